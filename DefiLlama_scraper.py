@@ -11,7 +11,7 @@ import json
 import argparse
 
 # Import data lineage
-from data_lineage import get_lineage_tracker, LineageContext
+from data_lineage import disable_lineage, get_lineage_tracker, LineageContext
 
 # Set up logging
 logging.basicConfig(
@@ -59,6 +59,7 @@ def enable_mock_mode():
     """Enable mock mode for testing without API calls"""
     global MOCK_MODE
     MOCK_MODE = True
+    disable_lineage()
     logger.info("Mock mode enabled - no real API calls will be made")
 
 def format_currency(value):
@@ -258,7 +259,7 @@ def fetch_tvl_data(limit=100):
             logger.info(f"Successfully fetched {len(data)} protocols from DeFi Llama")
             
             # Add metadata to the lineage
-            lineage.get_node(raw_data_id).metadata.update({
+            lineage.update_node_metadata(raw_data_id, {
                 "record_count": len(data),
                 "first_protocol": data[0]["name"] if data else None
             })
@@ -356,7 +357,7 @@ def fetch_market_data(symbols, api_key):
                     }
                     
             # Add metadata to the lineage
-            lineage.get_node(raw_data_id).metadata.update({
+            lineage.update_node_metadata(raw_data_id, {
                 "symbols_requested": len(symbols),
                 "symbols_found": len(result)
             })
@@ -436,7 +437,7 @@ def process_data(tvl_data, market_data):
             df = pd.DataFrame(processed_data)
             
             # Add metadata to the lineage
-            lineage.get_node(combined_data_id).metadata.update({
+            lineage.update_node_metadata(combined_data_id, {
                 "record_count": len(df),
                 "columns": df.columns.tolist()
             })
@@ -4,9 +4,7 @@ import numpy as np
 import os
 import argparse
 import logging
-from sklearn.metrics.pairwise import cosine_similarity
 from dotenv import load_dotenv
-import ast  # For converting string to list
 
 # Set up logging
 logging.basicConfig(
@@ -115,8 +113,19 @@ def retrieve_reddit_data(query, db_connection):
     
     # Extract embeddings and calculate similarity
     try:
-        embeddings = np.array([np.array(ast.literal_eval(row[3])) for row in rows])  # Convert string to list
-        similarities = cosine_similarity([query_embedding], embeddings)[0]
+        # Parse each '[x, y, ...]' string in C straight into one pre-allocated
+        # matrix: no per-row arrays to copy and no whole-table joined string
+        first = np.fromstring(rows[0][3].strip()[1:-1], sep=',', dtype=np.float32)
+        embeddings = np.empty((len(rows), len(first)), dtype=np.float32)
+        embeddings[0] = first
+        for i in range(1, len(rows)):
+            embeddings[i] = np.fromstring(rows[i][3].strip()[1:-1], sep=',', dtype=np.float32)
+        # The text column holds raw vectors; normalize the rows in place once
+        # so the dot product ranks them by cosine similarity
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        embeddings /= norms
+        similarities = embeddings @ np.asarray(query_embedding, dtype=np.float32)
         
         # Find the most similar post(s)
         most_similar_idx = similarities.argmax()  # Get index of highest similarity
@@ -3,6 +3,7 @@ import pandas as pd
 import os
 import openai
 import psycopg2
+import io
 import json
 import logging
 import sys
@@ -17,7 +18,11 @@ import requests
 import numpy as np
 
 # Import data lineage
-from data_lineage import get_lineage_tracker, LineageContext
+from data_lineage import disable_lineage, get_lineage_tracker, LineageContext
+
+# Embedding requests go through the shared batched, two-tier cache
+import embedding_utils
+from embedding_utils import unit_vector
 
 # Set up logging
 logging.basicConfig(
@@ -34,6 +39,7 @@ def enable_mock_mode():
     """Enable mock mode for testing without API calls"""
     global MOCK_MODE
     MOCK_MODE = True
+    disable_lineage()
     logger.info("Mock mode enabled - no real API calls will be made")
 
 class CustomRequestor(prawcore.Requestor):
@@ -187,14 +193,10 @@ def get_embedding(text):
             target_type="dataset",
             metadata={"model": "text-embedding-ada-002", "dimensions": 1536}
         ) as embedding_id:
-            response = openai.Embedding.create(
-                input=text,
-                model="text-embedding-ada-002"
-            )
-            embedding = response['data'][0]['embedding']
+            embedding = embedding_utils.get_embeddings([text])[0]
             
             # Add metadata to the lineage
-            lineage.get_node(embedding_id).metadata.update({
+            lineage.update_node_metadata(embedding_id, {
                 "vector_length": len(embedding),
                 "timestamp": datetime.now().isoformat()
             })
@@ -204,6 +206,46 @@ def get_embedding(text):
         logger.error(f"Error getting embedding: {e}")
         raise
 
+def get_embeddings(texts):
+    """Get OpenAI embeddings for several texts in as few API calls as possible.
+    
+    Texts seen before (in this run or an earlier one) are served from the
+    embedding cache; the rest are sent together in batched requests.
+    """
+    lineage = get_lineage_tracker()
+    source_id = lineage.add_node(
+        node_type="dataset",
+        name="Text Content",
+        description="Reddit post text content to be embedded",
+        metadata={"text_count": len(texts), "text_length": sum(len(text) for text in texts)}
+    )
+    
+    if MOCK_MODE:
+        logger.info("Using mock embeddings")
+        return [np.random.rand(1536).tolist() for _ in texts]
+    
+    try:
+        with LineageContext(
+            source_nodes=source_id,
+            operation="transform",
+            target_name="OpenAI Embeddings",
+            target_description="Texts embedded as vectors using OpenAI API",
+            target_type="dataset",
+            metadata={"model": "text-embedding-ada-002", "dimensions": 1536}
+        ) as embedding_id:
+            embeddings = embedding_utils.get_embeddings(texts)
+            
+            # Add metadata to the lineage
+            lineage.update_node_metadata(embedding_id, {
+                "vector_count": len(embeddings),
+                "timestamp": datetime.now().isoformat()
+            })
+            
+            return embeddings
+    except Exception as e:
+        logger.error(f"Error getting embeddings: {e}")
+        raise
+
 def fetch_recent_posts(subreddit, hours=24):
     """Fetch recent posts from subreddit within specified time window."""
     # Create a data lineage node for the Reddit API source
@@ -228,6 +270,7 @@ def fetch_recent_posts(subreddit, hours=24):
             metadata={"timestamp": datetime.now().isoformat()}
         ) as posts_id:
             post_count = 0
+            pending = []
             
             for post in subreddit.new(limit=100):
                 created_at = datetime.fromtimestamp(float(post.created_utc), tz=timezone.utc)
@@ -237,35 +280,22 @@ def fetch_recent_posts(subreddit, hours=24):
                     
                 if post.selftext:
                     logger.info(f"Processing post: {post.id}")
-                    embedding = get_embedding(post.selftext)
-                    posts.append([
-                        post.id, post.title, post.selftext, 
-                        post.score, post.num_comments, created_at, embedding
-                    ])
+                    pending.append((post, created_at))
                     post_count += 1
             
+            # Embed every post together instead of one API round trip per post
+            embeddings = get_embeddings([post.selftext for post, _ in pending]) if pending else []
+            for (post, created_at), embedding in zip(pending, embeddings):
+                posts.append([
+                    post.id, post.title, post.selftext, 
+                    post.score, post.num_comments, created_at, embedding
+                ])
+            
             # Update metadata with post count
-            node = lineage.get_node(posts_id)
-            if node and isinstance(node, dict):
-                # Ensure metadata exists and is a dictionary
-                if "metadata" not in node:
-                    node["metadata"] = {}
-                elif not isinstance(node["metadata"], dict):
-                    node["metadata"] = {}
-                
-                # Update metadata
-                node["metadata"].update({
-                    "post_count": post_count,
-                    "oldest_post": cutoff_time.isoformat()
-                })
-                
-                # Update the node in the database
-                lineage.cursor.execute("""
-                    UPDATE nodes 
-                    SET metadata = ? 
-                    WHERE id = ?
-                """, (json.dumps(node["metadata"]), posts_id))
-                lineage.conn.commit()
+            lineage.update_node_metadata(posts_id, {
+                "post_count": post_count,
+                "oldest_post": cutoff_time.isoformat()
+            })
             
             return posts
     except prawcore.exceptions.NotFound:
@@ -278,6 +308,50 @@ def fetch_recent_posts(subreddit, hours=24):
         logger.error(f"Failed to fetch posts: {e}")
         raise
 
+_EMBEDDING_COLUMNS = "post_id, title, text, score, num_comments, created_utc, embedding, embedding_vector"
+
+def _copy_field(value):
+    """Render one value in COPY text format."""
+    if value is None:
+        return "\\N"
+    return (str(value).replace("\\", "\\\\").replace("\t", "\\t")
+            .replace("\n", "\\n").replace("\r", "\\r"))
+
+def bulk_load_embeddings(cursor, records):
+    """Upsert Reddit post records with one COPY instead of INSERT statements.
+    
+    COPY cannot resolve conflicts itself, so the rows are streamed into a
+    temporary table and merged into reddit_embeddings with a single
+    INSERT ... SELECT ... ON CONFLICT.
+    
+    Args:
+        cursor: Cursor on a psycopg2 connection
+        records: Tuples in the order of _EMBEDDING_COLUMNS, vectors as '[...]' text
+    """
+    buffer = io.StringIO()
+    for record in records:
+        buffer.write("\t".join(_copy_field(value) for value in record))
+        buffer.write("\n")
+    buffer.seek(0)
+    
+    cursor.execute("""
+        CREATE TEMP TABLE reddit_embeddings_load
+        (LIKE reddit_embeddings INCLUDING DEFAULTS) ON COMMIT DROP
+    """)
+    cursor.copy_expert(f"COPY reddit_embeddings_load ({_EMBEDDING_COLUMNS}) FROM STDIN", buffer)
+    cursor.execute(f"""
+        INSERT INTO reddit_embeddings ({_EMBEDDING_COLUMNS})
+        SELECT DISTINCT ON (post_id) {_EMBEDDING_COLUMNS} FROM reddit_embeddings_load
+        ON CONFLICT (post_id) DO UPDATE SET
+            title = EXCLUDED.title,
+            text = EXCLUDED.text,
+            score = EXCLUDED.score,
+            num_comments = EXCLUDED.num_comments,
+            created_utc = EXCLUDED.created_utc,
+            embedding = EXCLUDED.embedding,
+            embedding_vector = EXCLUDED.embedding_vector
+    """)
+
 def insert_posts_to_db(posts, engine):
     """Insert posts into database with vector embeddings."""
     if not posts:
@@ -363,7 +437,7 @@ def insert_posts_to_db(posts, engine):
                 
                 if not has_vector_column:
                     logger.info("Adding embedding_vector column to reddit_embeddings table")
-                    cursor.execute("ALTER TABLE reddit_embeddings ADD COLUMN embedding_vector vector(1536)")
+                    cursor.execute("ALTER TABLE reddit_embeddings ADD COLUMN embedding_vector halfvec(1536)")
                 
                 # Create table if it doesn't exist
                 cursor.execute("""
@@ -375,42 +449,26 @@ def insert_posts_to_db(posts, engine):
                         num_comments INTEGER,
                         created_utc TIMESTAMP,
                         embedding TEXT,
-                        embedding_vector vector(1536)
+                        embedding_vector halfvec(1536)
                     )
                 """)
                 conn.commit()
                 
                 # PostgreSQL with vector support
-                insert_query = """
-                    INSERT INTO reddit_embeddings 
-                        (post_id, title, text, score, num_comments, created_utc, embedding, embedding_vector)
-                    VALUES %s
-                    ON CONFLICT (post_id) DO UPDATE SET
-                        title = EXCLUDED.title,
-                        text = EXCLUDED.text,
-                        score = EXCLUDED.score,
-                        num_comments = EXCLUDED.num_comments,
-                        created_utc = EXCLUDED.created_utc,
-                        embedding = EXCLUDED.embedding,
-                        embedding_vector = EXCLUDED.embedding_vector
-                """
-                
                 records = [
                     (row.post_id, row.title, row.text, row.score, 
                      row.num_comments, row.created_utc, 
                      f"[{','.join(map(str, row.embedding))}]",
-                     f"[{','.join(map(str, row.embedding))}]")
+                     f"[{','.join(map(str, unit_vector(row.embedding)))}]")
                     for row in df.itertuples(index=False)
                 ]
                 
-                execute_values(cursor, insert_query, records, template="""
-                    (%s, %s, %s, %s, %s, %s, %s, %s::vector)
-                """)
+                bulk_load_embeddings(cursor, records)
             
             conn.commit()
             
             # Add metadata to the lineage
-            lineage.get_node(db_id).metadata.update({
+            lineage.update_node_metadata(db_id, {
                 "records_inserted": len(posts)
             })
             
@@ -1,9 +1,16 @@
 import os
 import json
 import datetime
-import uuid
 import logging
+import math
 import sqlite3
+import threading
+import queue
+import atexit
+import itertools
+import weakref
+import functools
+import contextlib
 from dataclasses import dataclass, asdict
 from typing import Dict, List, Optional, Any, Union
 
@@ -14,6 +21,220 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# orjson is an optional, much faster drop-in for metadata (de)serialization;
+# metadata stays JSON text either way so SQLite's JSON functions can read it
+try:
+    import orjson
+    
+    def _dumps(obj) -> str:
+        return orjson.dumps(obj, default=str, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY).decode()
+    
+    _loads = orjson.loads
+except ImportError:
+    def _finite(obj):
+        """Replace NaN and infinities with None, as orjson does."""
+        if isinstance(obj, float):
+            return obj if math.isfinite(obj) else None
+        if isinstance(obj, dict):
+            return {key: _finite(value) for key, value in obj.items()}
+        if isinstance(obj, (list, tuple)):
+            return [_finite(value) for value in obj]
+        return obj
+    
+    def _dumps(obj) -> str:
+        # Values JSON has no type for (Decimal prices, NumPy scalars) are
+        # stored as their string form rather than failing the caller's write.
+        # Bare NaN/Infinity are not JSON and SQLite's JSON1 rejects them, so
+        # they become null; the copy is only made when one is present.
+        try:
+            return json.dumps(obj, default=str, allow_nan=False)
+        except ValueError:
+            return json.dumps(_finite(obj), default=str, allow_nan=False)
+    
+    _loads = json.loads
+
+# Lineage ids only need to be unique, so they are a per-process random
+# nonce followed by a counter: no syscall per id, and ids from one process
+# sort in insertion order, which keeps primary key B-tree inserts appending
+_ID_NONCE = os.urandom(8).hex()
+_id_counter = itertools.count()
+
+def _reseed_ids():
+    """Give this process its own id nonce and counter."""
+    global _ID_NONCE, _id_counter
+    _ID_NONCE = os.urandom(8).hex()
+    _id_counter = itertools.count()
+
+# A forked worker inherits both, and would otherwise repeat its parent's ids
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reseed_ids)
+
+def _new_id() -> str:
+    """Return a unique 32-character hex id."""
+    return f"{_ID_NONCE}{next(_id_counter):016x}"
+
+def _now() -> str:
+    """Return the current time as an ISO 8601 string."""
+    return datetime.datetime.now().isoformat()
+
+def _encode_metadata(metadata) -> str:
+    """Serialize metadata, storing anything that is not a dict as an empty object."""
+    return _dumps(metadata) if isinstance(metadata, dict) else "{}"
+
+# Applied to every connection: WAL lets readers and the writer thread work
+# concurrently, and NORMAL sync only fsyncs the WAL at checkpoints
+_CONNECTION_PRAGMAS = """
+    PRAGMA journal_mode=WAL;
+    PRAGMA synchronous=NORMAL;
+    PRAGMA temp_store=MEMORY;
+    PRAGMA cache_size=-65536;
+    PRAGMA busy_timeout=5000;
+"""
+
+# Bumped whenever _init_db gains a migration step
+_SCHEMA_VERSION = 6
+
+# Statements are module constants so every call site passes the identical
+# string and hits sqlite3's per-connection prepared statement cache
+_STATEMENT_CACHE_SIZE = 512
+
+_INSERT_NODE_SQL = """
+    INSERT INTO nodes (id, node_type, name, description, metadata, created_at)
+    VALUES (?, ?, ?, ?, ?, ?)
+"""
+
+# Duplicate (source, target, operation) edges are dropped by the unique
+# index, so re-running a pipeline step does not duplicate its lineage
+_INSERT_EDGE_SQL = """
+    INSERT OR IGNORE INTO edges (id, source_id, target_id, operation, metadata, timestamp)
+    VALUES (?, ?, ?, ?, ?, ?)
+"""
+
+# RETURNING (SQLite 3.35+) yields the stored edge's id in the same
+# statement; the no-op update on conflict makes it return the existing id
+_HAVE_RETURNING = sqlite3.sqlite_version_info >= (3, 35, 0)
+
+_UPSERT_EDGE_RETURNING_SQL = """
+    INSERT INTO edges (id, source_id, target_id, operation, metadata, timestamp)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT (source_id, target_id, operation) DO UPDATE SET id = id
+    RETURNING id
+"""
+
+# json_patch merges the update into the stored object inside SQLite, so an
+# update is a queued write with no read-modify-write round trip
+_UPDATE_NODE_METADATA_SQL = """
+    UPDATE nodes 
+    SET metadata = json_set(metadata, ?, json(?)) 
+    WHERE id = ?
+"""
+
+# Metadata is stored as JSON text, so json() splices it into the export
+# without a decode/encode round trip through Python
+_EXPORT_NODES_SQL = """
+    SELECT json_object(
+        'id', id,
+        'node_type', node_type,
+        'name', name,
+        'description', description,
+        'metadata', json(metadata),
+        'created_at', created_at
+    )
+    FROM nodes
+"""
+
+_EXPORT_EDGES_SQL = """
+    SELECT json_object(
+        'id', id,
+        'source_id', source_id,
+        'target_id', target_id,
+        'operation', operation,
+        'metadata', json(metadata),
+        'timestamp', timestamp
+    )
+    FROM edges
+"""
+
+# Static vis.js page for .html visualizations, in the three parts the node
+# and edge arrays are streamed between, so no graph library is involved
+_HTML_HEAD = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>Data Lineage</title>
+<script src="https://unpkg.com/vis-network/standalone/umd/vis-network.min.js"></script>
+<style>html, body, #lineage { width: 100%; height: 100%; margin: 0; }</style>
+</head>
+<body>
+<div id="lineage"></div>
+<script>
+var nodes = new vis.DataSet("""
+
+_HTML_MIDDLE = """);
+var edges = new vis.DataSet("""
+
+_HTML_TAIL = """);
+new vis.Network(document.getElementById("lineage"), {nodes: nodes, edges: edges}, {
+    edges: {arrows: "to", font: {align: "middle"}},
+    layout: {hierarchical: {direction: "LR", sortMethod: "directed"}},
+    physics: false
+});
+</script>
+</body>
+</html>
+"""
+
+# "</" is escaped so a name or description cannot close the script tag
+_HTML_NODES_SQL = r"""
+    SELECT replace(json_object('id', id, 'label', name, 'title', description, 'group', node_type), '</', '<\/')
+    FROM nodes
+"""
+
+_HTML_EDGES_SQL = r"""
+    SELECT replace(json_object('from', source_id, 'to', target_id, 'label', operation), '</', '<\/')
+    FROM edges
+"""
+
+# Each edge label is a separate matplotlib text artist, which dominates
+# drawing time on large graphs and is unreadable there anyway
+_MAX_DRAWN_EDGE_LABELS = 500
+
+def _draw_lineage_graph(nodes, edges, output_file):
+    """Draw the lineage graph to output_file.
+    
+    Args:
+        nodes: Iterable of (id, name, node_type) tuples
+        edges: Iterable of (source_id, target_id, operation) tuples
+        output_file: Path of the image to write
+    """
+    import networkx as nx
+    import matplotlib.pyplot as plt
+    
+    # Build the graph with one bulk call for nodes and one for edges
+    G = nx.DiGraph()
+    G.add_nodes_from(
+        (node_id, {"label": name, "type": node_type})
+        for node_id, name, node_type in nodes
+    )
+    G.add_edges_from(
+        (source_id, target_id, {"label": operation})
+        for source_id, target_id, operation in edges
+    )
+    
+    # Draw the graph
+    plt.figure(figsize=(12, 8))
+    pos = nx.spring_layout(G)
+    nx.draw(G, pos, with_labels=True, node_color='lightblue', 
+           node_size=2000, font_size=10, font_weight='bold')
+    if G.number_of_edges() <= _MAX_DRAWN_EDGE_LABELS:
+        edge_labels = nx.get_edge_attributes(G, 'label')
+        nx.draw_networkx_edge_labels(G, pos, edge_labels=edge_labels)
+    else:
+        logger.info(f"Skipping edge labels for {G.number_of_edges()} edges")
+    
+    plt.savefig(output_file)
+    plt.close()
+
 @dataclass
 class DataNode:
     """Represents a data entity in the lineage graph."""
@@ -34,192 +255,885 @@ class DataEdge:
     timestamp: str
     metadata: Dict[str, Any]
 
+# Open trackers with a writer thread. The writers are daemon threads, so one
+# exit hook drains them all; a weak set lets closed trackers be collected
+_async_trackers = weakref.WeakSet()
+
+def _flush_async_trackers():
+    """Commit the queued writes of every open tracker before the process exits."""
+    for tracker in list(_async_trackers):
+        tracker.flush()
+
+atexit.register(_flush_async_trackers)
+
 class DataLineage:
-    """Tracks and manages data lineage information."""
+    """Tracks and manages data lineage information.
     
-    def __init__(self, db_path: str = "lineage.db"):
+    Writes use a single write connection, matching SQLite's single-writer
+    model, while reads check out one of up to read_pool_size read-only
+    connections, which WAL lets run alongside the writer. By default all
+    writes go through a queue drained by a background writer thread, so
+    callers never block on SQLite commits; with async_writes=False each
+    write is committed before the call returns. Reads flush the queue first
+    so they see every write made before them. Call close() to release the
+    connections.
+    """
+    
+    def __init__(self, db_path: str = "lineage.db", batch_size: int = 1000,
+                 async_writes: bool = True, max_pending: int = 100_000,
+                 read_pool_size: int = 4):
         """Initialize the data lineage tracker.
         
         Args:
             db_path: Path to SQLite database file for storing lineage
+            batch_size: Maximum number of queued writes committed together
+            async_writes: Commit writes on a background thread instead of
+                in the calling thread
+            max_pending: Maximum number of queued writes before callers
+                block, bounding memory when writes outpace the disk
+            read_pool_size: Maximum number of concurrent read connections
         """
         self.db_path = db_path
+        self.batch_size = batch_size
+        self.async_writes = async_writes
+        self.read_pool_size = read_pool_size
+        self._write_conn = None
+        self._read_pool = queue.LifoQueue()
+        self._read_conn_count = 0
+        self._pool_lock = threading.Lock()
+        self._connections = []
+        self._closed = False
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._write_lock = threading.Lock()
+        # Bumped on every queued write; with the row counts it fingerprints
+        # the graph so unchanged outputs are not regenerated
+        self._generation = 0
+        self._snapshots = {}
         try:
             self._init_db()
         except Exception as e:
             logger.error(f"Error initializing lineage database: {e}")
             # Use in-memory database as fallback
             self.db_path = ":memory:"
+            self._write_conn = None
             try:
                 self._init_db()
                 logger.info("Using in-memory database as fallback")
             except Exception as e2:
                 logger.error(f"Failed to initialize in-memory database: {e2}")
+        
+        self.writer_thread = None
+        if async_writes:
+            self.writer_thread = threading.Thread(
+                target=self._writer_loop,
+                name="lineage-writer",
+                daemon=True
+            )
+            self.writer_thread.start()
+            _async_trackers.add(self)
+    
+    def _connect(self):
+        """Open a new SQLite connection to the lineage database."""
+        if self.db_path == ":memory:":
+            # Every ":memory:" connection is a separate database, so threads
+            # share a named in-memory database instead
+            conn = sqlite3.connect(
+                f"file:lineage_{id(self)}?mode=memory&cache=shared",
+                uri=True,
+                check_same_thread=False,
+                isolation_level=None,
+                cached_statements=_STATEMENT_CACHE_SIZE
+            )
+        else:
+            conn = sqlite3.connect(
+                self.db_path,
+                check_same_thread=False,
+                isolation_level=None,
+                cached_statements=_STATEMENT_CACHE_SIZE
+            )
+        
+        conn.executescript(_CONNECTION_PRAGMAS)
+        self._connections.append(conn)
+        return conn
+    
+    def _get_write_conn(self):
+        """Get the single write connection, opening it on first use."""
+        if self._write_conn is None:
+            self._write_conn = self._connect()
+        return self._write_conn
+    
+    @contextlib.contextmanager
+    def _read_conn(self):
+        """Check out a pooled read connection for the duration of the block.
+        
+        Connections are opened lazily up to read_pool_size; beyond that,
+        readers wait for one to be returned.
+        """
+        try:
+            conn = self._read_pool.get_nowait()
+        except queue.Empty:
+            with self._pool_lock:
+                can_open = self._read_conn_count < self.read_pool_size
+                if can_open:
+                    self._read_conn_count += 1
+            if can_open:
+                conn = self._connect()
+                conn.execute("PRAGMA query_only=1")
+            else:
+                conn = self._read_pool.get()
+        try:
+            yield conn
+        finally:
+            self._read_pool.put(conn)
     
     def _init_db(self):
-        """Initialize SQLite database with proper SQLite syntax."""
+        """Initialize SQLite database with proper SQLite syntax.
+        
+        The schema version is kept in PRAGMA user_version, so an
+        up-to-date database costs a single pragma read and no DDL.
+        Migrations run in one transaction, so a failed step leaves the
+        database at its previous version.
+        """
+        conn = self._get_write_conn()
         try:
-            self.conn = sqlite3.connect(self.db_path)
-            self.cursor = self.conn.cursor()
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            if version >= _SCHEMA_VERSION:
+                return
             
-            # Create nodes table with SQLite syntax
-            self.cursor.execute("""
-                CREATE TABLE IF NOT EXISTS nodes (
-                    id TEXT PRIMARY KEY,
-                    node_type TEXT,
-                    name TEXT,
-                    description TEXT,
-                    metadata TEXT
-                )
-            """)
+            conn.execute("BEGIN IMMEDIATE")
+            # Another process may have migrated while we waited for the lock
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            cursor = conn.cursor()
             
-            # Create edges table with SQLite syntax
-            self.cursor.execute("""
-                CREATE TABLE IF NOT EXISTS edges (
-                    id TEXT PRIMARY KEY,
-                    source_id TEXT,
-                    target_id TEXT,
-                    operation TEXT,
-                    metadata TEXT,
-                    FOREIGN KEY (source_id) REFERENCES nodes (id),
-                    FOREIGN KEY (target_id) REFERENCES nodes (id)
-                )
-            """)
+            if version < 1:
+                # Create nodes table with SQLite syntax
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS nodes (
+                        id TEXT PRIMARY KEY,
+                        node_type TEXT,
+                        name TEXT,
+                        description TEXT,
+                        metadata TEXT
+                    )
+                """)
+                
+                # Create edges table with SQLite syntax
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS edges (
+                        id TEXT PRIMARY KEY,
+                        source_id TEXT,
+                        target_id TEXT,
+                        operation TEXT,
+                        metadata TEXT,
+                        FOREIGN KEY (source_id) REFERENCES nodes (id),
+                        FOREIGN KEY (target_id) REFERENCES nodes (id)
+                    )
+                """)
+            
+            if version < 2:
+                # Per-node edge lookups would otherwise scan the whole table
+                cursor.execute("CREATE INDEX IF NOT EXISTS idx_edges_source ON edges (source_id)")
+                cursor.execute("CREATE INDEX IF NOT EXISTS idx_edges_target ON edges (target_id)")
+            
+            if version < 3:
+                # Keep the first copy of each duplicate edge so the unique
+                # index can be built; its leading column replaces idx_edges_source
+                cursor.execute("""
+                    DELETE FROM edges
+                    WHERE rowid NOT IN (
+                        SELECT MIN(rowid) FROM edges
+                        GROUP BY source_id, target_id, operation
+                    )
+                """)
+                cursor.execute("""
+                    CREATE UNIQUE INDEX IF NOT EXISTS idx_edges_unique
+                    ON edges (source_id, target_id, operation)
+                """)
+                cursor.execute("DROP INDEX IF EXISTS idx_edges_source")
             
-            self.conn.commit()
+            if version < 4:
+                # Rows written before this migration keep a NULL timestamp
+                cursor.execute("ALTER TABLE nodes ADD COLUMN created_at TEXT")
+                cursor.execute("ALTER TABLE edges ADD COLUMN timestamp TEXT")
+            
+            if version < 5:
+                # Writers only ever store JSON objects, so repairing legacy
+                # rows once lets every read path decode metadata unguarded
+                for table in ("nodes", "edges"):
+                    cursor.execute(f"""
+                        UPDATE {table} SET metadata = '{{}}'
+                        WHERE metadata IS NULL OR json_valid(metadata) = 0
+                    """)
+            
+            if version < 6:
+                # A TEXT primary key on a rowid table is a second B-tree next
+                # to the table itself; WITHOUT ROWID keeps rows in the key's
+                # B-tree, and the monotonic ids append to it in order
+                cursor.execute("""
+                    CREATE TABLE nodes_new (
+                        id TEXT PRIMARY KEY,
+                        node_type TEXT,
+                        name TEXT,
+                        description TEXT,
+                        metadata TEXT,
+                        created_at TEXT
+                    ) WITHOUT ROWID
+                """)
+                cursor.execute("""
+                    INSERT INTO nodes_new (id, node_type, name, description, metadata, created_at)
+                    SELECT id, node_type, name, description, metadata, created_at
+                    FROM nodes WHERE id IS NOT NULL
+                """)
+                cursor.execute("DROP TABLE nodes")
+                cursor.execute("ALTER TABLE nodes_new RENAME TO nodes")
+                
+                cursor.execute("""
+                    CREATE TABLE edges_new (
+                        id TEXT PRIMARY KEY,
+                        source_id TEXT,
+                        target_id TEXT,
+                        operation TEXT,
+                        metadata TEXT,
+                        timestamp TEXT,
+                        FOREIGN KEY (source_id) REFERENCES nodes (id),
+                        FOREIGN KEY (target_id) REFERENCES nodes (id)
+                    ) WITHOUT ROWID
+                """)
+                cursor.execute("""
+                    INSERT INTO edges_new (id, source_id, target_id, operation, metadata, timestamp)
+                    SELECT id, source_id, target_id, operation, metadata, timestamp
+                    FROM edges WHERE id IS NOT NULL
+                """)
+                cursor.execute("DROP TABLE edges")
+                cursor.execute("ALTER TABLE edges_new RENAME TO edges")
+                cursor.execute("CREATE INDEX idx_edges_target ON edges (target_id)")
+                cursor.execute("""
+                    CREATE UNIQUE INDEX idx_edges_unique
+                    ON edges (source_id, target_id, operation)
+                """)
+            
+            cursor.execute(f"PRAGMA user_version = {_SCHEMA_VERSION}")
+            conn.execute("COMMIT")
         except sqlite3.Error as e:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
             logger.error(f"Error initializing database: {e}")
             raise
     
-    def add_node(self, node_type, name, description, metadata=None):
-        """Add a node to the lineage graph with SQLite syntax."""
-        try:
-            node_id = str(uuid.uuid4())
-            # Ensure metadata is always a dictionary
-            if metadata is None:
-                metadata = {}
-            elif not isinstance(metadata, dict):
-                metadata = {}
-            
-            metadata_json = json.dumps(metadata)
+    def _writer_loop(self):
+        """Drain the write queue, committing up to batch_size writes at a time.
+        
+        A None item is the shutdown sentinel queued by close().
+        """
+        conn = self._get_write_conn()
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size and batch[-1] is not None:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
             
-            self.cursor.execute("""
-                INSERT INTO nodes (id, node_type, name, description, metadata)
-                VALUES (?, ?, ?, ?, ?)
-            """, (node_id, node_type, name, description, metadata_json))
+            stop = batch[-1] is None
+            writes = batch[:-1] if stop else batch
+            try:
+                if writes:
+                    self._write_batch(conn, writes)
+            except Exception as e:
+                # The writer must outlive any bad write: flush() and get_node()
+                # wait on the queue, which only this thread drains
+                logger.error("Lineage writer failed on a batch of %d records: %s", len(writes), e)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
             
-            self.conn.commit()
-            logger.info(f"Added node: {name} ({node_type})")
-            return node_id
+            if stop:
+                return
+    
+    def _write_batch(self, conn, batch):
+        """Commit a batch of queued writes in a single transaction.
+        
+        If the batch fails, it is rolled back and written again one row at
+        a time, so only the rows that fail are discarded.
+        """
+        try:
+            # Take the write lock up front rather than upgrading mid-batch
+            conn.execute("BEGIN IMMEDIATE")
+            # Consecutive writes of the same statement go through a single
+            # executemany; grouping only adjacent items preserves ordering
+            for sql, group in itertools.groupby(batch, key=lambda item: item[0]):
+                # executemany takes any iterable, so the queued row lists are
+                # chained rather than copied into one flat list
+                row_lists = [rows for _, rows in group]
+                cursor = conn.executemany(sql, itertools.chain.from_iterable(row_lists))
+                if sql is _INSERT_EDGE_SQL:
+                    skipped = sum(map(len, row_lists)) - cursor.rowcount
+                    if skipped:
+                        # Per-write log lines are DEBUG with lazy %-formatting,
+                        # like the ones in add_node and add_edge
+                        logger.debug("Skipped %d edges that already exist", skipped)
+            conn.execute("COMMIT")
+        except Exception as e:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            logger.error("Error writing lineage batch of %d records, retrying row by row: %s", len(batch), e)
+            self._write_rows(conn, batch)
+    
+    def _write_rows(self, conn, batch):
+        """Write a batch one row per statement, discarding only the rows that fail.
+        
+        A failed statement in SQLite undoes just that statement, so the
+        rows around it still commit in the same transaction.
+        """
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for sql, rows in batch:
+                for row in rows:
+                    try:
+                        conn.execute(sql, row)
+                    except Exception as e:
+                        logger.error("Discarding lineage write %r: %s", row, e)
+            conn.execute("COMMIT")
         except sqlite3.Error as e:
-            logger.error(f"Error adding node: {e}")
-            raise
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            logger.error("Error writing lineage batch of %d records: %s", len(batch), e)
+    
+    def _enqueue(self, sql, params):
+        """Queue a write for the background writer thread."""
+        self._enqueue_many(sql, [params])
+    
+    def _enqueue_many(self, sql, rows):
+        """Queue several rows for one statement; they are committed together."""
+        if self._closed:
+            raise sqlite3.ProgrammingError("Cannot write to a closed lineage tracker")
+        self._generation += 1
+        if self.async_writes:
+            self._queue.put((sql, rows))
+        else:
+            with self._write_lock:
+                self._write_batch(self._get_write_conn(), [(sql, rows)])
+    
+    def flush(self):
+        """Block until every queued write has been committed."""
+        self._queue.join()
+    
+    def close(self):
+        """Commit pending writes, stop the writer thread and close all connections."""
+        if self._closed:
+            return
+        self._closed = True
+        _async_trackers.discard(self)
+        if self.writer_thread is not None:
+            self._queue.put(None)
+            self.writer_thread.join()
+        
+        for conn in self._connections:
+            conn.close()
+        self._connections = []
+        self._write_conn = None
+        self._read_pool = queue.LifoQueue()
+        self._read_conn_count = 0
+    
+    def add_node(self, node_type, name, description, metadata=None):
+        """Add a node to the lineage graph with SQLite syntax."""
+        return self._add_node(node_type, name, description, _encode_metadata(metadata))
+    
+    def _add_node(self, node_type, name, description, metadata_json):
+        """Queue a node whose metadata is already serialized."""
+        node_id = _new_id()
+        self._enqueue(_INSERT_NODE_SQL, (node_id, node_type, name, description, metadata_json, _now()))
+        
+        # Per-write log lines are DEBUG with lazy %-formatting: lineage writes
+        # sit on every request's hot path, and an INFO record per node cost
+        # more than the queued write itself
+        logger.debug("Added node: %s (%s)", name, node_type)
+        return node_id
+    
+    def add_nodes_bulk(self, nodes):
+        """Add many nodes in a single transaction.
+        
+        Args:
+            nodes: Iterable of dicts with node_type and name keys, and
+                optional description and metadata keys; it is consumed once,
+                so a generator works
+            
+        Returns:
+            List of node IDs, in the same order as nodes
+        """
+        # One timestamp for the whole batch, as it is committed together
+        created_at = _now()
+        rows = [
+            (_new_id(), node["node_type"], node["name"], node.get("description", ""),
+             _encode_metadata(node.get("metadata")), created_at)
+            for node in nodes
+        ]
+        self._enqueue_many(_INSERT_NODE_SQL, rows)
+        
+        logger.debug("Added %d nodes", len(rows))
+        return [row[0] for row in rows]
     
     def add_edge(self, source_id, target_id, operation, metadata=None):
-        """Add an edge to the lineage graph with SQLite syntax."""
-        try:
-            edge_id = str(uuid.uuid4())
-            metadata_json = json.dumps(metadata) if metadata else "{}"
+        """Add an edge to the lineage graph with SQLite syntax.
+        
+        An edge with the same source, target and operation as an existing
+        one is ignored. With async_writes=False the ID of the existing edge
+        is returned; with queued writes the returned ID is never stored.
+        """
+        edge = (_new_id(), source_id, target_id, operation, _encode_metadata(metadata), _now())
+        if self.async_writes or not _HAVE_RETURNING:
+            self._enqueue(_INSERT_EDGE_SQL, edge)
+            edge_id = edge[0]
+        else:
+            edge_id = self._upsert_edge(edge)
+        
+        logger.debug("Added edge: %s from %s to %s", operation, source_id, target_id)
+        return edge_id
+    
+    def _upsert_edge(self, edge):
+        """Insert an edge synchronously and return the ID actually stored."""
+        if self._closed:
+            raise sqlite3.ProgrammingError("Cannot write to a closed lineage tracker")
+        self._generation += 1
+        with self._write_lock:
+            conn = self._get_write_conn()
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                edge_id = conn.execute(_UPSERT_EDGE_RETURNING_SQL, edge).fetchone()[0]
+                conn.execute("COMMIT")
+            except sqlite3.Error as e:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                logger.error("Error writing lineage edge: %s", e)
+                return edge[0]
+        
+        if edge_id != edge[0]:
+            logger.debug("Edge already exists: %s", edge_id)
+        return edge_id
+    
+    def add_edges(self, source_ids, target_id, operation, metadata=None):
+        """Add edges from several sources to one target in a single write.
+        
+        Args:
+            source_ids: IDs of the source nodes
+            target_id: ID of the shared target node
+            operation: Operation linking each source to the target
+            metadata: Metadata shared by every edge
             
-            self.cursor.execute("""
-                INSERT INTO edges (id, source_id, target_id, operation, metadata)
-                VALUES (?, ?, ?, ?, ?)
-            """, (edge_id, source_id, target_id, operation, metadata_json))
+        Returns:
+            List of edge IDs, in the same order as source_ids
+        """
+        return self._add_edges(source_ids, target_id, operation, _encode_metadata(metadata))
+    
+    def _add_edges(self, source_ids, target_id, operation, metadata_json):
+        """Queue fan-in edges whose shared metadata is already serialized."""
+        edge_ids = [_new_id() for _ in source_ids]
+        timestamp = _now()
+        
+        self._enqueue_many(_INSERT_EDGE_SQL, [
+            (edge_id, source_id, target_id, operation, metadata_json, timestamp)
+            for edge_id, source_id in zip(edge_ids, source_ids)
+        ])
+        
+        logger.debug("Added %d %s edges to %s", len(edge_ids), operation, target_id)
+        return edge_ids
+    
+    def add_edges_bulk(self, edges):
+        """Add many edges in a single transaction.
+        
+        Args:
+            edges: Iterable of dicts with source_id, target_id and operation
+                keys, and an optional metadata key; it is consumed once
             
-            self.conn.commit()
-            logger.info(f"Added edge: {operation} from {source_id} to {target_id}")
-            return edge_id
-        except sqlite3.Error as e:
-            logger.error(f"Error adding edge: {e}")
-            raise
+        Returns:
+            List of edge IDs, in the same order as edges
+        """
+        timestamp = _now()
+        rows = [
+            (_new_id(), edge["source_id"], edge["target_id"], edge["operation"],
+             _encode_metadata(edge.get("metadata")), timestamp)
+            for edge in edges
+        ]
+        self._enqueue_many(_INSERT_EDGE_SQL, rows)
+        
+        logger.debug("Added %d edges", len(rows))
+        return [row[0] for row in rows]
+    
+    def update_node_metadata(self, node_id, updates):
+        """Merge updates into a stored node's metadata.
+        
+        The update is queued like any other write, so callers never wait
+        for a flush. Each key is written with json_set, which matches
+        dict.update: values replace whole, and None is stored as null.
+        """
+        if not isinstance(updates, dict) or not updates:
+            return
+        self._enqueue_many(_UPDATE_NODE_METADATA_SQL, [
+            ('$."%s"' % key, _dumps(value), node_id) for key, value in updates.items()
+        ])
     
     def get_node(self, node_id):
         """Get a node from the lineage graph with SQLite syntax."""
+        self.flush()
         try:
-            self.cursor.execute("""
-                SELECT id, node_type, name, description, metadata
-                FROM nodes
-                WHERE id = ?
-            """, (node_id,))
+            with self._read_conn() as conn:
+                row = conn.execute("""
+                    SELECT id, node_type, name, description, metadata, created_at
+                    FROM nodes
+                    WHERE id = ?
+                """, (node_id,)).fetchone()
             
-            row = self.cursor.fetchone()
-            if row:
-                try:
-                    metadata = json.loads(row[4]) if row[4] else {}
-                except (json.JSONDecodeError, TypeError):
-                    metadata = {}
-                
-                if not isinstance(metadata, dict):
-                    metadata = {}
-                
-                return DataNode(
-                    node_id=row[0],
-                    node_type=row[1],
-                    name=row[2],
-                    description=row[3],
-                    created_at=datetime.datetime.now().isoformat(),
-                    metadata=metadata
-                )
-            return None
+            if row is None:
+                return None
+            
+            node_id, node_type, name, description, metadata, created_at = row
+            # Writers always store a JSON object and migration 5 repaired
+            # legacy rows, so no validation here
+            return DataNode(
+                node_id=node_id,
+                node_type=node_type,
+                name=name,
+                description=description,
+                created_at=created_at,
+                metadata=_loads(metadata)
+            )
         except sqlite3.Error as e:
             logger.error(f"Error getting node: {e}")
             raise
     
-    def get_edges(self, node_id):
-        """Get edges connected to a node with SQLite syntax."""
-        try:
-            self.cursor.execute("""
-                SELECT id, source_id, target_id, operation, metadata
+    def _iter_edges(self, where_sql, params):
+        """Yield raw edge rows matching where_sql, without decoding metadata.
+        
+        Rows are (id, source_id, target_id, operation, metadata, timestamp)
+        tuples straight from the cursor, for callers that never need dicts.
+        The read connection is held until the generator is exhausted.
+        """
+        self.flush()
+        with self._read_conn() as conn:
+            yield from conn.execute(f"""
+                SELECT id, source_id, target_id, operation, metadata, timestamp
                 FROM edges
-                WHERE source_id = ? OR target_id = ?
-            """, (node_id, node_id))
-            
-            edges = []
-            for row in self.cursor.fetchall():
-                metadata = json.loads(row[4]) if row[4] else {}
-                edges.append({
-                    "id": row[0],
-                    "source_id": row[1],
-                    "target_id": row[2],
-                    "operation": row[3],
-                    "metadata": metadata
-                })
-            return edges
+                WHERE {where_sql}
+            """, params)
+    
+    def _edge_dicts(self, where_sql, params, description):
+        """Return decoded edges matching where_sql as a list of dicts."""
+        try:
+            return [
+                {
+                    "id": edge_id,
+                    "source_id": source_id,
+                    "target_id": target_id,
+                    "operation": operation,
+                    "metadata": _loads(metadata),
+                    "timestamp": timestamp
+                }
+                for edge_id, source_id, target_id, operation, metadata, timestamp
+                in self._iter_edges(where_sql, params)
+            ]
         except sqlite3.Error as e:
-            logger.error(f"Error getting edges: {e}")
+            logger.error(f"Error getting {description}: {e}")
             raise
     
+    def get_edges(self, node_id):
+        """Get edges connected to a node with SQLite syntax."""
+        return self._edge_dicts("source_id = ? OR target_id = ?", (node_id, node_id), "edges")
+    
+    def get_outgoing_edges(self, node_id):
+        """Get edges whose source is the given node."""
+        return self._edge_dicts("source_id = ?", (node_id,), "outgoing edges")
+    
+    def get_incoming_edges(self, node_id):
+        """Get edges whose target is the given node."""
+        return self._edge_dicts("target_id = ?", (node_id,), "incoming edges")
+    
+    def _graph_snapshot(self):
+        """Return a cheap fingerprint of the current graph contents."""
+        with self._read_conn() as conn:
+            row = conn.execute("""
+                SELECT
+                    (SELECT COUNT(*) FROM nodes),
+                    (SELECT MAX(created_at) FROM nodes),
+                    (SELECT COUNT(*) FROM edges),
+                    (SELECT MAX(timestamp) FROM edges)
+            """).fetchone()
+        return (self._generation,) + tuple(row)
+    
+    def _is_up_to_date(self, output_file, snapshot):
+        """Check whether output_file was already generated from this snapshot."""
+        if snapshot[1] == 0:
+            logger.info(f"Lineage graph is empty, skipping {output_file}")
+            return True
+        if self._snapshots.get(output_file) == snapshot and os.path.exists(output_file):
+            logger.info(f"Lineage graph unchanged, keeping existing {output_file}")
+            return True
+        return False
+    
     def visualize(self, output_file: str = "data_lineage.html"):
-        """Generate a visualization of the data lineage graph."""
+        """Generate a visualization of the data lineage graph.
+        
+        .html outputs are an interactive vis.js page; any other extension
+        is drawn with networkx and matplotlib.
+        """
+        self.flush()
         try:
-            import networkx as nx
-            import matplotlib.pyplot as plt
+            snapshot = self._graph_snapshot()
+            if self._is_up_to_date(output_file, snapshot):
+                return
             
-            G = nx.DiGraph()
+            with self._read_conn() as conn:
+                if output_file.endswith(".html"):
+                    # vis.js items are rendered by SQLite and streamed into the page
+                    with open(output_file, 'w') as f:
+                        f.write(_HTML_HEAD + "[")
+                        self._write_json_rows(f, conn.execute(_HTML_NODES_SQL))
+                        f.write("]" + _HTML_MIDDLE + "[")
+                        self._write_json_rows(f, conn.execute(_HTML_EDGES_SQL))
+                        f.write("]" + _HTML_TAIL)
+                else:
+                    _draw_lineage_graph(
+                        conn.execute("SELECT id, name, node_type FROM nodes"),
+                        conn.execute("SELECT source_id, target_id, operation FROM edges"),
+                        output_file
+                    )
+            self._snapshots[output_file] = snapshot
             
-            # Add nodes
-            self.cursor.execute("SELECT id, name, node_type FROM nodes")
-            for row in self.cursor.fetchall():
-                G.add_node(row[0], label=row[1], type=row[2])
+            logger.info(f"Data lineage visualization saved to {output_file}")
             
-            # Add edges
-            self.cursor.execute("SELECT source_id, target_id, operation FROM edges")
-            for row in self.cursor.fetchall():
-                G.add_edge(row[0], row[1], label=row[2])
+        except Exception as e:
+            logger.error(f"Error generating visualization: {e}")
+            raise
+    
+    @staticmethod
+    def _write_json_rows(f, cursor, chunk_size=1000):
+        """Write single-column JSON rows from cursor as comma-separated array items."""
+        separator = ""
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            f.write(separator)
+            f.write(",".join(row[0] for row in rows))
+            separator = ","
+    
+    def export_json(self, output_file: str = "data_lineage.json"):
+        """Export the data lineage graph to JSON format."""
+        self.flush()
+        try:
+            snapshot = self._graph_snapshot()
+            if self._is_up_to_date(output_file, snapshot):
+                return
             
-            # Draw the graph
-            plt.figure(figsize=(12, 8))
-            pos = nx.spring_layout(G)
-            nx.draw(G, pos, with_labels=True, node_color='lightblue', 
-                   node_size=2000, font_size=10, font_weight='bold')
-            edge_labels = nx.get_edge_attributes(G, 'label')
-            nx.draw_networkx_edge_labels(G, pos, edge_labels=edge_labels)
+            # Rows are rendered by SQLite's json_object and streamed to the
+            # file in chunks, so the graph is never held in memory at once
+            with self._read_conn() as conn, open(output_file, 'w') as f:
+                f.write('{"nodes": [')
+                self._write_json_rows(f, conn.execute(_EXPORT_NODES_SQL))
+                f.write('], "edges": [')
+                self._write_json_rows(f, conn.execute(_EXPORT_EDGES_SQL))
+                f.write(']}')
+            self._snapshots[output_file] = snapshot
             
-            plt.savefig(output_file)
-            plt.close()
+            logger.info(f"Data lineage exported to {output_file}")
             
+        except Exception as e:
+            logger.error(f"Error exporting lineage: {e}")
+            raise
+
+class MemoryLineage:
+    """In-process lineage graph with the same interface as DataLineage.
+    
+    Nodes and edges live in dicts with adjacency lists, so there is no
+    SQLite, serialization round trip or file I/O while a pipeline runs.
+    Rows are kept in the column order of the SQLite tables, so persist()
+    can copy them into a lineage database unchanged.
+    """
+    
+    def __init__(self, persist_path: Optional[str] = None):
+        """Initialize the in-memory lineage tracker.
+        
+        Args:
+            persist_path: SQLite database the graph is copied to on close(),
+                or None to discard it
+        """
+        self.persist_path = persist_path
+        self._lock = threading.Lock()
+        self._closed = False
+        # id -> (id, node_type, name, description, metadata, created_at)
+        self._nodes = {}
+        # id -> (id, source_id, target_id, operation, metadata, timestamp)
+        self._edges = {}
+        # (source_id, target_id, operation) -> id of the stored edge
+        self._edge_keys = {}
+        self._out = {}
+        self._in = {}
+    
+    def _check_open(self):
+        """Raise if the tracker has been closed."""
+        if self._closed:
+            raise sqlite3.ProgrammingError("Cannot write to a closed lineage tracker")
+    
+    def add_node(self, node_type, name, description, metadata=None):
+        """Add a node to the lineage graph."""
+        return self._add_node(node_type, name, description, _encode_metadata(metadata))
+    
+    def _add_node(self, node_type, name, description, metadata_json):
+        """Add a node whose metadata is already serialized."""
+        self._check_open()
+        node_id = _new_id()
+        self._nodes[node_id] = (node_id, node_type, name, description, metadata_json, _now())
+        
+        logger.debug("Added node: %s (%s)", name, node_type)
+        return node_id
+    
+    def add_nodes_bulk(self, nodes):
+        """Add many nodes at once; see DataLineage.add_nodes_bulk."""
+        self._check_open()
+        created_at = _now()
+        node_ids = []
+        for node in nodes:
+            node_id = _new_id()
+            self._nodes[node_id] = (
+                node_id, node["node_type"], node["name"], node.get("description", ""),
+                _encode_metadata(node.get("metadata")), created_at
+            )
+            node_ids.append(node_id)
+        
+        logger.debug("Added %d nodes", len(node_ids))
+        return node_ids
+    
+    def _insert_edge(self, edge):
+        """Store an edge row unless an identical one exists; return the stored ID."""
+        key = edge[1:4]
+        with self._lock:
+            existing_id = self._edge_keys.get(key)
+            if existing_id is not None:
+                return existing_id
+            self._edge_keys[key] = edge[0]
+            self._edges[edge[0]] = edge
+            self._out.setdefault(edge[1], []).append(edge)
+            self._in.setdefault(edge[2], []).append(edge)
+        return edge[0]
+    
+    def add_edge(self, source_id, target_id, operation, metadata=None):
+        """Add an edge to the lineage graph, ignoring duplicates."""
+        self._check_open()
+        edge_id = self._insert_edge((_new_id(), source_id, target_id, operation, _encode_metadata(metadata), _now()))
+        
+        logger.debug("Added edge: %s from %s to %s", operation, source_id, target_id)
+        return edge_id
+    
+    def add_edges(self, source_ids, target_id, operation, metadata=None):
+        """Add edges from several sources to one target; see DataLineage.add_edges."""
+        return self._add_edges(source_ids, target_id, operation, _encode_metadata(metadata))
+    
+    def _add_edges(self, source_ids, target_id, operation, metadata_json):
+        """Add fan-in edges whose shared metadata is already serialized."""
+        self._check_open()
+        timestamp = _now()
+        edge_ids = []
+        for source_id in source_ids:
+            edge_ids.append(self._insert_edge((_new_id(), source_id, target_id, operation, metadata_json, timestamp)))
+        
+        logger.debug("Added %d %s edges to %s", len(edge_ids), operation, target_id)
+        return edge_ids
+    
+    def add_edges_bulk(self, edges):
+        """Add many edges at once; see DataLineage.add_edges_bulk."""
+        self._check_open()
+        timestamp = _now()
+        edge_ids = []
+        for edge in edges:
+            edge_ids.append(self._insert_edge((
+                _new_id(), edge["source_id"], edge["target_id"], edge["operation"],
+                _encode_metadata(edge.get("metadata")), timestamp
+            )))
+        
+        logger.debug("Added %d edges", len(edge_ids))
+        return edge_ids
+    
+    def update_node_metadata(self, node_id, updates):
+        """Merge updates into a stored node's metadata."""
+        self._check_open()
+        with self._lock:
+            row = self._nodes.get(node_id)
+            if row is None:
+                return
+            metadata = _loads(row[4])
+            metadata.update(updates)
+            self._nodes[node_id] = row[:4] + (_encode_metadata(metadata),) + row[5:]
+    
+    def get_node(self, node_id):
+        """Get a node from the lineage graph."""
+        row = self._nodes.get(node_id)
+        if row is None:
+            return None
+        
+        node_id, node_type, name, description, metadata, created_at = row
+        return DataNode(
+            node_id=node_id,
+            node_type=node_type,
+            name=name,
+            description=description,
+            created_at=created_at,
+            metadata=_loads(metadata)
+        )
+    
+    @staticmethod
+    def _edge_dicts(edges):
+        """Return edge rows as dicts, matching DataLineage.get_edges."""
+        return [
+            {
+                "id": edge_id,
+                "source_id": source_id,
+                "target_id": target_id,
+                "operation": operation,
+                "metadata": _loads(metadata),
+                "timestamp": timestamp
+            }
+            for edge_id, source_id, target_id, operation, metadata, timestamp in edges
+        ]
+    
+    def get_edges(self, node_id):
+        """Get edges connected to a node."""
+        outgoing = self._out.get(node_id, [])
+        # A self-loop is in both lists but must only be returned once
+        incoming = [edge for edge in self._in.get(node_id, []) if edge[1] != node_id]
+        return self._edge_dicts(outgoing + incoming)
+    
+    def get_outgoing_edges(self, node_id):
+        """Get edges whose source is the given node."""
+        return self._edge_dicts(self._out.get(node_id, []))
+    
+    def get_incoming_edges(self, node_id):
+        """Get edges whose target is the given node."""
+        return self._edge_dicts(self._in.get(node_id, []))
+    
+    def visualize(self, output_file: str = "data_lineage.html"):
+        """Generate a visualization of the data lineage graph."""
+        try:
+            nodes = list(self._nodes.values())
+            edges = list(self._edges.values())
+            if output_file.endswith(".html"):
+                with open(output_file, 'w') as f:
+                    f.write(_HTML_HEAD)
+                    f.write(_dumps([
+                        {"id": node_id, "label": name, "title": description, "group": node_type}
+                        for node_id, node_type, name, description, _, _ in nodes
+                    ]).replace("</", "<\\/"))
+                    f.write(_HTML_MIDDLE)
+                    f.write(_dumps([
+                        {"from": source_id, "to": target_id, "label": operation}
+                        for _, source_id, target_id, operation, _, _ in edges
+                    ]).replace("</", "<\\/"))
+                    f.write(_HTML_TAIL)
+            else:
+                _draw_lineage_graph(
+                    [(row[0], row[2], row[1]) for row in nodes],
+                    [(row[1], row[2], row[3]) for row in edges],
+                    output_file
+                )
             logger.info(f"Data lineage visualization saved to {output_file}")
-            
         except Exception as e:
             logger.error(f"Error generating visualization: {e}")
             raise
@@ -228,54 +1142,152 @@ class DataLineage:
         """Export the data lineage graph to JSON format."""
         try:
             lineage_data = {
-                "nodes": [],
-                "edges": []
+                "nodes": [
+                    {
+                        "id": node_id,
+                        "node_type": node_type,
+                        "name": name,
+                        "description": description,
+                        "metadata": _loads(metadata),
+                        "created_at": created_at
+                    }
+                    for node_id, node_type, name, description, metadata, created_at
+                    in list(self._nodes.values())
+                ],
+                "edges": [
+                    {
+                        "id": edge_id,
+                        "source_id": source_id,
+                        "target_id": target_id,
+                        "operation": operation,
+                        "metadata": _loads(metadata),
+                        "timestamp": timestamp
+                    }
+                    for edge_id, source_id, target_id, operation, metadata, timestamp
+                    in list(self._edges.values())
+                ]
             }
-            
-            # Get all nodes
-            self.cursor.execute("SELECT * FROM nodes")
-            for row in self.cursor.fetchall():
-                metadata = json.loads(row[4]) if row[4] else {}
-                node = {
-                    "id": row[0],
-                    "node_type": row[1],
-                    "name": row[2],
-                    "description": row[3],
-                    "metadata": metadata
-                }
-                lineage_data["nodes"].append(node)
-            
-            # Get all edges
-            self.cursor.execute("SELECT * FROM edges")
-            for row in self.cursor.fetchall():
-                metadata = json.loads(row[4]) if row[4] else {}
-                edge = {
-                    "id": row[0],
-                    "source_id": row[1],
-                    "target_id": row[2],
-                    "operation": row[3],
-                    "metadata": metadata
-                }
-                lineage_data["edges"].append(edge)
-            
-            # Write to file
             with open(output_file, 'w') as f:
-                json.dump(lineage_data, f, indent=2)
+                f.write(_dumps(lineage_data))
             
             logger.info(f"Data lineage exported to {output_file}")
-            
         except Exception as e:
             logger.error(f"Error exporting lineage: {e}")
             raise
+    
+    def persist(self, db_path: str):
+        """Copy the whole graph into a SQLite lineage database in one transaction."""
+        tracker = DataLineage(db_path=db_path, async_writes=False)
+        try:
+            with tracker._write_lock:
+                # The stored rows are handed to executemany as-is, without copies
+                tracker._write_batch(tracker._get_write_conn(), [
+                    (_INSERT_NODE_SQL, self._nodes.values()),
+                    (_INSERT_EDGE_SQL, self._edges.values())
+                ])
+        finally:
+            tracker.close()
+        
+        logger.info(f"Persisted {len(self._nodes)} nodes and {len(self._edges)} edges to {db_path}")
+    
+    def flush(self):
+        """No-op; in-memory writes are visible immediately."""
+    
+    def close(self):
+        """Persist to persist_path, if set, and reject further writes."""
+        if self._closed:
+            return
+        self._closed = True
+        if self.persist_path:
+            self.persist(self.persist_path)
+
+class NullLineage:
+    """Lineage tracker that records nothing, for when tracing is switched off.
+    
+    Every write returns a fixed id and get_node() hands back a throwaway
+    node, so callers that annotate results keep working at no cost.
+    """
+    
+    _ID = "lineage_disabled"
+    
+    def add_node(self, node_type, name, description, metadata=None):
+        return self._ID
+    
+    def _add_node(self, node_type, name, description, metadata_json):
+        return self._ID
+    
+    def add_nodes_bulk(self, nodes):
+        return [self._ID for _ in nodes]
+    
+    def add_edge(self, source_id, target_id, operation, metadata=None):
+        return self._ID
+    
+    def add_edges(self, source_ids, target_id, operation, metadata=None):
+        return [self._ID for _ in source_ids]
+    
+    def _add_edges(self, source_ids, target_id, operation, metadata_json):
+        return [self._ID for _ in source_ids]
+    
+    def add_edges_bulk(self, edges):
+        return [self._ID for _ in edges]
+    
+    def update_node_metadata(self, node_id, updates):
+        pass
+    
+    def get_node(self, node_id):
+        return DataNode(node_id=node_id, node_type="", name="", description="", created_at="", metadata={})
+    
+    def get_edges(self, node_id):
+        return []
+    
+    def get_outgoing_edges(self, node_id):
+        return []
+    
+    def get_incoming_edges(self, node_id):
+        return []
+    
+    def visualize(self, output_file: str = "data_lineage.html"):
+        logger.info("Lineage tracking is disabled; nothing to visualize")
+    
+    def export_json(self, output_file: str = "data_lineage.json"):
+        logger.info("Lineage tracking is disabled; nothing to export")
+    
+    def flush(self):
+        pass
+    
+    def close(self):
+        pass
 
 # Singleton pattern for lineage tracker
 _lineage_tracker = None
 
-def get_lineage_tracker() -> DataLineage:
-    """Get the global lineage tracker instance."""
+def get_lineage_tracker() -> Union[DataLineage, MemoryLineage, NullLineage]:
+    """Get the global lineage tracker instance.
+    
+    Set LINEAGE_BACKEND=memory to track lineage in process and write it to
+    lineage.db only when the tracker is closed, or LINEAGE_DISABLED=1 to
+    skip lineage tracking altogether.
+    """
     global _lineage_tracker
     if _lineage_tracker is None:
-        _lineage_tracker = DataLineage()
+        if os.getenv("LINEAGE_DISABLED", "").lower() in ("1", "true", "yes"):
+            _lineage_tracker = NullLineage()
+        elif os.getenv("LINEAGE_BACKEND", "sqlite") == "memory":
+            _lineage_tracker = MemoryLineage(persist_path="lineage.db")
+            atexit.register(_lineage_tracker.close)
+        else:
+            _lineage_tracker = DataLineage()
+    return _lineage_tracker
+
+def disable_lineage() -> Union[DataLineage, MemoryLineage, NullLineage]:
+    """Switch the global tracker to NullLineage, as mock and test runs do.
+    
+    LINEAGE_DISABLED=0 keeps lineage tracking on for those runs too.
+    """
+    global _lineage_tracker
+    if os.getenv("LINEAGE_DISABLED", "").lower() in ("0", "false", "no"):
+        return get_lineage_tracker()
+    _lineage_tracker = NullLineage()
     return _lineage_tracker
 
 class LineageContext:
@@ -322,30 +1334,30 @@ class LineageContext:
     def __enter__(self):
         """Create the target node when entering the context."""
         try:
-            self.target_id = self.lineage.add_node(
+            # The target node and every edge share the same metadata, so
+            # serialize it once for all of them
+            metadata_json = _encode_metadata(self.metadata)
+            self.target_id = self.lineage._add_node(
                 node_type=self.target_type,
                 name=self.target_name,
                 description=self.target_description,
-                metadata=self.metadata
+                metadata_json=metadata_json
             )
             
-            # Create edges from source nodes to target
-            for source_id in self.source_nodes:
-                try:
-                    self.lineage.add_edge(
-                        source_id=source_id,
-                        target_id=self.target_id,
-                        operation=self.operation,
-                        metadata=self.metadata
-                    )
-                except Exception as e:
-                    logger.error(f"Error adding edge from {source_id} to {self.target_id}: {e}")
+            # Create all edges from source nodes to target in one batch
+            if self.source_nodes:
+                self.lineage._add_edges(
+                    source_ids=self.source_nodes,
+                    target_id=self.target_id,
+                    operation=self.operation,
+                    metadata_json=metadata_json
+                )
             
             return self.target_id
         except Exception as e:
             logger.error(f"Error in lineage context entry: {e}")
             # Return a dummy ID to prevent crashes
-            return f"dummy_context_{str(uuid.uuid4())}"
+            return f"dummy_context_{_new_id()}"
     
     def __exit__(self, exc_type, exc_val, exc_tb):
         """Handle any errors when exiting the context."""
@@ -361,30 +1373,8 @@ class LineageContext:
                 # Update the target node with error information if we have a valid target_id
                 if self.target_id:
                     try:
-                        # Get current metadata from database
-                        self.lineage.cursor.execute("""
-                            SELECT metadata FROM nodes WHERE id = ?
-                        """, (self.target_id,))
-                        row = self.lineage.cursor.fetchone()
-                        if row:
-                            try:
-                                current_metadata = json.loads(row[0]) if row[0] else {}
-                            except (json.JSONDecodeError, TypeError):
-                                current_metadata = {}
-                            
-                            if not isinstance(current_metadata, dict):
-                                current_metadata = {}
-                            
-                            # Update metadata with error information
-                            current_metadata["error"] = error_metadata
-                            
-                            # Update the node in the database
-                            self.lineage.cursor.execute("""
-                                UPDATE nodes 
-                                SET metadata = ? 
-                                WHERE id = ?
-                            """, (json.dumps(current_metadata), self.target_id))
-                            self.lineage.conn.commit()
+                        # Merge the error into the node's stored metadata
+                        self.lineage.update_node_metadata(self.target_id, {"error": error_metadata})
                     except Exception as e:
                         logger.error(f"Error updating node metadata: {e}")
                 
@@ -0,0 +1,214 @@
+"""
+Embedding helpers shared by the scraper and the RAG pipeline.
+
+Holds the two-tier embedding cache, token-aware request batching and
+vector normalization, so Reddit_scraper.py can embed posts without
+importing the whole RAG application.
+"""
+
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import openai
+
+# tiktoken gives exact token counts for embedding batches; without it a
+# characters-per-token estimate is used
+try:
+    import tiktoken
+    HAVE_TIKTOKEN = True
+except ImportError:
+    HAVE_TIKTOKEN = False
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_MODEL = "text-embedding-ada-002"
+
+# Upper bounds for a single embeddings request
+EMBEDDING_BATCH_SIZE = 256
+EMBEDDING_BATCH_TOKENS = 300_000
+# Longest single input the embedding model accepts; longer texts are cut
+EMBEDDING_INPUT_TOKENS = 8191
+
+# Local caches live outside the working tree so they are never committed
+CACHE_DIR = os.getenv('CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'crypto-data-engineering'))
+
+class EmbeddingCache:
+    """Two-tier cache for OpenAI embeddings.
+    
+    An in-process LRU sits in front of a SQLite file, so repeated texts
+    skip the embedding API both within a session and across runs. Keys
+    include the model name, so switching models never returns stale vectors.
+    """
+    
+    def __init__(self, path=None, maxsize=10000):
+        self.path = path or os.getenv('EMBEDDING_CACHE_PATH') or os.path.join(CACHE_DIR, 'embedding_cache.db')
+        self.maxsize = maxsize
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+    
+    @staticmethod
+    def _key(text, model):
+        """Hash model and text into a fixed-size cache key."""
+        return hashlib.sha256(f"{model}\0{text}".encode()).digest()
+    
+    def _disk(self):
+        """Open the SQLite tier on first use."""
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings (key BLOB PRIMARY KEY, vector BLOB) WITHOUT ROWID"
+            )
+        return self._conn
+    
+    def _remember(self, key, vector):
+        """Insert into the in-process tier, evicting the least recently used entry."""
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        if len(self._memory) > self.maxsize:
+            self._memory.popitem(last=False)
+    
+    def get(self, text, model=EMBEDDING_MODEL):
+        """Return the cached embedding for text, or None on a miss."""
+        key = self._key(text, model)
+        with self._lock:
+            vector = self._memory.get(key)
+            if vector is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return vector.tolist()
+            
+            try:
+                row = self._disk().execute("SELECT vector FROM embeddings WHERE key = ?", (key,)).fetchone()
+            except sqlite3.Error as e:
+                logger.warning(f"Embedding cache unavailable: {e}")
+                row = None
+            if row is not None:
+                vector = np.frombuffer(row[0], dtype=np.float32)
+                self._remember(key, vector)
+                self.disk_hits += 1
+                logger.info(f"Embedding cache disk hit ({self.stats()})")
+                return vector.tolist()
+            
+            self.misses += 1
+            logger.info(f"Embedding cache miss ({self.stats()})")
+            return None
+    
+    def put(self, text, embedding, model=EMBEDDING_MODEL):
+        """Store an embedding in both tiers as float32."""
+        key = self._key(text, model)
+        vector = np.asarray(embedding, dtype=np.float32)
+        with self._lock:
+            self._remember(key, vector)
+            try:
+                conn = self._disk()
+                conn.execute("INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)", (key, vector.tobytes()))
+                conn.commit()
+            except sqlite3.Error as e:
+                logger.warning(f"Could not persist embedding: {e}")
+    
+    def stats(self):
+        """Summarize hit and miss counts for logging."""
+        return f"{self.hits} memory hits, {self.disk_hits} disk hits, {self.misses} misses"
+
+embedding_cache = EmbeddingCache()
+
+_token_encoders = {}
+
+def _get_encoder(model):
+    """Return the tiktoken encoding for model, loading it only once."""
+    encoder = _token_encoders.get(model)
+    if encoder is None:
+        encoder = _token_encoders[model] = tiktoken.encoding_for_model(model)
+    return encoder
+
+def count_tokens(text, model):
+    """Count tokens in text for the given model, estimating if tiktoken is missing."""
+    if not HAVE_TIKTOKEN:
+        return len(text) // 4 + 1
+    return len(_get_encoder(model).encode(text))
+
+def truncate_tokens(text, max_tokens, model):
+    """Cut text to at most max_tokens tokens for the given model."""
+    if not HAVE_TIKTOKEN:
+        return text[:max_tokens * 4]
+    encoder = _get_encoder(model)
+    tokens = encoder.encode(text)
+    return text if len(tokens) <= max_tokens else encoder.decode(tokens[:max_tokens])
+
+def _fit_input(text, model):
+    """Cut text to EMBEDDING_INPUT_TOKENS, returning it with its token count."""
+    if not HAVE_TIKTOKEN:
+        text = text[:EMBEDDING_INPUT_TOKENS * 4]
+        return text, len(text) // 4 + 1
+    encoder = _get_encoder(model)
+    tokens = encoder.encode(text)
+    if len(tokens) <= EMBEDDING_INPUT_TOKENS:
+        return text, len(tokens)
+    return encoder.decode(tokens[:EMBEDDING_INPUT_TOKENS]), EMBEDDING_INPUT_TOKENS
+
+def embedding_batches(texts, model, batch_size=EMBEDDING_BATCH_SIZE):
+    """Split texts into request-sized batches by count and token budget.
+    
+    Each text is first cut to EMBEDDING_INPUT_TOKENS, so the batches hold
+    the inputs as sent, in the same order as texts.
+    """
+    batch, batch_tokens = [], 0
+    for text in texts:
+        text, tokens = _fit_input(text, model)
+        if batch and (len(batch) >= batch_size or batch_tokens + tokens > EMBEDDING_BATCH_TOKENS):
+            yield batch
+            batch, batch_tokens = [], 0
+        batch.append(text)
+        batch_tokens += tokens
+    if batch:
+        yield batch
+
+def get_embeddings(texts, model=EMBEDDING_MODEL):
+    """Generate embeddings for several texts, batching cache misses into few API calls.
+    
+    Returns:
+        List of embeddings in the same order as texts
+    """
+    embeddings = {}
+    misses = []
+    for text in texts:
+        if text in embeddings:
+            continue
+        embedding = embedding_cache.get(text, model)
+        if embedding is None:
+            misses.append(text)
+        embeddings[text] = embedding
+    
+    # Batches may hold truncated inputs, so results are keyed by the
+    # original texts, which come in the same order
+    offset = 0
+    for batch in embedding_batches(misses, model):
+        response = openai.Embedding.create(input=batch, model=model)
+        # The API may return items out of order, so match them by index
+        for item in response['data']:
+            text = misses[offset + item['index']]
+            embeddings[text] = item['embedding']
+            embedding_cache.put(text, item['embedding'], model)
+        offset += len(batch)
+    
+    return [embeddings[text] for text in texts]
+
+def get_embedding(text, model=EMBEDDING_MODEL):
+    """Generate embedding for a given text using OpenAI API, with caching."""
+    return get_embeddings([text], model)[0]
+
+def unit_vector(embedding):
+    """Scale an embedding to unit length, returned as a list for SQL parameters."""
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return (vector / norm if norm else vector).tolist()
@@ -5,6 +5,7 @@ This script demonstrates how to use the LangChain RAG implementation programmati
 """
 
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 from langchain_rag import CryptoRAGSystem
 
 def interactive_mode(rag_system):
@@ -36,8 +37,13 @@ def interactive_mode(rag_system):
         print(response)
         print("="*50)
 
-def batch_mode(rag_system, queries=None):
-    """Process a list of queries in batch mode"""
+def batch_mode(rag_system, queries=None, parallel=False):
+    """Process a list of queries in batch mode
+    
+    With parallel=True the queries run concurrently, so the batch takes
+    about as long as the slowest query instead of the sum of all of them.
+    Responses are still printed in query order.
+    """
     if not queries:
         queries = [
             "What is the current price of Bitcoin?",
@@ -51,10 +57,16 @@ def batch_mode(rag_system, queries=None):
     print(f"Processing {len(queries)} queries in batch mode:")
     print(f"{'='*50}\n")
     
-    for i, query in enumerate(queries, 1):
+    if parallel:
+        # chat() is dominated by database and LLM round trips, which overlap
+        with ThreadPoolExecutor(max_workers=min(8, len(queries))) as executor:
+            responses = executor.map(rag_system.chat, queries)
+    else:
+        responses = map(rag_system.chat, queries)
+    
+    for i, (query, response) in enumerate(zip(queries, responses), 1):
         print(f"\nQuery {i}: {query}")
         print(f"{'-'*50}")
-        response = rag_system.chat(query)
         print(f"\nResponse: {response}")
         print(f"\n{'='*50}")
 
@@ -63,6 +75,7 @@ def main():
     parser = argparse.ArgumentParser(description='Example usage of LangChain RAG')
     parser.add_argument('--query', type=str, help='Single query to process')
     parser.add_argument('--batch', action='store_true', help='Run in batch mode with predefined queries')
+    parser.add_argument('--parallel', action='store_true', help='Run batch mode queries concurrently')
     parser.add_argument('--interactive', action='store_true', help='Run in interactive mode')
     parser.add_argument('--mock', action='store_true', help='Use mock mode instead of real API calls', default=True)
     
@@ -79,7 +92,7 @@ def main():
         print("="*50)
     elif args.batch:
         # Run in batch mode with predefined queries
-        batch_mode(rag_system)
+        batch_mode(rag_system, parallel=args.parallel)
     elif args.interactive or not (args.query or args.batch):
         # Run in interactive mode (default)
         interactive_mode(rag_system)
@@ -1,18 +1,60 @@
 import psycopg2
+import psycopg2.extensions
+import psycopg2.pool
 import openai
 import numpy as np
 import os
+import sys
 import argparse
 import logging
 import json
-from sklearn.metrics.pairwise import cosine_similarity
+import hashlib
+import sqlite3
+import threading
+import time
+import contextlib
+import functools
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-import ast  # For converting string to list
 import pandas as pd
 from datetime import datetime
 
+# CuPy moves the in-memory similarity search onto a GPU when USE_GPU is set
+try:
+    import cupy
+    HAVE_CUPY = True
+except ImportError:
+    HAVE_CUPY = False
+
+# SimSIMD scores float16 rows directly with hardware SIMD kernels
+try:
+    import simsimd
+    HAVE_SIMSIMD = True
+except ImportError:
+    HAVE_SIMSIMD = False
+
+# Numba compiles a parallel dot-product and top-k kernel for the in-memory search
+try:
+    from numba import njit, prange
+    HAVE_NUMBA = True
+except ImportError:
+    HAVE_NUMBA = False
+
+# pgvector's psycopg2 adapter binds numpy arrays as vector literals and
+# returns vector columns as numpy arrays
+try:
+    from pgvector.psycopg2 import register_vector
+    HAVE_PGVECTOR = True
+except ImportError:
+    HAVE_PGVECTOR = False
+
 # Import data lineage
-from data_lineage import get_lineage_tracker, LineageContext
+from data_lineage import disable_lineage, get_lineage_tracker, LineageContext
+
+# Embedding cache, request batching and token counting shared with Reddit_scraper.py
+import embedding_utils
+from embedding_utils import CACHE_DIR, EMBEDDING_MODEL, count_tokens, truncate_tokens, unit_vector
 
 # Set up logging
 logging.basicConfig(
@@ -28,6 +70,7 @@ def enable_mock_mode():
     """Enable mock mode for testing without API calls"""
     global MOCK_MODE
     MOCK_MODE = True
+    disable_lineage()
     logger.info("Mock mode enabled - no real API calls will be made")
 
 # Load environment variables from .env file
@@ -43,16 +86,118 @@ db_password = os.getenv('DB_PASSWORD')
 # OpenAI API key
 openai.api_key = os.getenv('OPENAI_API_KEY')
 
+CHAT_MODEL = "gpt-3.5-turbo"
+
+# Cached answers expire so market data in them does not go stale
+RESPONSE_CACHE_TTL = 86400
+# Cosine similarity above which a new query reuses a previous answer
+SEMANTIC_CACHE_THRESHOLD = 0.97
+
+class ResponseCache:
+    """Cache for LLM answers, keyed by the query and the context it was given.
+    
+    Exact repeats are found by hash in a SQLite file. Near-duplicate
+    queries (query embeddings above SEMANTIC_CACHE_THRESHOLD) that were
+    answered from the same context reuse that answer from an in-process
+    index of recent queries. Entries older than the TTL are ignored.
+    """
+    
+    def __init__(self, path=None, ttl=RESPONSE_CACHE_TTL, threshold=SEMANTIC_CACHE_THRESHOLD, max_recent=1000):
+        self.path = path or os.getenv('RESPONSE_CACHE_PATH') or os.path.join(CACHE_DIR, 'response_cache.db')
+        self.ttl = ttl
+        self.threshold = threshold
+        self.max_recent = max_recent
+        self._recent = []
+        self._lock = threading.Lock()
+        self._conn = None
+    
+    @staticmethod
+    def _context_hash(context):
+        """Hash the model and context an answer was generated from."""
+        return hashlib.sha256(f"{CHAT_MODEL}\0{context}".encode()).digest()
+    
+    @staticmethod
+    def _key(query, context_hash):
+        """Combine query text and context hash into the exact-match key."""
+        return hashlib.sha256(query.encode() + b"\0" + context_hash).digest()
+    
+    def _disk(self):
+        """Open the SQLite store on first use."""
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses (key BLOB PRIMARY KEY, response TEXT, created REAL) WITHOUT ROWID"
+            )
+        return self._conn
+    
+    def get(self, query, context, query_embedding):
+        """Return a cached answer for query and context, or None.
+        
+        Returns:
+            (response, kind) where kind is "exact" or "semantic", or None on a miss
+        """
+        context_hash = self._context_hash(context)
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            try:
+                row = self._disk().execute(
+                    "SELECT response FROM responses WHERE key = ? AND created >= ?",
+                    (self._key(query, context_hash), cutoff)
+                ).fetchone()
+            except sqlite3.Error as e:
+                logger.warning(f"Response cache unavailable: {e}")
+                row = None
+            if row is not None:
+                return row[0], "exact"
+            
+            self._recent = [entry for entry in self._recent if entry[3] >= cutoff]
+            candidates = [entry for entry in self._recent if entry[1] == context_hash]
+            if not candidates:
+                return None
+            q = np.asarray(unit_vector(query_embedding), dtype=np.float32)
+            sims = np.stack([entry[0] for entry in candidates]) @ q
+            best = int(np.argmax(sims))
+            if sims[best] >= self.threshold:
+                return candidates[best][2], "semantic"
+            return None
+    
+    def put(self, query, context, query_embedding, response):
+        """Store an answer for exact and semantic lookups."""
+        context_hash = self._context_hash(context)
+        now = time.time()
+        with self._lock:
+            self._recent.append((np.asarray(unit_vector(query_embedding), dtype=np.float32), context_hash, response, now))
+            del self._recent[:-self.max_recent]
+            try:
+                conn = self._disk()
+                conn.execute(
+                    "INSERT OR REPLACE INTO responses (key, response, created) VALUES (?, ?, ?)",
+                    (self._key(query, context_hash), response, now)
+                )
+                conn.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,))
+                conn.commit()
+            except sqlite3.Error as e:
+                logger.warning(f"Could not persist response: {e}")
+
+_response_cache = ResponseCache()
+
 # Function to generate OpenAI embeddings
-def get_embedding(text, model="text-embedding-ada-002"):
-    """Generate embedding for a given text using OpenAI API."""
+def get_embeddings(texts, model=EMBEDDING_MODEL):
+    """Generate embeddings for several texts, batching cache misses into few API calls.
+    
+    Returns:
+        List of embeddings in the same order as texts
+    """
     if MOCK_MODE:
-        logger.info(f"Generating mock embedding for: {text[:30]}...")
-        # Return a simple mock embedding (dimensionality 1536 to match ada-002)
-        return [0.1] * 1536
-        
-    response = openai.Embedding.create(input=[text], model=model)
-    return response['data'][0]['embedding']
+        logger.info(f"Generating {len(texts)} mock embeddings")
+        # Return simple mock embeddings (dimensionality 1536 to match ada-002)
+        return [[0.1] * 1536 for _ in texts]
+    return embedding_utils.get_embeddings(texts, model)
+
+def get_embedding(text, model=EMBEDDING_MODEL):
+    """Generate embedding for a given text using OpenAI API, with caching."""
+    return get_embeddings([text], model)[0]
 
 # Function to get database connection
 def get_db_connection():
@@ -64,6 +209,7 @@ def get_db_connection():
             def execute(self, query, params=None):
                 logger.info(f"Mock executing query: {query}")
                 self.last_query = query
+                self.pending = None
                 return self
                 
             def fetchall(self):
@@ -79,15 +225,33 @@ def get_db_connection():
                     # Mock structured coin data
                     return [["Ethereum", "ETH", 3500.45, 420000000000, 15000000000, 120000000]]
                     
+            def fetchone(self):
+                # The mock schema has no pgvector column
+                return [False]
+            
+            def fetchmany(self, size=None):
+                # Serve every mock row in the first block
+                if self.pending is None:
+                    self.pending = self.fetchall()
+                rows, self.pending = self.pending, []
+                return rows
+                    
             def __init__(self):
                 self.last_query = ""
+                self.pending = None
                 
             def close(self):
                 pass
                 
         class MockConnection:
-            def cursor(self):
+            def cursor(self, name=None):
                 return MockCursor()
+            
+            def commit(self):
+                pass
+            
+            def rollback(self):
+                pass
                 
             def close(self):
                 pass
@@ -100,15 +264,606 @@ def get_db_connection():
             user=db_user, 
             password=db_password, 
             host=db_host, 
-            port=db_port
+            port=db_port,
+            connection_factory=_SearchConnection
         )
     except Exception as e:
         logger.error(f"Failed to connect to database: {e}")
         raise
 
+# HNSW candidate list size per query; higher trades latency for recall
+HNSW_EF_SEARCH = 40
+
+def configure_hnsw_params(vector_count):
+    """Pick HNSW build and search parameters for a collection size.
+    
+    Larger graphs need more links per node (m) and wider candidate lists
+    (ef_construction, ef_search) to keep recall up as they grow.
+    
+    Returns:
+        (m, ef_construction, ef_search)
+    """
+    if vector_count < 100_000:
+        return 16, 64, HNSW_EF_SEARCH
+    if vector_count < 1_000_000:
+        return 24, 128, 100
+    return 32, 200, 200
+
+# ef_search applied to each vector query, tuned by ensure_search_indexes
+_hnsw_ef_search = HNSW_EF_SEARCH
+
+def configure_connection(db_connection):
+    """Apply the session settings used by vector search to a connection."""
+    cursor = db_connection.cursor()
+    try:
+        # JIT compilation costs more than it saves on short index lookups
+        cursor.execute("SET jit = off")
+        db_connection.commit()
+    except Exception as e:
+        logger.warning(f"Could not configure search session: {e}")
+        db_connection.rollback()
+
+# The two hot retrieval queries, prepared once per connection so repeat
+# calls skip parsing and planning. Values are (parameter types, query).
+_PREPARED_STATEMENTS = {
+    "reddit_ann": ("halfvec, int", """
+        SELECT post_id, title, text, embedding_vector <#> $1 AS distance
+        FROM reddit_embeddings
+        WHERE embedding_vector IS NOT NULL
+        ORDER BY distance
+        LIMIT $2
+    """),
+    "coin_exact": ("text", """
+        SELECT "Name", "Symbol", "Price (USD)", "Market Cap (USD)", "24h Volume (USD)", "Circulating Supply"
+        FROM coin_data_structured
+        WHERE "Symbol" = upper($1) OR "Name" = $1
+    """),
+    "coin_search": ("text, int", """
+        SELECT "Name", "Symbol", "Price (USD)", "Market Cap (USD)", "24h Volume (USD)", "Circulating Supply"
+        FROM coin_data_structured
+        WHERE "Name" ILIKE $1 OR "Symbol" ILIKE $1
+        ORDER BY "Market Cap (USD)" DESC NULLS LAST
+        LIMIT $2
+    """),
+}
+
+def prepare_statements(db_connection):
+    """PREPARE the hot retrieval queries on a connection.
+    
+    Returns:
+        Set of statement names that were prepared successfully
+    """
+    prepared = set()
+    cursor = db_connection.cursor()
+    for name, (param_types, query) in _PREPARED_STATEMENTS.items():
+        try:
+            cursor.execute(f"PREPARE {name} ({param_types}) AS {query}")
+            db_connection.commit()
+            prepared.add(name)
+        except Exception as e:
+            logger.warning(f"Could not prepare {name}: {e}")
+            db_connection.rollback()
+    return prepared
+
+# Cosine indexes from before the inner-product search: the ivfflat index the
+# original init script created, and the HNSW index that first replaced it.
+# Rows they were built over may not be unit length.
+LEGACY_COSINE_INDEXES = ('idx_reddit_vector', 'idx_reddit_hnsw')
+
+# Declared type of reddit_embeddings.embedding_vector, e.g. 'halfvec(1536)', or NULL
+_VECTOR_COLUMN_TYPE_SQL = """
+    SELECT format_type(atttypid, atttypmod) FROM pg_attribute
+    WHERE attrelid = to_regclass('reddit_embeddings')
+    AND attname = 'embedding_vector' AND NOT attisdropped
+"""
+
+# Memory and parallel workers granted to an HNSW build; pgvector builds far
+# faster when the graph fits in maintenance_work_mem
+HNSW_BUILD_WORK_MEM = os.getenv('HNSW_BUILD_WORK_MEM', '2GB')
+HNSW_BUILD_WORKERS = int(os.getenv('HNSW_BUILD_WORKERS', '7'))
+
+def _create_hnsw_index(cursor, opclass, m, ef_construction):
+    """Build the inner-product HNSW index over the non-NULL Reddit vectors.
+    
+    Rows without a vector are legitimate (older ingests), so the index is
+    partial; its predicate matches the search query's WHERE clause and the
+    planner drops the per-row filter.
+    """
+    # SET LOCAL keeps the build settings to this transaction
+    cursor.execute("SET LOCAL maintenance_work_mem = %s", (HNSW_BUILD_WORK_MEM,))
+    cursor.execute("SET LOCAL max_parallel_maintenance_workers = %s", (HNSW_BUILD_WORKERS,))
+    cursor.execute(f"""
+        CREATE INDEX IF NOT EXISTS idx_reddit_hnsw_ip ON reddit_embeddings
+        USING hnsw (embedding_vector {opclass}) WITH (m = {m}, ef_construction = {ef_construction})
+        WHERE embedding_vector IS NOT NULL
+    """)
+
+# Searches shortlist candidates through an HNSW index over binary-quantized
+# vectors (1 bit per dimension, a fraction of the halfvec index's size, so
+# it stays in page cache) when migrate_search_indexes.py has built one, and
+# rerank only those with the full inner product
+BINARY_RERANK_CANDIDATES = 50
+
+_use_binary_rerank = False
+
+def ensure_search_indexes(db_connection):
+    """Make sure the indexes behind both retrieval queries exist.
+    
+    The HNSW index turns the top-k search into an O(log N) graph walk
+    inside Postgres instead of a scan of every stored embedding. Stored
+    vectors are unit length, so the index uses inner product, which skips
+    the per-row norm that cosine distance computes. The trigram GIN index
+    lets the coin lookup's ILIKE '%...%' use an index instead of
+    case-folding every row.
+    
+    Only CREATE INDEX IF NOT EXISTS runs here. Normalizing older databases,
+    converting the column to halfvec and building the binary-quantized
+    index rewrite or scan the whole table, so they are left to the one-off
+    migrate_search_indexes.py.
+    """
+    global _hnsw_ef_search, _use_binary_rerank
+    cursor = db_connection.cursor()
+    try:
+        # The planner's row estimate is enough to size the graph and costs no scan
+        cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass('reddit_embeddings')")
+        row = cursor.fetchone()
+        vector_count = max(int(row[0] or 0), 0) if row else 0
+        m, ef_construction, _hnsw_ef_search = configure_hnsw_params(vector_count)
+        logger.info(f"HNSW parameters for ~{vector_count} posts: m={m}, ef_construction={ef_construction}, ef_search={_hnsw_ef_search}")
+        
+        cursor.execute(_VECTOR_COLUMN_TYPE_SQL)
+        row = cursor.fetchone()
+        column_type = row[0] if row else None
+        cursor.execute(
+            "SELECT bool_or(to_regclass(name) IS NOT NULL) FROM unnest(%s::text[]) AS name",
+            (list(LEGACY_COSINE_INDEXES),)
+        )
+        has_cosine_index = cursor.fetchone()[0]
+        cursor.execute("SELECT to_regclass('idx_reddit_hnsw_bit') IS NOT NULL")
+        has_binary_index = cursor.fetchone()[0]
+        if has_cosine_index:
+            # Rows from before the inner-product index may not be unit length
+            logger.warning("reddit_embeddings still has a cosine index; run migrate_search_indexes.py")
+        elif column_type:
+            if column_type.startswith('vector'):
+                logger.info("embedding_vector is not halfvec; migrate_search_indexes.py converts it")
+            opclass = 'halfvec_ip_ops' if column_type.startswith('halfvec') else 'vector_ip_ops'
+            _create_hnsw_index(cursor, opclass, m, ef_construction)
+        _use_binary_rerank = bool(has_binary_index)
+        db_connection.commit()
+    except Exception as e:
+        logger.warning(f"Could not create HNSW index on reddit_embeddings: {e}")
+        db_connection.rollback()
+    
+    statements = [
+        ("pg_trgm extension", "CREATE EXTENSION IF NOT EXISTS pg_trgm"),
+        ("trigram index on coin_data_structured", """
+            CREATE INDEX IF NOT EXISTS idx_coin_trgm ON coin_data_structured
+            USING gin ("Name" gin_trgm_ops, "Symbol" gin_trgm_ops)
+        """),
+    ]
+    for description, statement in statements:
+        try:
+            cursor.execute(statement)
+            db_connection.commit()
+        except Exception as e:
+            logger.warning(f"Could not create {description}: {e}")
+            db_connection.rollback()
+
+class _SearchConnection(psycopg2.extensions.connection):
+    """psycopg2 connection that registers the pgvector adapter, applies the
+    search session settings and prepares the retrieval queries once on open."""
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.vector_adapter = False
+        if HAVE_PGVECTOR:
+            try:
+                register_vector(self)
+                self.commit()
+                self.vector_adapter = True
+            except Exception as e:
+                logger.warning(f"Could not register pgvector adapter: {e}")
+                self.rollback()
+        if not _schema_probed:
+            # Probe the schema while the connection is set up, so no query pays for it
+            try:
+                _probe_schema(self)
+                self.commit()
+            except Exception as e:
+                logger.warning(f"Could not probe reddit_embeddings schema: {e}")
+                self.rollback()
+        configure_connection(self)
+        self.prepared = prepare_statements(self)
+
+class _MockPool:
+    """Stand-in for the connection pool in mock mode."""
+    
+    def getconn(self):
+        return get_db_connection()
+    
+    def putconn(self, conn, close=False):
+        pass
+    
+    def closeall(self):
+        pass
+
+# Bounds for the shared connection pool
+DB_POOL_MINCONN = int(os.getenv('DB_POOL_MINCONN', '2'))
+DB_POOL_MAXCONN = int(os.getenv('DB_POOL_MAXCONN', '10'))
+
+_pool = None
+_pool_lock = threading.Lock()
+# ThreadedConnectionPool raises PoolError once maxconn connections are out;
+# this makes borrowers wait for a free connection instead
+_pool_slots = threading.BoundedSemaphore(DB_POOL_MAXCONN)
+
+def _get_pool():
+    """Create the process-wide connection pool on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            if MOCK_MODE:
+                _pool = _MockPool()
+            else:
+                _pool = psycopg2.pool.ThreadedConnectionPool(
+                    DB_POOL_MINCONN,
+                    DB_POOL_MAXCONN,
+                    dbname=db_name,
+                    user=db_user,
+                    password=db_password,
+                    host=db_host,
+                    port=db_port,
+                    connection_factory=_SearchConnection
+                )
+                logger.info(f"Opened database pool ({DB_POOL_MINCONN}-{DB_POOL_MAXCONN} connections)")
+        return _pool
+
+@contextlib.contextmanager
+def db():
+    """Borrow a connection from the pool for the duration of a with block."""
+    pool = _get_pool()
+    with _pool_slots:
+        conn = pool.getconn()
+        try:
+            yield conn
+        finally:
+            # Drop connections the server closed rather than handing them out again
+            pool.putconn(conn, close=bool(getattr(conn, 'closed', False)))
+
+def close_pool():
+    """Close every pooled connection."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
+
+def _pooled(func):
+    """Run func on a pooled connection when the caller does not pass one."""
+    @functools.wraps(func)
+    def wrapper(query, db_connection=None, *args, **kwargs):
+        if db_connection is not None:
+            return func(query, db_connection, *args, **kwargs)
+        with db() as conn:
+            return func(query, conn, *args, **kwargs)
+    return wrapper
+
+def _parse_embeddings(texts):
+    """Parse stored '[x, y, ...]' embedding strings into one float32 matrix.
+    
+    The strings are joined and handed to a single np.fromstring call, so a
+    whole block is parsed in C in one pass instead of one call (or one
+    Python float object per element, as with ast.literal_eval) per row.
+    """
+    flat = np.fromstring(",".join(text.strip()[1:-1] for text in texts), sep=',', dtype=np.float32)
+    return flat.reshape(len(texts), -1)
+
+def _iter_embedding_blocks(db_connection, block_size=1000):
+    """Stream Reddit posts and their text embeddings in blocks.
+    
+    A named (server-side) cursor keeps the table on the server, so only
+    one block of rows is transferred and held at a time.
+    
+    Yields:
+        (rows, embeddings) where rows are (post_id, title, text, embedding)
+        tuples and embeddings is a (len(rows), dim) float32 array
+    """
+    cursor = db_connection.cursor(name="reddit_embeddings_scan")
+    cursor.itersize = block_size
+    try:
+        cursor.execute("SELECT post_id, title, text, embedding FROM reddit_embeddings WHERE embedding IS NOT NULL")
+        while True:
+            rows = cursor.fetchmany(block_size)
+            if not rows:
+                break
+            yield list(rows), _parse_embeddings([row[3] for row in rows])
+    finally:
+        cursor.close()
+
+# Rows upcast to float32 at a time when scoring the in-memory matrix
+SEARCH_BLOCK_ROWS = 4096
+
+# Offload the in-memory search to the GPU, only worth the transfer for
+# collections well beyond CPU cache sizes
+USE_GPU = os.getenv('USE_GPU', 'false').lower() in ('1', 'true', 'yes')
+GPU_MIN_ROWS = 100_000
+
+def _vector_param(db_connection, embedding):
+    """Return a unit-length query vector in the form the connection binds best."""
+    vector = unit_vector(embedding)
+    if getattr(db_connection, "vector_adapter", False):
+        # The pgvector adapter renders a float32 array as a compact '[...]'
+        # literal instead of psycopg2's ARRAY[...] of Python floats
+        return np.asarray(vector, dtype=np.float32)
+    return vector
+
+def _normalize_rows(embeddings):
+    """Scale each row of a float32 matrix to unit length in place."""
+    norms = np.sqrt(np.einsum('ij,ij->i', embeddings, embeddings))
+    norms[norms == 0] = 1
+    embeddings /= norms[:, None]
+    return embeddings
+
+if HAVE_NUMBA:
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _topk_dot(M, q, k):
+        """Return (indices, scores) of the k rows of M with the largest dot product with q.
+        
+        M must be a C-contiguous float32 matrix and q a float32 vector.
+        """
+        n, d = M.shape
+        sims = np.empty(n, dtype=np.float32)
+        for i in prange(n):
+            s = np.float32(0.0)
+            for j in range(d):
+                s += M[i, j] * q[j]
+            sims[i] = s
+        
+        # k is small, so an insertion-sorted buffer beats a heap or partition
+        top = np.full(k, -1, dtype=np.int64)
+        scores = np.full(k, -np.inf, dtype=np.float32)
+        for i in range(n):
+            s = sims[i]
+            if s > scores[k - 1]:
+                pos = k - 1
+                while pos > 0 and scores[pos - 1] < s:
+                    scores[pos] = scores[pos - 1]
+                    top[pos] = top[pos - 1]
+                    pos -= 1
+                scores[pos] = s
+                top[pos] = i
+        return top, scores
+
+# On-disk copy of the in-memory search matrix, so a new process memory-maps
+# it instead of re-reading and re-parsing every embedding from the database
+EMBEDDING_MATRIX_PATH = os.getenv('EMBEDDING_MATRIX_PATH', os.path.join(CACHE_DIR, 'reddit_embeddings.f16.bin'))
+
+class _EmbeddingMatrix:
+    """Row-normalized float16 matrix of every stored Reddit text embedding.
+    
+    Loaded once per process on first use. With unit-length rows, cosine
+    similarity for a query is a single matrix-vector product, so no norms
+    are recomputed per call. Rows are kept as float16, which halves the
+    memory the search streams through at a negligible cost in ranking.
+    
+    The matrix is persisted to EMBEDDING_MATRIX_PATH and memory-mapped by
+    later processes. A JSON header beside it holds the post ids in row
+    order and a fingerprint of the ids and embeddings; the matrix is
+    rebuilt when the fingerprint no longer matches the table. Titles and
+    texts are not written to disk; they are read from the database on load.
+    """
+    rows = None
+    M = None
+    M_gpu = None
+    _lock = threading.Lock()
+    
+    @staticmethod
+    def _header_path(path):
+        return path + '.json'
+    
+    @staticmethod
+    def _fingerprint(db_connection):
+        """Hash every embedded post's id and embedding in Postgres, or None if the query fails.
+        
+        Any insert, delete or re-embedding changes the hash, while only one
+        short string crosses the wire.
+        """
+        try:
+            cursor = db_connection.cursor()
+            cursor.execute("""
+                SELECT count(*) || ':' || coalesce(md5(string_agg(post_id || ':' || md5(embedding), ',' ORDER BY post_id)), '')
+                FROM reddit_embeddings WHERE embedding IS NOT NULL
+            """)
+            return cursor.fetchone()[0]
+        except Exception as e:
+            logger.warning(f"Could not fingerprint Reddit embeddings: {e}")
+            db_connection.rollback()
+            return None
+    
+    @staticmethod
+    def _post_rows(db_connection, post_ids):
+        """Fetch (post_id, title, text) for post_ids in order, or None if any is missing."""
+        cursor = db_connection.cursor()
+        cursor.execute("SELECT post_id, title, text FROM reddit_embeddings WHERE embedding IS NOT NULL")
+        by_id = {row[0]: tuple(row) for row in cursor.fetchall()}
+        try:
+            return [by_id[post_id] for post_id in post_ids]
+        except KeyError:
+            return None
+    
+    @classmethod
+    def _read_file(cls, path, db_connection, fingerprint):
+        """Memory-map a saved matrix, or return None if missing or stale."""
+        try:
+            with open(cls._header_path(path)) as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if fingerprint is None or saved.get('fingerprint') != fingerprint:
+            logger.info("Saved Reddit embedding matrix is stale; rebuilding")
+            return None
+        rows = cls._post_rows(db_connection, saved['ids'])
+        if rows is None:
+            return None
+        if not rows:
+            return [], np.empty((0, 0), dtype=np.float16)
+        try:
+            M = np.memmap(path, dtype=np.float16, mode='r', shape=(len(rows), saved['dim']))
+        except (OSError, ValueError):
+            return None
+        return rows, M
+    
+    @classmethod
+    def _write_file(cls, path, rows, M, fingerprint):
+        """Save the matrix and its header, replacing any previous copy atomically."""
+        try:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            M.tofile(path + '.tmp')
+            with open(cls._header_path(path) + '.tmp', 'w') as f:
+                json.dump({
+                    "fingerprint": fingerprint,
+                    "dim": M.shape[1] if M.size else 0,
+                    "ids": [row[0] for row in rows]
+                }, f)
+            os.replace(path + '.tmp', path)
+            os.replace(cls._header_path(path) + '.tmp', cls._header_path(path))
+        except OSError as e:
+            logger.warning(f"Could not save Reddit embedding matrix to {path}: {e}")
+    
+    @classmethod
+    def load(cls, db_connection):
+        """Load the matrix from disk or the database unless it is already loaded."""
+        with cls._lock:
+            if cls.M is None:
+                # Mock rows are not worth saving and must not replace a real copy
+                path = EMBEDDING_MATRIX_PATH if not MOCK_MODE else None
+                fingerprint = cls._fingerprint(db_connection) if path else None
+                saved = cls._read_file(path, db_connection, fingerprint) if path else None
+                if saved is not None:
+                    cls.rows, cls.M = saved
+                    logger.info(f"Mapped {len(cls.rows)} Reddit embeddings from {path}")
+                else:
+                    rows, blocks = [], []
+                    for block_rows, embeddings in _iter_embedding_blocks(db_connection):
+                        rows.extend(tuple(row[:3]) for row in block_rows)
+                        blocks.append(_normalize_rows(embeddings).astype(np.float16))
+                    cls.rows = rows
+                    cls.M = np.concatenate(blocks) if blocks else np.empty((0, 0), dtype=np.float16)
+                    logger.info(f"Loaded {len(rows)} Reddit embeddings into memory")
+                    # Without a fingerprint a saved copy could never be validated
+                    if path and fingerprint is not None:
+                        cls._write_file(path, rows, cls.M, fingerprint)
+                if USE_GPU and len(cls.rows) >= GPU_MIN_ROWS:
+                    if HAVE_CUPY:
+                        cls.M_gpu = cupy.asarray(cls.M)
+                        logger.info("Copied Reddit embeddings to the GPU")
+                    else:
+                        logger.warning("USE_GPU is set but cupy is not installed; searching on the CPU")
+        return cls
+    
+    @classmethod
+    def invalidate(cls):
+        """Drop the loaded matrix and its saved copy so the next search rebuilds it."""
+        with cls._lock:
+            cls.rows, cls.M, cls.M_gpu = None, None, None
+            if not EMBEDDING_MATRIX_PATH or MOCK_MODE:
+                return
+            for stale in (EMBEDDING_MATRIX_PATH, cls._header_path(EMBEDDING_MATRIX_PATH)):
+                try:
+                    os.remove(stale)
+                except OSError:
+                    pass
+    
+    @classmethod
+    def search(cls, query_embedding, top_k):
+        """Return the top_k (row, similarity) pairs, most similar first."""
+        if not cls.rows or top_k <= 0:
+            return []
+        q = np.asarray(query_embedding, dtype=np.float32)
+        norm = np.sqrt(np.vdot(q, q))
+        if norm:
+            q = q / norm
+        k = min(top_k, len(cls.rows))
+        
+        if cls.M_gpu is not None:
+            sims = cls.M_gpu @ cupy.asarray(q, dtype=cupy.float16)
+            top = cupy.argpartition(-sims, k - 1)[:k]
+            top = top[cupy.argsort(-sims[top])]
+            top, scores = cupy.asnumpy(top), cupy.asnumpy(sims[top])
+        elif HAVE_SIMSIMD:
+            # Reads the float16 matrix as stored, with no float32 upcast; rows
+            # and query are unit length, so the dot product is the cosine
+            q16 = q.astype(np.float16)[np.newaxis, :]
+            sims = np.asarray(simsimd.cdist(q16, cls.M, metric='dot'), dtype=np.float32).ravel()
+            top = np.argpartition(-sims, k - 1)[:k]
+            top = top[np.argsort(-sims[top])]
+            scores = sims[top]
+        elif HAVE_NUMBA:
+            # The kernel returns each block's top k; merge the short candidate lists
+            candidates, candidate_scores = [], []
+            for start in range(0, len(cls.rows), SEARCH_BLOCK_ROWS):
+                block = cls.M[start:start + SEARCH_BLOCK_ROWS].astype(np.float32)
+                block_top, block_scores = _topk_dot(block, q, min(k, len(block)))
+                candidates.append(block_top + start)
+                candidate_scores.append(block_scores)
+            candidates = np.concatenate(candidates)
+            candidate_scores = np.concatenate(candidate_scores)
+            order = np.argsort(-candidate_scores)[:k]
+            top, scores = candidates[order], candidate_scores[order]
+        else:
+            # Upcast one block at a time so the products accumulate in float32
+            sims = np.empty(len(cls.rows), dtype=np.float32)
+            for start in range(0, len(sims), SEARCH_BLOCK_ROWS):
+                block = cls.M[start:start + SEARCH_BLOCK_ROWS]
+                sims[start:start + len(block)] = block.astype(np.float32) @ q
+            # argpartition selects the top k in O(N); only those k get sorted
+            top = np.argpartition(-sims, k - 1)[:k]
+            top = top[np.argsort(-sims[top])]
+            scores = sims[top]
+        
+        return [(cls.rows[idx], float(score)) for idx, score in zip(top, scores)]
+
+# A retrieved Reddit post; lighter to build than a dict per row
+Post = namedtuple('Post', ('post_id', 'title', 'content', 'similarity'))
+
+# Type of the pgvector column on reddit_embeddings ('vector' or 'halfvec'),
+# or None without one. Probed when the first pooled connection opens,
+# never per query
+_VECTOR_COLUMN_TYPE = None
+_schema_probed = False
+_schema_lock = threading.Lock()
+
+def _probe_schema(db_connection):
+    """Read the type of embedding_vector from the catalog and cache it."""
+    global _VECTOR_COLUMN_TYPE, _schema_probed
+    with _schema_lock:
+        cursor = db_connection.cursor()
+        cursor.execute(_VECTOR_COLUMN_TYPE_SQL)
+        row = cursor.fetchone()
+        _VECTOR_COLUMN_TYPE = row[0].split('(')[0] if row and row[0] else None
+        _schema_probed = True
+        logger.info(f"reddit_embeddings pgvector column type: {_VECTOR_COLUMN_TYPE}")
+        return _VECTOR_COLUMN_TYPE
+
+def _vector_column_type(db_connection):
+    """Return the base type of embedding_vector, probing only if no connection has yet."""
+    if _schema_probed:
+        return _VECTOR_COLUMN_TYPE
+    return _probe_schema(db_connection)
+
 # Function to retrieve relevant Reddit data (unstructured)
-def retrieve_reddit_data(query, db_connection, top_k=3):
-    """Retrieve top k most relevant Reddit posts based on semantic similarity using pgvector."""
+@_pooled
+def retrieve_reddit_data(query, db_connection, top_k=3, query_embedding=None):
+    """Retrieve top k most relevant Reddit posts based on semantic similarity using pgvector.
+    
+    Args:
+        query_embedding: Embedding of query if the caller already has it;
+            computed here otherwise
+    
+    Returns:
+        List of Post tuples, most similar first
+    """
     # Create data lineage nodes
     lineage = get_lineage_tracker()
     query_node_id = lineage.add_node(
@@ -119,7 +874,8 @@ def retrieve_reddit_data(query, db_connection, top_k=3):
     )
     
     # Generate the embedding for the query using OpenAI
-    query_embedding = get_embedding(query)
+    if query_embedding is None:
+        query_embedding = get_embedding(query)
     
     # Add embedding node in lineage
     embedding_node_id = lineage.add_node(
@@ -134,7 +890,7 @@ def retrieve_reddit_data(query, db_connection, top_k=3):
         source_id=query_node_id,
         target_id=embedding_node_id,
         operation="embed",
-        metadata={"model": "text-embedding-ada-002"}
+        metadata={"model": EMBEDDING_MODEL}
     )
     
     # Connect to the database
@@ -142,15 +898,15 @@ def retrieve_reddit_data(query, db_connection, top_k=3):
     
     try:
         # First check if our table is using the vector column
-        cursor.execute("SELECT EXISTS (SELECT FROM information_schema.columns WHERE table_name = 'reddit_embeddings' AND column_name = 'embedding_vector')")
-        has_vector_column = cursor.fetchone()[0]
+        vector_type = _vector_column_type(db_connection)
+        has_vector_column = vector_type is not None
         
         # Create database source node in lineage
         db_source_id = lineage.add_node(
             node_type="source",
             name="PostgreSQL Database",
             description="Database containing Reddit posts with embeddings",
-            metadata={"table": "reddit_embeddings", "has_vector_column": has_vector_column}
+            metadata={"table": "reddit_embeddings", "has_vector_column": has_vector_column, "vector_type": vector_type}
         )
         
         with LineageContext(
@@ -164,71 +920,80 @@ def retrieve_reddit_data(query, db_connection, top_k=3):
             
             if has_vector_column:
                 logger.info("Using pgvector for similarity search")
-                # Use pgvector's cosine distance operator (<->) for similarity search
-                cursor.execute("""
-                    SELECT post_id, title, text, 1 - (embedding_vector <-> %s::vector) as similarity 
-                    FROM reddit_embeddings
-                    WHERE embedding_vector IS NOT NULL
-                    ORDER BY embedding_vector <-> %s::vector
-                    LIMIT %s
-                """, (query_embedding, query_embedding, top_k))
+                # Stored vectors are unit length, so pgvector's negative inner
+                # product <#> ranks like cosine distance and is served by the HNSW index
+                query_vector = _vector_param(db_connection, query_embedding)
+                # SET LOCAL scopes ef_search to this transaction and travels
+                # in the same round trip as the search
+                set_ef_search = f"SET LOCAL hnsw.ef_search = {_hnsw_ef_search}; "
+                if _use_binary_rerank:
+                    # Shortlist by Hamming distance on the bit index, then
+                    # rank the shortlist by the full inner product. The vector
+                    # is bound in both places: a CTE referenced twice is
+                    # materialized, and the bit index can only order by a
+                    # constant, not a column from the CTE scan
+                    candidates = max(BINARY_RERANK_CANDIDATES, top_k)
+                    cursor.execute(f"SET LOCAL hnsw.ef_search = {max(_hnsw_ef_search, candidates)}; " + f"""
+                        WITH shortlist AS (
+                            SELECT post_id, title, text, embedding_vector
+                            FROM reddit_embeddings
+                            WHERE embedding_vector IS NOT NULL
+                            ORDER BY binary_quantize(embedding_vector)::bit(1536) <~> binary_quantize(%s::{vector_type})
+                            LIMIT %s
+                        )
+                        SELECT post_id, title, text, embedding_vector <#> %s::{vector_type} AS distance
+                        FROM shortlist
+                        ORDER BY distance
+                        LIMIT %s
+                    """, (query_vector, candidates, query_vector, top_k))
+                elif "reddit_ann" in getattr(db_connection, "prepared", ()):
+                    cursor.execute(set_ef_search + f"EXECUTE reddit_ann(%s::{vector_type}, %s)", (query_vector, top_k))
+                else:
+                    # Bind the vector once; Postgres flattens the CTE, so
+                    # q.v is still a constant the HNSW index can order by
+                    cursor.execute(set_ef_search + f"""
+                        WITH q AS (SELECT %s::{vector_type} AS v)
+                        SELECT post_id, title, text, embedding_vector <#> q.v AS distance
+                        FROM reddit_embeddings, q
+                        WHERE embedding_vector IS NOT NULL
+                        ORDER BY distance
+                        LIMIT %s
+                    """, (query_vector, top_k))
                 
                 rows = cursor.fetchall()
                 
-                if rows:
-                    top_posts = []
-                    for row in rows:
-                        top_posts.append({
-                            "post_id": row[0],
-                            "title": row[1],
-                            "content": row[2],
-                            "similarity": row[3]
-                        })
-                    
-                    # Update lineage metadata
-                    lineage.get_node(results_id).metadata.update({
-                        "posts_found": len(top_posts),
-                        "max_similarity": max([post["similarity"] for post in top_posts]) if top_posts else 0,
-                        "search_method": "pgvector"
-                    })
-                    
-                    logger.info(f"Found {len(top_posts)} similar posts using pgvector")
-                    return top_posts
+                # <#> is the negative inner product, so similarity is its negation
+                top_posts = [Post(post_id, title, text, -distance) for post_id, title, text, distance in rows]
+                
+                # Update lineage metadata
+                lineage.update_node_metadata(results_id, {
+                    "posts_found": len(top_posts),
+                    "max_similarity": max(post.similarity for post in top_posts) if top_posts else 0,
+                    "search_method": "pgvector"
+                })
+                
+                logger.info(f"Found {len(top_posts)} similar posts using pgvector")
+                return top_posts
             
-            # Fallback to the original in-memory approach if pgvector is not available
+            # The in-memory path only serves schemas without the pgvector column
             logger.info("Falling back to in-memory similarity calculation")
-            cursor.execute("SELECT post_id, title, text, embedding FROM reddit_embeddings")
-            rows = cursor.fetchall()
+            matches = _EmbeddingMatrix.load(db_connection).search(query_embedding, top_k)
             
-            if not rows:
+            if not matches:
                 # Update lineage metadata to show no results
-                lineage.get_node(results_id).metadata.update({
+                lineage.update_node_metadata(results_id, {
                     "posts_found": 0,
                     "search_method": "fallback",
                     "error": "No Reddit posts found in database"
                 })
                 return []
             
-            embeddings = np.array([np.array(ast.literal_eval(row[3])) for row in rows])  # Convert string to list
-            similarities = cosine_similarity([query_embedding], embeddings)[0]
-            
-            # Find the most similar posts
-            top_indices = similarities.argsort()[-top_k:][::-1]  # Get indices of top k similarity scores
-            top_posts = []
-            
-            for idx in top_indices:
-                post = rows[idx]
-                top_posts.append({
-                    "post_id": post[0],
-                    "title": post[1],
-                    "content": post[2],
-                    "similarity": similarities[idx]
-                })
+            top_posts = [Post(*post, similarity) for post, similarity in matches]
             
             # Update lineage metadata
-            lineage.get_node(results_id).metadata.update({
+            lineage.update_node_metadata(results_id, {
                 "posts_found": len(top_posts),
-                "max_similarity": max([post["similarity"] for post in top_posts]) if top_posts else 0,
+                "max_similarity": max(post.similarity for post in top_posts) if top_posts else 0,
                 "search_method": "in-memory"
             })
             
@@ -238,6 +1003,67 @@ def retrieve_reddit_data(query, db_connection, top_k=3):
         return []
 
 # Function to retrieve relevant structured data (crypto prices, market cap, etc.)
+# Most coins returned for one query, largest market cap first
+STRUCTURED_RESULT_LIMIT = 20
+
+# Seconds the in-memory coin index is trusted before it is reloaded
+COIN_INDEX_TTL = 300
+
+class _CoinIndex:
+    """In-memory copy of coin_data_structured, keyed by lowercase name and symbol.
+    
+    The coin universe is small and only changes when the scraper runs, so
+    lookups are served from memory with no database round trip. The copy
+    is reloaded once it is older than COIN_INDEX_TTL.
+    """
+    rows = None
+    by_key = None
+    loaded_at = 0.0
+    _lock = threading.Lock()
+    
+    @classmethod
+    def load(cls, db_connection):
+        """Return the index, reloading it if missing or expired; None if it cannot load."""
+        with cls._lock:
+            if cls.rows is None or time.monotonic() - cls.loaded_at > COIN_INDEX_TTL:
+                try:
+                    cursor = db_connection.cursor()
+                    cursor.execute("""
+                        SELECT "Name", "Symbol", "Price (USD)", "Market Cap (USD)", "24h Volume (USD)", "Circulating Supply" 
+                        FROM coin_data_structured
+                        ORDER BY "Market Cap (USD)" DESC NULLS LAST
+                    """)
+                    rows = [tuple(row) for row in cursor.fetchall()]
+                except Exception as e:
+                    logger.warning(f"Could not load coin index: {e}")
+                    db_connection.rollback()
+                    return None
+                by_key = {}
+                for row in rows:
+                    for key in (row[0], row[1]):
+                        if key:
+                            by_key.setdefault(key.lower(), []).append(row)
+                cls.rows, cls.by_key, cls.loaded_at = rows, by_key, time.monotonic()
+                logger.info(f"Loaded {len(rows)} coins into the coin index")
+        return cls
+    
+    @classmethod
+    def lookup(cls, query):
+        """Return rows whose name or symbol equals the query, else those containing it."""
+        needle = query.strip().lower()
+        exact = cls.by_key.get(needle)
+        if exact:
+            return exact
+        # rows are kept in market cap order, so the first matches are the largest
+        matches = []
+        for row in cls.rows:
+            if needle in (row[0] or "").lower() or needle in (row[1] or "").lower():
+                matches.append(row)
+                if len(matches) == STRUCTURED_RESULT_LIMIT:
+                    break
+        return matches
+
+@_pooled
 def retrieve_structured_data(query, db_connection):
     """Retrieve structured market data for cryptocurrencies matching the query."""
     # Create data lineage nodes
@@ -268,13 +1094,38 @@ def retrieve_structured_data(query, db_connection):
         target_type="dataset",
         metadata={"timestamp": datetime.now().isoformat()}
     ) as results_id:
-        # Define your query to fetch the relevant structured data
-        cursor.execute("""
-            SELECT "Name", "Symbol", "Price (USD)", "Market Cap (USD)", "24h Volume (USD)", "Circulating Supply" 
-            FROM coin_data_structured
-            WHERE "Name" ILIKE %s OR "Symbol" ILIKE %s
-        """, (f"%{query}%", f"%{query}%"))
-        rows = cursor.fetchall()
+        prepared = getattr(db_connection, "prepared", ())
+        
+        # Serve the query from the in-memory coin index when it is available
+        index = None if MOCK_MODE else _CoinIndex.load(db_connection)
+        if index is not None:
+            rows = index.lookup(query)
+        else:
+            # Most queries name a coin outright ("ETH", "Ethereum"); try an exact
+            # match on the Symbol primary key and the Name index first
+            if "coin_exact" in prepared:
+                cursor.execute("EXECUTE coin_exact(%s)", (query,))
+            else:
+                cursor.execute("""
+                    SELECT "Name", "Symbol", "Price (USD)", "Market Cap (USD)", "24h Volume (USD)", "Circulating Supply" 
+                    FROM coin_data_structured
+                    WHERE "Symbol" = upper(%s) OR "Name" = %s
+                """, (query, query))
+            rows = cursor.fetchall()
+        
+        # Fall back to the trigram-indexed substring search
+        if not rows and index is None:
+            if "coin_search" in prepared:
+                cursor.execute("EXECUTE coin_search(%s, %s)", (f"%{query}%", STRUCTURED_RESULT_LIMIT))
+            else:
+                cursor.execute("""
+                    SELECT "Name", "Symbol", "Price (USD)", "Market Cap (USD)", "24h Volume (USD)", "Circulating Supply" 
+                    FROM coin_data_structured
+                    WHERE "Name" ILIKE %s OR "Symbol" ILIKE %s
+                    ORDER BY "Market Cap (USD)" DESC NULLS LAST
+                    LIMIT %s
+                """, (f"%{query}%", f"%{query}%", STRUCTURED_RESULT_LIMIT))
+            rows = cursor.fetchall()
         
         # Format the structured data 
         if rows:
@@ -290,7 +1141,7 @@ def retrieve_structured_data(query, db_connection):
                 })
             
             # Update lineage metadata
-            lineage.get_node(results_id).metadata.update({
+            lineage.update_node_metadata(results_id, {
                 "coins_found": len(structured_data),
                 "coins": [item["symbol"] for item in structured_data]
             })
@@ -298,15 +1149,132 @@ def retrieve_structured_data(query, db_connection):
             return structured_data
         else:
             # Update lineage metadata to show no results
-            lineage.get_node(results_id).metadata.update({
+            lineage.update_node_metadata(results_id, {
                 "coins_found": 0,
                 "error": "No matching cryptocurrency data found"
             })
             
             return []
 
-def generate_conversational_response(query, structured_data, reddit_posts):
-    """Generate a conversational response using LLM based on retrieved data."""
+# Prompt pieces are built once at import instead of re-rendered per call.
+# SYSTEM_PROMPT must stay byte-identical between calls so OpenAI can serve
+# it from its prompt prefix cache; anything per-request goes in the user message.
+SYSTEM_PROMPT = """You are CryptoInsightBot, a helpful assistant specializing in cryptocurrency information.
+Your task is to create a conversational, helpful response based on the provided context information.
+You should synthesize the information and present it in a natural, informative way that directly answers the user's query.
+Include relevant market data and community discussions from the context, but paraphrase them in your own words.
+Make sure your response feels like a cohesive answer rather than just listing facts.
+If there are contradictions in the sources, acknowledge them and provide a balanced view.
+Keep your response concise yet informative, focusing on the most relevant details for the user's query.
+Do not mention "the context" or "the data" in your response - present the information as your own knowledge.
+Do not make up information that isn't in the provided context."""
+
+_COIN_TEMPLATE = """Market Data for {name} ({symbol}):
+- Current Price: ${price:,.2f}
+- Market Cap: ${market_cap:,.2f}
+- 24h Trading Volume: ${volume_24h:,.2f}
+- Circulating Supply: {circulating_supply:,.0f} {symbol}"""
+
+_POST_TEMPLATE = """Reddit Discussion {index}:
+Title: {title}
+Content: {content}"""
+
+_USER_PROMPT_TEMPLATE = """User Query: {query}
+
+Context Information:
+{context}
+
+Please provide a helpful, conversational response to the user's query based on this context."""
+
+# Context window of CHAT_MODEL and the part of it reserved for the answer
+CHAT_CONTEXT_TOKENS = 16385
+RESPONSE_MAX_TOKENS = 500
+
+def _build_context(structured_data, reddit_posts):
+    """Render coins and posts through the prebuilt templates into one context string."""
+    context_parts = []
+    if structured_data:
+        context_parts.extend(map(_COIN_TEMPLATE.format_map, structured_data))
+    if reddit_posts:
+        context_parts.extend(
+            _POST_TEMPLATE.format(index=i, title=post.title, content=post.content)
+            for i, post in enumerate(reddit_posts, 1)
+        )
+    return "\n\n".join(context_parts)
+
+def _fit_posts_to_budget(prompt_tokens, reddit_posts):
+    """Trim post contents evenly so the prompt leaves room for the answer.
+    
+    Sending an oversized prompt costs a failed API round trip, so the
+    overflow is cut from the Reddit posts, the longest and least dense
+    part of the context.
+    """
+    overflow = prompt_tokens - (CHAT_CONTEXT_TOKENS - RESPONSE_MAX_TOKENS)
+    if overflow <= 0 or not reddit_posts:
+        return reddit_posts
+    post_tokens = sum(count_tokens(post.content, CHAT_MODEL) for post in reddit_posts)
+    per_post = max(0, (post_tokens - overflow) // len(reddit_posts))
+    logger.info(f"Prompt is {overflow} tokens over budget; trimming posts to {per_post} tokens each")
+    return [post._replace(content=truncate_tokens(post.content, per_post, CHAT_MODEL)) for post in reddit_posts]
+
+# Running totals of prompt tokens sent and served from OpenAI's prompt cache
+_prompt_usage = {"prompt_tokens": 0, "cached_tokens": 0}
+_prompt_usage_lock = threading.Lock()
+
+def _record_prompt_usage(response):
+    """Log how much of the prompt OpenAI served from its prefix cache.
+    
+    The cache matches on identical leading tokens, which is why
+    SYSTEM_PROMPT comes first and every per-request value (query and
+    context) lives only in the user message.
+    
+    Returns:
+        Number of cached prompt tokens reported for this response
+    """
+    usage = response.get("usage") or {}
+    details = usage.get("prompt_tokens_details") or {}
+    cached_tokens = details.get("cached_tokens", 0)
+    with _prompt_usage_lock:
+        _prompt_usage["prompt_tokens"] += usage.get("prompt_tokens", 0)
+        _prompt_usage["cached_tokens"] += cached_tokens
+        total, cached = _prompt_usage["prompt_tokens"], _prompt_usage["cached_tokens"]
+    if total:
+        logger.info(f"Prompt cache: {cached_tokens} cached tokens this call, {cached / total:.0%} of {total} overall")
+    return cached_tokens
+
+def _stream_completion(response, lineage, response_id, on_complete=None):
+    """Yield text deltas from a streamed chat completion as they arrive.
+    
+    on_complete, if given, is called with the full text once the stream ends.
+    """
+    generated = []
+    for chunk in response:
+        delta = chunk.choices[0].delta.get("content", "")
+        if delta:
+            generated.append(delta)
+            yield delta
+    
+    generated_text = "".join(generated)
+    lineage.update_node_metadata(response_id, {
+        "model": CHAT_MODEL,
+        "response_length": len(generated_text),
+        "token_count": len(generated_text.split()),
+        "has_data": True,
+        "streamed": True
+    })
+    if on_complete is not None:
+        on_complete(generated_text)
+
+def _as_result(text, stream):
+    """Return text as-is, or as a one-chunk iterator when streaming."""
+    return iter([text]) if stream else text
+
+def generate_conversational_response(query, structured_data, reddit_posts, stream=False):
+    """Generate a conversational response using LLM based on retrieved data.
+    
+    With stream=True, returns an iterator of text chunks that yields tokens
+    as the model produces them instead of waiting for the full response.
+    """
     # Create data lineage nodes
     lineage = get_lineage_tracker()
     
@@ -348,89 +1316,77 @@ def generate_conversational_response(query, structured_data, reddit_posts):
     Would you like to know more about any specific aspect of Ethereum?
     """
             # Update lineage metadata
-            lineage.get_node(response_id).metadata.update({
+            lineage.update_node_metadata(response_id, {
                 "model": "mock",
                 "response_length": len(mock_response),
                 "is_mock": True
             })
             
-            return mock_response
-        
-        # Prepare the context
-        context_parts = []
-        
-        # Add structured data to the context
-        if structured_data:
-            for coin in structured_data:
-                context_parts.append(f"""
-    Market Data for {coin['name']} ({coin['symbol']}):
-    - Current Price: ${coin['price']:,.2f}
-    - Market Cap: ${coin['market_cap']:,.2f}
-    - 24h Trading Volume: ${coin['volume_24h']:,.2f}
-    - Circulating Supply: {coin['circulating_supply']:,.0f} {coin['symbol']}
-                """.strip())
-        
-        # Add Reddit posts to the context
-        if reddit_posts:
-            for i, post in enumerate(reddit_posts):
-                context_parts.append(f"""
-    Reddit Discussion {i+1}:
-    Title: {post['title']}
-    Content: {post['content']}
-                """.strip())
+            return _as_result(mock_response, stream)
         
         # Combine all context
-        full_context = "\n\n".join(context_parts)
+        full_context = _build_context(structured_data, reddit_posts)
         
         if not full_context:
             # Update lineage metadata to show no context
-            lineage.get_node(response_id).metadata.update({
+            lineage.update_node_metadata(response_id, {
                 "error": "No context data available",
                 "has_data": False
             })
             
-            return f"I'm sorry, but I couldn't find any information about {query} in my database."
+            return _as_result(f"I'm sorry, but I couldn't find any information about {query} in my database.", stream)
         
-        # Build the prompt for the LLM
-        system_prompt = """
-    You are CryptoInsightBot, a helpful assistant specializing in cryptocurrency information.
-    Your task is to create a conversational, helpful response based on the provided context information.
-    You should synthesize the information and present it in a natural, informative way that directly answers the user's query.
-    Include relevant market data and community discussions from the context, but paraphrase them in your own words.
-    Make sure your response feels like a cohesive answer rather than just listing facts.
-    If there are contradictions in the sources, acknowledge them and provide a balanced view.
-    Keep your response concise yet informative, focusing on the most relevant details for the user's query.
-    Do not mention "the context" or "the data" in your response - present the information as your own knowledge.
-    Do not make up information that isn't in the provided context.
-    """
+        # Keep the prompt inside the model's context window
+        user_prompt = _USER_PROMPT_TEMPLATE.format(query=query, context=full_context)
+        prompt_tokens = count_tokens(SYSTEM_PROMPT, CHAT_MODEL) + count_tokens(user_prompt, CHAT_MODEL)
+        if prompt_tokens > CHAT_CONTEXT_TOKENS - RESPONSE_MAX_TOKENS:
+            reddit_posts = _fit_posts_to_budget(prompt_tokens, reddit_posts)
+            full_context = _build_context(structured_data, reddit_posts)
+            user_prompt = _USER_PROMPT_TEMPLATE.format(query=query, context=full_context)
         
-        user_prompt = f"""
-    User Query: {query}
-    
-    Context Information:
-    {full_context}
-    
-    Please provide a helpful, conversational response to the user's query based on this context.
-    """
+        # Reuse an earlier answer to the same (or a near-identical) question
+        # asked over the same context; the embedding is already cached
+        query_embedding = get_embedding(query)
+        cached = _response_cache.get(query, full_context, query_embedding)
+        if cached is not None:
+            cached_response, cache_kind = cached
+            logger.info(f"Response cache hit ({cache_kind})")
+            lineage.update_node_metadata(response_id, {
+                "model": CHAT_MODEL,
+                "response_length": len(cached_response),
+                "has_data": True,
+                "cache_hit": cache_kind
+            })
+            return _as_result(cached_response, stream)
+        
+        def remember(text):
+            _response_cache.put(query, full_context, query_embedding, text)
         
         try:
             response = openai.ChatCompletion.create(
-                model="gpt-3.5-turbo",
+                model=CHAT_MODEL,
                 messages=[
-                    {"role": "system", "content": system_prompt},
+                    {"role": "system", "content": SYSTEM_PROMPT},
                     {"role": "user", "content": user_prompt}
                 ],
-                max_tokens=500,
-                temperature=0.7
+                max_tokens=RESPONSE_MAX_TOKENS,
+                temperature=0.7,
+                stream=stream
             )
             
+            if stream:
+                return _stream_completion(response, lineage, response_id, on_complete=remember)
+            
             generated_text = response.choices[0].message.content.strip()
+            remember(generated_text)
+            cached_tokens = _record_prompt_usage(response)
             
             # Update lineage metadata
-            lineage.get_node(response_id).metadata.update({
-                "model": "gpt-3.5-turbo",
+            lineage.update_node_metadata(response_id, {
+                "model": CHAT_MODEL,
                 "response_length": len(generated_text),
                 "token_count": len(generated_text.split()),
+                "cached_prompt_tokens": cached_tokens,
                 "has_data": True
             })
             
@@ -439,7 +1395,7 @@ def generate_conversational_response(query, structured_data, reddit_posts):
             logger.error(f"Error generating LLM response: {e}")
             
             # Update lineage metadata with error
-            lineage.get_node(response_id).metadata.update({
+            lineage.update_node_metadata(response_id, {
                 "error": str(e),
                 "error_type": type(e).__name__
             })
@@ -449,23 +1405,47 @@ def generate_conversational_response(query, structured_data, reddit_posts):
                 fallback = f"Based on my data, I found information about {query}. Here are some details: {full_context[:200]}..."
             else:
                 fallback = f"I'm sorry, but I couldn't find any information about {query} in my database."
-            return fallback
+            return _as_result(fallback, stream)
+
+# Shared workers for running the two retrievals of a query concurrently
+_retrieval_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="retrieval")
+
+def _embed_and_retrieve_reddit_data(query, db_connection, top_k):
+    """Embed the query, then run the Reddit search.
+    
+    The embedding round trip happens before a pooled connection is
+    borrowed, so no connection sits idle while OpenAI responds.
+    """
+    query_embedding = get_embedding(query)
+    return retrieve_reddit_data(query, db_connection, top_k=top_k, query_embedding=query_embedding)
 
 # Main function to handle the query and return a generated response
-def chat(query, db_connection, posts_limit=3):
-    """Process a user query and return a conversational response."""
+def chat(query, db_connection=None, posts_limit=3, stream=False):
+    """Process a user query and return a conversational response.
+    
+    Without an explicit db_connection, structured and Reddit retrieval run
+    concurrently, each on its own connection borrowed from the pool. A
+    psycopg2 connection cannot serve two queries at once, so with an
+    explicit db_connection they run one after the other. With stream=True
+    the response is an iterator of text chunks.
+    """
     logger.info(f"Processing query: {query}")
     
-    # Retrieve structured market data
-    structured_data = retrieve_structured_data(query, db_connection)
+    if db_connection is None:
+        # The market data lookup and the Reddit search (embedding API call plus
+        # vector query) are independent I/O, so run them at the same time
+        structured_future = _retrieval_executor.submit(retrieve_structured_data, query)
+        reddit_future = _retrieval_executor.submit(_embed_and_retrieve_reddit_data, query, None, posts_limit)
+        structured_data = structured_future.result()
+        reddit_posts = reddit_future.result()
+    else:
+        structured_data = retrieve_structured_data(query, db_connection)
+        reddit_posts = _embed_and_retrieve_reddit_data(query, db_connection, posts_limit)
     logger.info(f"Retrieved {len(structured_data)} structured data entries")
-    
-    # Retrieve relevant Reddit posts
-    reddit_posts = retrieve_reddit_data(query, db_connection, top_k=posts_limit)
     logger.info(f"Retrieved {len(reddit_posts)} relevant Reddit posts")
     
     # Generate conversational response
-    response = generate_conversational_response(query, structured_data, reddit_posts)
+    response = generate_conversational_response(query, structured_data, reddit_posts, stream=stream)
     logger.info("Generated conversational response")
     
     return response
@@ -501,25 +1481,28 @@ def main():
             }
         )
         
-        # Connect to the database
-        db_connection = get_db_connection()
+        # Borrow a pooled connection to check the search indexes
+        with db() as db_connection:
+            ensure_search_indexes(db_connection)
         
         # Get user query
         query = args.query
         
-        # Get the chat response
-        response = chat(query, db_connection, posts_limit=args.posts)
+        # Get the chat response; each concurrent retrieval uses its own pooled connection
+        response = chat(query, posts_limit=args.posts, stream=True)
         
-        # Generate lineage visualization
-        lineage.visualize(output_file='visualizations/rag_lineage.html')
-        lineage.export_json(output_file='visualizations/rag_lineage.json')
-        
-        # Display the response
+        # Display the response as it streams in
         print("\n" + "="*50)
         print(f"Query: {query}")
         print("="*50)
-        print(response)
-        print("="*50 + "\n")
+        for chunk in response:
+            sys.stdout.write(chunk)
+            sys.stdout.flush()
+        print("\n" + "="*50 + "\n")
+        
+        # Generate lineage visualization
+        lineage.visualize(output_file='visualizations/rag_lineage.html')
+        lineage.export_json(output_file='visualizations/rag_lineage.json')
         
         logger.info("RAG pipeline completed successfully")
         logger.info(f"Data lineage visualization saved to visualizations/rag_lineage.html")
@@ -527,6 +1510,8 @@ def main():
     except Exception as e:
         logger.error(f"RAG pipeline failed: {e}")
         sys.exit(1)
+    finally:
+        close_pool()
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -1,6 +1,9 @@
 -- Enable pgvector extension
 CREATE EXTENSION IF NOT EXISTS vector;
 
+-- Enable trigram matching for substring search on coin names
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
 -- Create tables
 CREATE TABLE IF NOT EXISTS reddit_embeddings (
     post_id TEXT PRIMARY KEY,
@@ -10,7 +13,8 @@ CREATE TABLE IF NOT EXISTS reddit_embeddings (
     num_comments INTEGER,
     created_utc TEXT,
     embedding TEXT,
-    embedding_vector vector(1536)
+    -- halfvec (fp16) halves index and row size versus vector (fp32)
+    embedding_vector halfvec(1536)
 );
 
 -- LangChain PGVector collection table
@@ -37,9 +41,12 @@ CREATE TABLE IF NOT EXISTS coin_data_structured (
 -- Create indexes for better performance
 CREATE INDEX IF NOT EXISTS idx_reddit_title ON reddit_embeddings(title);
 CREATE INDEX IF NOT EXISTS idx_coin_name ON coin_data_structured("Name");
+CREATE INDEX IF NOT EXISTS idx_coin_trgm ON coin_data_structured USING gin ("Name" gin_trgm_ops, "Symbol" gin_trgm_ops);
 
 -- Create vector indexes for similarity searches
-CREATE INDEX IF NOT EXISTS idx_reddit_vector ON reddit_embeddings USING ivfflat (embedding_vector vector_cosine_ops) WITH (lists = 100);
+-- Stored Reddit vectors are unit length, so inner product ranks like cosine.
+-- Partial, because rows ingested without a vector keep it NULL.
+CREATE INDEX IF NOT EXISTS idx_reddit_hnsw_ip ON reddit_embeddings USING hnsw (embedding_vector halfvec_ip_ops) WITH (m = 16, ef_construction = 64) WHERE embedding_vector IS NOT NULL;
 CREATE INDEX IF NOT EXISTS idx_langchain_vector ON langchain_pg_embedding USING ivfflat (embedding vector_cosine_ops) WITH (lists = 100);
 CREATE INDEX IF NOT EXISTS idx_langchain_collection ON langchain_pg_embedding(collection_id);
 
@@ -7,17 +7,25 @@ It allows for easier swapping of components and more sophisticated prompt engine
 """
 
 import argparse
-import ast
+import functools
+import hashlib
 import logging
 import os
+import queue
+import re
+import sqlite3
+import threading
+import time
+import weakref
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime
-from typing import Dict, List, Any, Optional
+from typing import Dict, Iterator, List, Any, Optional, Union
 
 import numpy as np
 import pandas as pd
 import psycopg2
+import psycopg2.pool
 from dotenv import load_dotenv
-from sklearn.metrics.pairwise import cosine_similarity
 
 # Set up logging
 logging.basicConfig(
@@ -26,17 +34,483 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Token-aware embedding batching and the cache directory are shared with improved_RAG.py
+from embedding_utils import CACHE_DIR, EMBEDDING_BATCH_SIZE, EMBEDDING_MODEL, embedding_batches
+
+# pgvector's adapter returns vector columns as NumPy arrays, so the
+# fallback reads embedding_vector instead of parsing the text column
+try:
+    from pgvector.psycopg2 import register_vector
+    HAVE_PGVECTOR = True
+except ImportError:
+    HAVE_PGVECTOR = False
+
+# SimSIMD scores every row against the query with hardware SIMD kernels
+try:
+    import simsimd
+    HAVE_SIMSIMD = True
+except ImportError:
+    HAVE_SIMSIMD = False
+
+# Numba compiles a fused dot-product and rescale kernel when SimSIMD is missing
+try:
+    from numba import njit, prange
+    HAVE_NUMBA = True
+except ImportError:
+    HAVE_NUMBA = False
+
+if HAVE_NUMBA:
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _dot_mv(codes, q, scales):
+        """Inner product of each dequantized row of codes with q in one pass."""
+        n, d = codes.shape
+        out = np.empty(n, dtype=np.float32)
+        for i in prange(n):
+            s = np.float32(0.0)
+            for j in range(d):
+                s += codes[i, j] * q[j]
+            out[i] = s * scales[i]
+        return out
+
+def _quantize_rows(M):
+    """Normalize each row of a float matrix and quantize it to int8.
+    
+    Returns (codes, scales) with codes * scales[:, None] approximately the
+    unit-length rows, so scoring a query is a dot product with no norms.
+    The codes take a quarter of float32's memory.
+    """
+    M = np.atleast_2d(np.asarray(M, dtype=np.float32))
+    norms = np.linalg.norm(M, axis=1)
+    norms[norms == 0] = 1
+    M = M / norms[:, None]
+    scales = np.abs(M).max(axis=1) / 127
+    scales[scales == 0] = 1
+    return np.rint(M / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+
+def _dot_scores(codes, scales, q):
+    """Cosine similarity of each quantized unit-length row with the unit vector q."""
+    q = np.ascontiguousarray(q, dtype=np.float32)
+    if HAVE_SIMSIMD:
+        # Both sides int8, scored by SimSIMD's integer dot kernel
+        q_codes, q_scales = _quantize_rows(q)
+        dots = np.asarray(simsimd.cdist(q_codes, codes, metric='dot'), dtype=np.float32).ravel()
+        return dots * scales * q_scales[0]
+    if HAVE_NUMBA:
+        return _dot_mv(codes, q, scales)
+    # Upcast one block at a time so int8 codes never become a full float copy
+    sims = np.empty(len(codes), dtype=np.float32)
+    for start in range(0, len(codes), FALLBACK_BLOCK_ROWS):
+        block = codes[start:start + FALLBACK_BLOCK_ROWS].astype(np.float32)
+        sims[start:start + len(block)] = (block @ q) * scales[start:start + len(block)]
+    return sims
+
+# Prompt pieces are parsed once at import instead of per response
+_SYSTEM_TEMPLATE = """
+You are CryptoInsight, an expert cryptocurrency assistant that provides valuable insights based on market data and community discussions.
+
+Use the structured market data provided to give accurate information about cryptocurrency prices, market capitalization, and trading volumes.
+
+Also, incorporate insights from relevant Reddit discussions to provide context and community sentiment.
+
+Keep your responses concise, fact-based, and focused on the information provided in the structured data and Reddit posts.
+"""
+
+_HUMAN_TEMPLATE = """
+Answer the following query about cryptocurrencies:
+
+USER QUERY: {query}
+
+Use these sources to provide an accurate and helpful response:
+
+{structured_content}
+
+{reddit_content}
+
+Respond in a helpful, conversational tone. Provide specific facts and figures from the data when available.
+"""
+
+_MARKET_DATA_TEMPLATE = """
+MARKET DATA FOR {name} ({symbol}):
+- Current Price: ${price:,.2f}
+- Market Cap: ${market_cap:,.2f}
+- 24h Trading Volume: ${volume_24h:,.2f}
+- Circulating Supply: {circulating_supply:,.0f} {symbol}
+"""
+
+# Values used for fields missing from a coin's market data
+_MARKET_DATA_DEFAULTS = {"name": "", "symbol": "", "price": 0, "market_cap": 0, "volume_24h": 0, "circulating_supply": 0}
+
+_REDDIT_ITEM_TEMPLATE = "{index}. {title}: {content}\n\n"
+
+def _format_context(structured_data: Dict[str, Any], reddit_docs: List[Any]) -> tuple:
+    """Render market data and Reddit posts into the prompt's two context sections."""
+    structured_content = ""
+    if structured_data:
+        structured_content = _MARKET_DATA_TEMPLATE.format_map({
+            **_MARKET_DATA_DEFAULTS,
+            **structured_data,
+            "name": structured_data.get('name', '').upper()
+        })
+    
+    if reddit_docs:
+        reddit_content = "RELEVANT REDDIT DISCUSSIONS:\n" + "".join(
+            _REDDIT_ITEM_TEMPLATE.format(
+                index=i,
+                title=doc.metadata.get('title', 'Reddit Post'),
+                content=doc.page_content
+            )
+            for i, doc in enumerate(reddit_docs, 1)
+        )
+    else:
+        reddit_content = "RELEVANT REDDIT DISCUSSIONS:\nNo relevant Reddit discussions found.\n"
+    return structured_content, reddit_content
+
+# Rows fetched per round trip when loading the fallback search matrix
+FALLBACK_BLOCK_ROWS = 10000
+
+# Seconds the cached fallback matrix is used before it is reloaded
+FALLBACK_CACHE_TTL = 300
+
+# Distinct queries whose embeddings are kept in memory
+QUERY_EMBEDDING_CACHE_SIZE = 2048
+
+# Embedding requests in flight at once
+EMBEDDING_CONCURRENCY = 5
+
+# Concurrent query embeddings are sent together: up to this many texts,
+# waiting at most this long for more to arrive after the first
+QUERY_BATCH_MAX = 32
+QUERY_BATCH_WAIT_MS = 10
+
+# Chat model behind the answer chain; part of the response cache key
+CHAT_MODEL = "gpt-3.5-turbo"
+
+# Seconds a cached answer is reused; answers quote prices, so keep this short
+RESPONSE_CACHE_TTL = 600
+# Cosine similarity above which a new query reuses a previous answer
+SEMANTIC_CACHE_THRESHOLD = 0.97
+
+class SemanticResponseCache:
+    """Answers to earlier queries, reused for repeated and near-duplicate queries.
+    
+    Every entry is keyed by a hash of the context the answer was generated
+    from, so refreshed market data or Reddit results never serve an old
+    answer. An identical query with the same context is found by key in a
+    SQLite file, so hits carry across sessions. A near-duplicate query also
+    needs cosine similarity of at least SEMANTIC_CACHE_THRESHOLD and the
+    same named coin; queries without a recognised coin only hit on exact
+    repeats. Unit-length query embeddings are kept in memory as one matrix,
+    so a lookup is a single matrix-vector product. Entries older than the
+    TTL are ignored.
+    """
+    
+    def __init__(self, path=None, ttl=RESPONSE_CACHE_TTL, threshold=SEMANTIC_CACHE_THRESHOLD, max_entries=1000):
+        self.path = path or os.getenv('LANGCHAIN_RESPONSE_CACHE_PATH') or os.path.join(CACHE_DIR, 'langchain_response_cache.db')
+        self.ttl = ttl
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self._entries = []  # (entity, context_hash, response, created)
+        self._matrix = None
+        self._lock = threading.Lock()
+        self._conn = None
+    
+    @staticmethod
+    def context_hash(context: str) -> bytes:
+        """Hash the model and context an answer was generated from."""
+        return hashlib.sha256(f"{CHAT_MODEL}\0{context}".encode()).digest()
+    
+    def _disk(self):
+        """Open the SQLite store on first use and load its live entries."""
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS answers "
+                "(query TEXT, context_hash BLOB, entity TEXT, embedding BLOB, response TEXT, created REAL, "
+                "PRIMARY KEY (query, context_hash))"
+            )
+            rows = self._conn.execute(
+                "SELECT entity, context_hash, embedding, response, created FROM answers WHERE created >= ? "
+                "ORDER BY created DESC LIMIT ?",
+                (time.time() - self.ttl, self.max_entries)
+            ).fetchall()
+            self._entries = [(entity, context_hash, response, created)
+                             for entity, context_hash, _, response, created in reversed(rows)]
+            if rows:
+                self._matrix = np.vstack([np.frombuffer(row[2], dtype=np.float32) for row in reversed(rows)])
+        return self._conn
+    
+    def _expire(self, cutoff):
+        """Drop entries created before cutoff; they are the oldest."""
+        stale = next((i for i, entry in enumerate(self._entries) if entry[3] >= cutoff), len(self._entries))
+        if stale:
+            del self._entries[:stale]
+            self._matrix = self._matrix[stale:] if self._entries else None
+    
+    def get(self, query: str, query_embedding, entity: Optional[str], context_hash: bytes) -> Optional[str]:
+        """Return the cached answer for this query and context, or None."""
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            try:
+                row = self._disk().execute(
+                    "SELECT response FROM answers WHERE query = ? AND context_hash = ? AND created >= ?",
+                    (query, context_hash, cutoff)
+                ).fetchone()
+            except sqlite3.Error as e:
+                logger.warning(f"Response cache unavailable: {e}")
+                row = None
+            if row is not None:
+                return row[0]
+            
+            self._expire(cutoff)
+            # Queries that name no coin embed too closely to tell apart
+            if entity is None or self._matrix is None:
+                return None
+            sims = self._matrix @ query_embedding
+            for idx in np.argsort(-sims):
+                if sims[idx] < self.threshold:
+                    return None
+                cached_entity, cached_hash, response, _ = self._entries[idx]
+                if cached_entity == entity and cached_hash == context_hash:
+                    return response
+            return None
+    
+    def put(self, query: str, query_embedding, entity: Optional[str], context_hash: bytes, response: str):
+        """Store an answer for later lookups."""
+        now = time.time()
+        with self._lock:
+            try:
+                conn = self._disk()
+            except sqlite3.Error as e:
+                logger.warning(f"Response cache unavailable: {e}")
+                conn = None
+            
+            self._entries.append((entity, context_hash, response, now))
+            row = query_embedding[np.newaxis, :]
+            self._matrix = row if self._matrix is None else np.vstack([self._matrix, row])
+            if len(self._entries) > self.max_entries:
+                del self._entries[:-self.max_entries]
+                self._matrix = self._matrix[-self.max_entries:]
+            if conn is None:
+                return
+            try:
+                conn.execute(
+                    "INSERT OR REPLACE INTO answers (query, context_hash, entity, embedding, response, created) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (query, context_hash, entity, query_embedding.tobytes(), response, now)
+                )
+                conn.execute("DELETE FROM answers WHERE created < ?", (now - self.ttl,))
+                conn.commit()
+            except sqlite3.Error as e:
+                logger.warning(f"Could not persist response: {e}")
+    
+    def close(self):
+        """Close the SQLite store."""
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+class _BatchedEmbedder:
+    """Embed query texts from many threads with one API request per batch.
+    
+    Callers queue (text, future) pairs; a background thread takes the first
+    waiting text, collects more until QUERY_BATCH_MAX or QUERY_BATCH_WAIT_MS,
+    embeds them with a single embed_documents call and resolves the futures.
+    """
+    
+    def __init__(self, embeddings, max_batch: int = QUERY_BATCH_MAX, max_wait_ms: float = QUERY_BATCH_WAIT_MS):
+        self.embeddings = embeddings
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self._pending = queue.Queue()
+        self._worker = threading.Thread(target=self._run, name="query-embedder", daemon=True)
+        self._worker.start()
+    
+    def embed(self, text: str) -> List[float]:
+        """Embed one text, sharing the request with any concurrent callers."""
+        future = Future()
+        self._pending.put((text, future))
+        return future.result()
+    
+    def _run(self):
+        while True:
+            batch = [self._pending.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._pending.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            
+            texts = [text for text, _ in batch]
+            try:
+                vectors = self.embeddings.embed_documents(texts)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            logger.debug(f"Embedded {len(texts)} queries in one request")
+            for (_, future), vector in zip(batch, vectors):
+                future.set_result(vector)
+
+# Mock fixtures are built once at import; the embedding strings alone are
+# thousands of joins each
+_MOCK_EMBEDDING_01, _MOCK_EMBEDDING_02, _MOCK_EMBEDDING_03 = (
+    "[" + ",".join([value] * 1536) + "]" for value in ("0.1", "0.2", "0.3")
+)
+
+# (content, title) of the mock Reddit posts returned for each topic
+_MOCK_POSTS = {
+    "bitcoin": (
+        ("Bitcoin is the first and largest cryptocurrency by market cap, often referred to as digital gold.", "Bitcoin Discussion"),
+        ("Comparing Bitcoin and Ethereum. Bitcoin is more of a store of value while Ethereum offers smart contract capabilities.", "Bitcoin vs Ethereum"),
+        ("Bitcoin has been showing strong support levels after the recent halving event with institutional adoption increasing.", "Bitcoin's Price Movement"),
+    ),
+    "solana": (
+        ("Solana is a high-throughput blockchain platform with low fees.", "Solana Discussion"),
+        ("Comparing Bitcoin and Solana. Solana has more use cases with its high throughput and low fees.", "Bitcoin vs Solana"),
+        ("Ethereum has seen massive adoption recently due to its smart contract platform, but Solana has more use cases with its high throughput and low fees.", "Ethereum's Recent Growth"),
+    ),
+    "ethereum": (
+        ("Ethereum is a great blockchain platform with smart contracts.", "Ethereum Discussion"),
+        ("Comparing Bitcoin and Ethereum. Ethereum has more use cases with its smart contract platform, but Bitcoin remains the largest by market cap.", "Bitcoin vs Ethereum"),
+        ("Solana has seen massive adoption recently due to its high throughput and low fees.", "Solana's Recent Growth"),
+    ),
+}
+
+_MOCK_SIMILARITIES = (0.92, 0.89, 0.78)
+
+# Coins recognised in free-text queries, mapped to their ticker symbol
+_CRYPTO_ENTITY_SYMBOLS = {
+    "bitcoin": "BTC", "btc": "BTC",
+    "ethereum": "ETH", "ether": "ETH", "eth": "ETH",
+    "solana": "SOL", "sol": "SOL",
+}
+_CRYPTO_ENTITIES = re.compile(r"\b(" + "|".join(_CRYPTO_ENTITY_SYMBOLS) + r")\b", re.IGNORECASE)
+
+@functools.lru_cache(maxsize=1024)
+def _extract_crypto_entity(query: str) -> Optional[str]:
+    """Return the ticker symbol of the first coin named in the query, or None."""
+    match = _CRYPTO_ENTITIES.search(query)
+    return _CRYPTO_ENTITY_SYMBOLS[match.group(1).lower()] if match else None
+
+# Every mock keyword in one pattern, so each text is scanned once
+_MOCK_KEYWORDS = re.compile(r"bitcoin|btc|solana|sol|regulat|compliance|law|nft|non-fungible token|mining|miner")
+_MOCK_KEYWORD_TOPICS = {
+    "bitcoin": "bitcoin", "btc": "bitcoin",
+    "solana": "solana", "sol": "solana",
+    "regulat": "regulation", "compliance": "regulation", "law": "regulation",
+    "nft": "nft", "non-fungible token": "nft",
+    "mining": "mining", "miner": "mining",
+}
+
+def _mock_topics(text: str) -> set:
+    """Return the mock topics whose keywords appear in text."""
+    return {_MOCK_KEYWORD_TOPICS[keyword] for keyword in _MOCK_KEYWORDS.findall(text.lower())}
+
+# Mock fixture set for each extracted coin; anything else gets ethereum
+_MOCK_ENTITY_TOPICS = {"BTC": "bitcoin", "SOL": "solana"}
+
+_MOCK_MARKET_SUMMARY = (
+    "Based on current market data, {name} ({symbol}) is trading at ${price:,.2f}. "
+    "The market cap is ${market_cap:,.2f} with a 24-hour trading volume of ${volume_24h:,.2f}.\n\n"
+)
+
+# Mock answers about a coin: (field defaults, template)
+_MOCK_COIN_RESPONSES = {
+    "bitcoin": (
+        {"name": "Bitcoin", "symbol": "BTC", "price": 0, "market_cap": 0, "volume_24h": 0},
+        _MOCK_MARKET_SUMMARY
+        + "According to recent Reddit discussions, Bitcoin is viewed as digital gold and a store of value. "
+        "There has been increased institutional adoption, and the recent halving event has generated positive sentiment. "
+        "Users are also discussing Bitcoin's performance relative to other cryptocurrencies like Ethereum."
+    ),
+    "solana": (
+        {"name": "Solana", "symbol": "SOL", "price": 0, "market_cap": 0, "volume_24h": 0},
+        _MOCK_MARKET_SUMMARY
+        + "According to recent Reddit discussions, Solana is viewed as a high-throughput blockchain platform with low fees. "
+        "Users are also discussing Solana's performance relative to other cryptocurrencies like Ethereum."
+    ),
+}
+
+# Mock answers about a subject, matched on the query
+_MOCK_TOPIC_RESPONSES = {
+    "regulation": (
+        "Based on recent Reddit discussions about cryptocurrency regulations:\n\n"
+        "1. Many users are concerned about the evolving regulatory landscape across different countries.\n\n"
+        "2. There's significant discussion about the SEC's approach to cryptocurrency in the United States, "
+        "particularly regarding which tokens might be classified as securities.\n\n"
+        "3. Community sentiment suggests that clear regulations could help with institutional adoption, "
+        "though there are concerns about potential restrictions on innovation.\n\n"
+        "4. Several posts highlight that regulatory clarity varies significantly by country, with some nations "
+        "like Singapore and Switzerland establishing more comprehensive frameworks."
+    ),
+    "nft": (
+        "Based on recent Reddit discussions about NFTs and current market trends:\n\n"
+        "1. The NFT market has matured significantly since the 2021 boom, with more focus on utility and long-term value.\n\n"
+        "2. Gaming and metaverse-related NFTs continue to gain traction, with several major gaming companies launching NFT integrations.\n\n"
+        "3. There's growing interest in music NFTs and tokenized royalties, allowing artists to directly connect with fans.\n\n"
+        "4. Environmental concerns regarding NFT minting have led to more collections moving to energy-efficient blockchains like Polygon, Solana, and Ethereum post-merge.\n\n"
+        "5. Community sentiment indicates that the 'profile picture' NFT projects are seeing less speculative interest, while projects offering tangible utility or community benefits are showing more stability."
+    ),
+    "mining": (
+        "Based on recent Reddit discussions about cryptocurrency mining:\n\n"
+        "1. Bitcoin mining profitability is highly dependent on electricity costs, with most profitable operations located in regions with low energy costs.\n\n"
+        "2. Following the April 2024 halving event, miners with older equipment have faced increased pressure as rewards were cut in half.\n\n"
+        "3. Many small-scale miners have shifted to alternative cryptocurrencies or joined mining pools to maintain profitability.\n\n"
+        "4. There's significant discussion about the environmental impact of mining, with a growing focus on renewable energy sources.\n\n"
+        "5. Community sentiment suggests that while mining is less accessible to individuals than in previous years, it remains viable for those with efficient operations and access to cheap electricity."
+    ),
+}
+
+_MOCK_DEFAULT_COIN = {"name": "the cryptocurrency", "symbol": "", "price": 0, "market_cap": 0, "volume_24h": 0}
+
+def _mock_response(query: str, structured_data: Dict[str, Any], reddit_docs: List[Any]) -> str:
+    """Pick and render the canned mock-mode answer with one keyword scan each of coin name and query."""
+    coin_topics = _mock_topics(structured_data.get('name', '')) if structured_data else set()
+    for topic in ("bitcoin", "solana"):
+        if topic in coin_topics:
+            defaults, template = _MOCK_COIN_RESPONSES[topic]
+            return template.format_map({**defaults, **structured_data})
+    
+    query_topics = _mock_topics(query)
+    for topic in ("regulation", "nft", "mining"):
+        if topic in query_topics:
+            return _MOCK_TOPIC_RESPONSES[topic]
+    
+    return _MOCK_MARKET_SUMMARY.format_map({**_MOCK_DEFAULT_COIN, **(structured_data or {})}) + (
+        "According to recent Reddit discussions, users are talking about: "
+        + (reddit_docs[0].page_content if reddit_docs else 'No relevant discussions found.')
+    )
+
+@functools.lru_cache(maxsize=None)
+def _mock_docs(topic: str) -> tuple:
+    """Build the mock Documents for a topic once; Document needs LangChain, so not at import."""
+    return tuple(
+        Document(page_content=content, metadata={"title": title, "post_id": f"mock{i}", "similarity": similarity})
+        for i, ((content, title), similarity) in enumerate(zip(_MOCK_POSTS[topic], _MOCK_SIMILARITIES), 1)
+    )
+
+# Shared workers for running the two retrievals of a query concurrently
+_retrieval_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="retrieval")
+
 # Gracefully handle imports for LangChain
 HAVE_LANGCHAIN = True
 try:
     from langchain_community.embeddings import OpenAIEmbeddings
     from langchain_community.vectorstores import PGVector
+    from langchain_community.vectorstores.pgvector import DistanceStrategy
     from langchain.schema import Document
     from langchain_openai import ChatOpenAI
     from langchain.prompts import ChatPromptTemplate
     from langchain.chains import create_sql_query_chain
     from langchain.chains import RetrievalQA
     from langchain.schema.runnable import RunnablePassthrough
+    from langchain.schema.output_parser import StrOutputParser
     from langchain_text_splitters import RecursiveCharacterTextSplitter
 except ImportError as e:
     logger.warning(f"Error importing LangChain components: {e}")
@@ -44,7 +518,7 @@ except ImportError as e:
     HAVE_LANGCHAIN = False
 
 # Import data lineage tracking
-from data_lineage import DataLineage, LineageContext
+from data_lineage import LineageContext, disable_lineage, get_lineage_tracker
 
 # Global flag for mock mode
 MOCK_MODE = False
@@ -53,6 +527,7 @@ def enable_mock_mode():
     """Enable mock mode for testing without API calls"""
     global MOCK_MODE
     MOCK_MODE = True
+    disable_lineage()
     logger.info("Mock mode enabled - no real API calls will be made")
 
 # Load environment variables from .env file
@@ -71,6 +546,31 @@ openai_api_key = os.getenv('OPENAI_API_KEY')
 # Configure connection string for pgvector
 CONNECTION_STRING = f"postgresql+psycopg2://{db_user}:{db_password}@{db_host}:{db_port}/{db_name}"
 
+# HNSW candidate list size per query; higher trades latency for recall
+HNSW_EF_SEARCH = 40
+
+# Bounds for the connection pool behind the direct SQL queries
+DB_POOL_MINCONN = int(os.getenv('DB_POOL_MINCONN', '2'))
+DB_POOL_MAXCONN = int(os.getenv('DB_POOL_MAXCONN', '10'))
+
+# Coin lookups prepared once per pooled connection so repeat calls skip
+# parsing and planning. Values are (parameter types, query).
+_PREPARED_STATEMENTS = {
+    "coin_exact": ("text", """
+        SELECT "Name", "Symbol", "Price (USD)", "Market Cap (USD)", "24h Volume (USD)", "Circulating Supply"
+        FROM coin_data_structured
+        WHERE "Symbol" = upper($1) OR "Name" = $1
+        LIMIT 1
+    """),
+    "coin_search": ("text", """
+        SELECT "Name", "Symbol", "Price (USD)", "Market Cap (USD)", "24h Volume (USD)", "Circulating Supply"
+        FROM coin_data_structured
+        WHERE "Name" ILIKE $1 OR "Symbol" ILIKE $1
+        ORDER BY "Market Cap (USD)" DESC NULLS LAST
+        LIMIT 1
+    """),
+}
+
 class CryptoRAGSystem:
     """
     Enhanced RAG system using LangChain to integrate structured and unstructured crypto data.
@@ -87,18 +587,53 @@ class CryptoRAGSystem:
         global MOCK_MODE
         MOCK_MODE = mock_mode or 'CI' in os.environ
         
-        # Initialize lineage tracker
-        self.lineage = DataLineage()
+        # Use the global tracker that LineageContext writes through, so the
+        # nodes it creates are the ones annotated here; mock runs skip lineage
+        if MOCK_MODE:
+            self.lineage = disable_lineage()
+        else:
+            self.lineage = get_lineage_tracker()
+        
+        # Database connections are pooled and opened on first use
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        self._pool_slots = threading.BoundedSemaphore(DB_POOL_MAXCONN)
+        
+        # Statement names prepared on each pooled connection
+        self._prepared = weakref.WeakKeyDictionary()
+        
+        # Type of reddit_embeddings.embedding_vector, probed on first search
+        self._vector_type = None
+        self._vector_type_probed = False
+        
+        # Repeated queries reuse their embedding instead of another API call
+        self._embed_query = functools.lru_cache(maxsize=QUERY_EMBEDDING_CACHE_SIZE)(self._embed_query_uncached)
+        
+        # Embedding matrix for the fallback search, loaded on first use
+        self._fallback_matrix = None
+        self._fallback_loaded_at = 0.0
+        self._fallback_lock = threading.Lock()
+        
+        # Answers to earlier queries, checked before retrieval and generation
+        self._response_cache = SemanticResponseCache()
         
         if not MOCK_MODE:
             # Set up LangChain components
             self.embeddings = OpenAIEmbeddings(api_key=openai_api_key)
+            self._query_embedder = _BatchedEmbedder(self.embeddings)
             self.llm = ChatOpenAI(
                 temperature=0.7,
-                model="gpt-3.5-turbo",
-                api_key=openai_api_key
+                model=CHAT_MODEL,
+                api_key=openai_api_key,
+                streaming=True  # tokens reach chain.stream() as the API produces them
             )
             
+            # The answer prompt and chain are built once and reused per query
+            self._answer_chain = ChatPromptTemplate.from_messages([
+                ("system", _SYSTEM_TEMPLATE),
+                ("human", _HUMAN_TEMPLATE)
+            ]) | self.llm | StrOutputParser()
+            
             try:
                 # Initialize vector store for Reddit content
                 self.setup_vector_store()
@@ -106,6 +641,43 @@ class CryptoRAGSystem:
                 logger.error(f"Error setting up vector store: {e}")
                 logger.warning("Using fallback methods for retrieval")
 
+    def _embed_query_uncached(self, normalized_query: str) -> tuple:
+        """Embed a normalized query; a tuple so the LRU cache can hold it."""
+        if MOCK_MODE:
+            return (0.1,) * 1536
+        return tuple(self._query_embedder.embed(normalized_query))
+    
+    def embed_query(self, query: str) -> tuple:
+        """Return the query's embedding, served from the LRU cache when seen before."""
+        embedding = self._embed_query(" ".join(query.lower().split()))
+        info = self._embed_query.cache_info()
+        logger.debug(f"Query embedding cache: {info.hits} hits, {info.misses} misses, {info.currsize}/{info.maxsize} entries")
+        return embedding
+    
+    def batch_embed_documents(self, texts: List[str], batch_size: int = EMBEDDING_BATCH_SIZE) -> List[List[float]]:
+        """
+        Embed many texts with as few API requests as possible.
+        
+        Texts are cut to the model's input limit and grouped into requests of
+        at most batch_size texts and EMBEDDING_BATCH_TOKENS tokens (see
+        embedding_utils), and up to EMBEDDING_CONCURRENCY requests run at once.
+        
+        Args:
+            texts: Texts to embed
+            batch_size: Most texts sent in one request
+            
+        Returns:
+            Embeddings in the same order as texts
+        """
+        if MOCK_MODE:
+            return [[0.1] * 1536 for _ in texts]
+        
+        batches = list(embedding_batches(texts, EMBEDDING_MODEL, batch_size))
+        logger.info(f"Embedding {len(texts)} texts in {len(batches)} requests")
+        with ThreadPoolExecutor(max_workers=EMBEDDING_CONCURRENCY, thread_name_prefix="embedding") as executor:
+            results = executor.map(self.embeddings.embed_documents, batches)
+            return [embedding for batch_embeddings in results for embedding in batch_embeddings]
+    
     def setup_vector_store(self):
         """Set up the vector store connection using pgvector"""
         try:
@@ -114,6 +686,7 @@ class CryptoRAGSystem:
                 collection_name="reddit_vectors",
                 connection_string=CONNECTION_STRING,
                 embedding_function=self.embeddings,
+                distance_strategy=DistanceStrategy.COSINE,
                 use_jsonb=True  # Use JSONB to store metadata
             )
             logger.info("Successfully connected to pgvector store")
@@ -149,22 +722,22 @@ class CryptoRAGSystem:
                         if "bitcoin" in query_term.lower():
                             # Bitcoin-related mock data
                             return [
-                                ["mock1", "Bitcoin Discussion", "Bitcoin is the first and largest cryptocurrency by market cap.", "[" + ",".join(["0.1"] * 1536) + "]"],
-                                ["mock2", "Bitcoin vs Ethereum", "Comparing the two biggest cryptocurrencies. Bitcoin is more of a store of value, while Ethereum offers smart contracts.", "[" + ",".join(["0.2"] * 1536) + "]"],
-                                ["mock3", "Bitcoin's Price Movement", "Bitcoin has been showing strong support levels after the recent halving event.", "[" + ",".join(["0.3"] * 1536) + "]"]
+                                ["mock1", "Bitcoin Discussion", "Bitcoin is the first and largest cryptocurrency by market cap.", _MOCK_EMBEDDING_01],
+                                ["mock2", "Bitcoin vs Ethereum", "Comparing the two biggest cryptocurrencies. Bitcoin is more of a store of value, while Ethereum offers smart contracts.", _MOCK_EMBEDDING_02],
+                                ["mock3", "Bitcoin's Price Movement", "Bitcoin has been showing strong support levels after the recent halving event.", _MOCK_EMBEDDING_03]
                             ]
                         elif "solana" in query_term.lower() or "sol" in query_term.lower():
                             return [
-                                ["mock1", "Solana Discussion", "Solana is a high-throughput blockchain platform with low fees.", "[" + ",".join(["0.1"] * 1536) + "]"],
-                                ["mock2", "Bitcoin vs Solana", "Comparing the two biggest cryptocurrencies. Solana has more use cases with its high throughput and low fees.", "[" + ",".join(["0.2"] * 1536) + "]"],
-                                ["mock3", "Ethereum's Recent Growth", "Ethereum has seen massive adoption recently due to its smart contract platform, but Solana has more use cases with its high throughput and low fees.", "[" + ",".join(["0.3"] * 1536) + "]"]
+                                ["mock1", "Solana Discussion", "Solana is a high-throughput blockchain platform with low fees.", _MOCK_EMBEDDING_01],
+                                ["mock2", "Bitcoin vs Solana", "Comparing the two biggest cryptocurrencies. Solana has more use cases with its high throughput and low fees.", _MOCK_EMBEDDING_02],
+                                ["mock3", "Ethereum's Recent Growth", "Ethereum has seen massive adoption recently due to its smart contract platform, but Solana has more use cases with its high throughput and low fees.", _MOCK_EMBEDDING_03]
                             ]
                         else:
                             # Default Ethereum-related mock data
                             return [
-                                ["mock1", "Ethereum Discussion", "Ethereum is a great blockchain platform with smart contracts.", "[" + ",".join(["0.1"] * 1536) + "]"],
-                                ["mock2", "Bitcoin vs Ethereum", "Comparing the two biggest cryptocurrencies. Ethereum has more use cases with its smart contract platform, but Bitcoin remains the largest by market cap.", "[" + ",".join(["0.2"] * 1536) + "]"],
-                                ["mock3", "Solana's Recent Growth", "Solana has seen massive adoption recently due to its high throughput and low fees.", "[" + ",".join(["0.3"] * 1536) + "]"]
+                                ["mock1", "Ethereum Discussion", "Ethereum is a great blockchain platform with smart contracts.", _MOCK_EMBEDDING_01],
+                                ["mock2", "Bitcoin vs Ethereum", "Comparing the two biggest cryptocurrencies. Ethereum has more use cases with its smart contract platform, but Bitcoin remains the largest by market cap.", _MOCK_EMBEDDING_02],
+                                ["mock3", "Solana's Recent Growth", "Solana has seen massive adoption recently due to its high throughput and low fees.", _MOCK_EMBEDDING_03]
                             ]
                     else:
                         # Mock structured coin data - match based on query params
@@ -183,8 +756,17 @@ class CryptoRAGSystem:
                             # Default to Ethereum if no parameters
                             return [["Ethereum", "ETH", 3500.45, 420000000000, 15000000000, 120000000]]
                 
+                def fetchmany(self, size=None):
+                    """Return every mock row in the first block, then none."""
+                    if getattr(self, 'drained', False):
+                        return []
+                    self.drained = True
+                    return self.fetchall()
+                
                 def fetchone(self):
                     """Mock fetchone method to handle vector column check."""
+                    if "coin_data_structured" in self.last_query:
+                        return self.fetchall()[0]
                     if "vector" in self.last_query:
                         return [True]  # Pretend vector extension is installed
                     elif "count" in self.last_query.lower():
@@ -199,7 +781,7 @@ class CryptoRAGSystem:
                     pass
                     
             class MockConnection:
-                def cursor(self):
+                def cursor(self, name=None):
                     return MockCursor()
                     
                 def close(self):
@@ -219,13 +801,83 @@ class CryptoRAGSystem:
             logger.error(f"Failed to connect to database: {e}")
             raise
     
-    def retrieve_reddit_data_with_langchain(self, query: str, top_k: int = 3) -> List[Document]:
+    def _borrow_connection(self):
+        """Take a warm connection from the pool, opening the pool on first use.
+        
+        Waits for a free connection when all DB_POOL_MAXCONN are in use.
+        Mock mode hands out a fresh mock connection instead.
+        """
+        if MOCK_MODE:
+            return self.get_db_connection()
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = psycopg2.pool.ThreadedConnectionPool(
+                    DB_POOL_MINCONN,
+                    DB_POOL_MAXCONN,
+                    dbname=db_name,
+                    user=db_user,
+                    password=db_password,
+                    host=db_host,
+                    port=db_port
+                )
+                logger.info(f"Opened database pool ({DB_POOL_MINCONN}-{DB_POOL_MAXCONN} connections)")
+        self._pool_slots.acquire()
+        try:
+            return self._pool.getconn()
+        except Exception:
+            self._pool_slots.release()
+            raise
+    
+    def _release_connection(self, db_connection):
+        """Return a borrowed connection to the pool."""
+        if MOCK_MODE or self._pool is None:
+            db_connection.close()
+            return
+        # Drop connections the server closed rather than handing them out again
+        self._pool.putconn(db_connection, close=bool(db_connection.closed))
+        self._pool_slots.release()
+    
+    def _prepared_statements(self, db_connection) -> set:
+        """PREPARE the coin lookups on a connection the first time it is seen.
+        
+        Returns:
+            Set of statement names usable on this connection
+        """
+        if MOCK_MODE:
+            return set()
+        prepared = self._prepared.get(db_connection)
+        if prepared is None:
+            prepared = set()
+            cursor = db_connection.cursor()
+            for name, (param_types, query) in _PREPARED_STATEMENTS.items():
+                try:
+                    cursor.execute(f"PREPARE {name} ({param_types}) AS {query}")
+                    db_connection.commit()
+                    prepared.add(name)
+                except Exception as e:
+                    logger.warning(f"Could not prepare {name}: {e}")
+                    db_connection.rollback()
+            cursor.close()
+            self._prepared[db_connection] = prepared
+        return prepared
+    
+    def close(self):
+        """Close every pooled database connection and the response cache."""
+        self._response_cache.close()
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.closeall()
+                self._pool = None
+    
+    def retrieve_reddit_data_with_langchain(self, query: str, top_k: int = 3,
+                                            entity: Optional[str] = None) -> List[Document]:
         """
         Retrieve relevant Reddit posts using LangChain's retriever.
         
         Args:
             query: User query to find relevant posts
             top_k: Number of posts to retrieve
+            entity: Ticker symbol already extracted from the query, if any
             
         Returns:
             List of LangChain Document objects containing the posts
@@ -249,40 +901,11 @@ class CryptoRAGSystem:
             
             if MOCK_MODE:
                 # Return mock documents in mock mode
-                mock_docs = []
-                
-                if "bitcoin" in query.lower() or "btc" in query.lower():
-                    # Bitcoin-related mock data
-                    mock_docs = [
-                        Document(page_content="Bitcoin is the first and largest cryptocurrency by market cap, often referred to as digital gold.", 
-                                 metadata={"title": "Bitcoin Discussion", "post_id": "mock1", "similarity": 0.92}),
-                        Document(page_content="Comparing Bitcoin and Ethereum. Bitcoin is more of a store of value while Ethereum offers smart contract capabilities.", 
-                                 metadata={"title": "Bitcoin vs Ethereum", "post_id": "mock2", "similarity": 0.89}),
-                        Document(page_content="Bitcoin has been showing strong support levels after the recent halving event with institutional adoption increasing.", 
-                                 metadata={"title": "Bitcoin's Price Movement", "post_id": "mock3", "similarity": 0.78})
-                    ]
-                elif "solana" in query.lower() or "sol" in query.lower():
-                    mock_docs = [
-                        Document(page_content="Solana is a high-throughput blockchain platform with low fees.", 
-                                 metadata={"title": "Solana Discussion", "post_id": "mock1", "similarity": 0.92}),
-                        Document(page_content="Comparing Bitcoin and Solana. Solana has more use cases with its high throughput and low fees.", 
-                                 metadata={"title": "Bitcoin vs Solana", "post_id": "mock2", "similarity": 0.89}),
-                        Document(page_content="Ethereum has seen massive adoption recently due to its smart contract platform, but Solana has more use cases with its high throughput and low fees.", 
-                                 metadata={"title": "Ethereum's Recent Growth", "post_id": "mock3", "similarity": 0.78})
-                    ]
-                else:
-                    # Default Ethereum-related mock data 
-                    mock_docs = [
-                        Document(page_content="Ethereum is a great blockchain platform with smart contracts.", 
-                                 metadata={"title": "Ethereum Discussion", "post_id": "mock1", "similarity": 0.92}),
-                        Document(page_content="Comparing Bitcoin and Ethereum. Ethereum has more use cases with its smart contract platform, but Bitcoin remains the largest by market cap.", 
-                                 metadata={"title": "Bitcoin vs Ethereum", "post_id": "mock2", "similarity": 0.89}),
-                        Document(page_content="Solana has seen massive adoption recently due to its high throughput and low fees.", 
-                                 metadata={"title": "Solana's Recent Growth", "post_id": "mock3", "similarity": 0.78})
-                    ]
+                entity = entity or _extract_crypto_entity(query)
+                mock_docs = list(_mock_docs(_MOCK_ENTITY_TOPICS.get(entity, "ethereum")))
                 
                 # Update lineage metadata
-                self.lineage.get_node(results_id).metadata.update({
+                self.lineage.update_node_metadata(results_id, {
                     "posts_found": len(mock_docs),
                     "search_method": "mock",
                     "framework": "langchain"
@@ -292,7 +915,7 @@ class CryptoRAGSystem:
             
             try:
                 # Use the vector store to find similar documents
-                docs = self.vector_store.similarity_search_with_score(query, k=top_k)
+                docs = self.vector_store.similarity_search_with_score_by_vector(list(self.embed_query(query)), k=top_k)
                 
                 # Convert to format needed for our application
                 result_docs = []
@@ -302,7 +925,7 @@ class CryptoRAGSystem:
                     result_docs.append(doc)
                 
                 # Update lineage metadata
-                self.lineage.get_node(results_id).metadata.update({
+                self.lineage.update_node_metadata(results_id, {
                     "posts_found": len(result_docs),
                     "max_similarity": max([doc.metadata.get("similarity", 0) for doc in result_docs]) if result_docs else 0,
                     "search_method": "pgvector",
@@ -318,42 +941,164 @@ class CryptoRAGSystem:
                 # Fall back to the legacy retrieval method
                 return self.retrieve_reddit_data_fallback(query, top_k)
     
-    def retrieve_reddit_data_fallback(self, query: str, top_k: int = 3) -> List[Document]:
-        """Legacy fallback method to retrieve Reddit posts if LangChain retrieval fails"""
-        db_connection = self.get_db_connection()
-        cursor = db_connection.cursor()
+    def _vector_column_type(self, db_connection) -> Optional[str]:
+        """Return the base type of embedding_vector ('vector' or 'halfvec'), or None.
         
+        Probed once per system; the schema does not change while it runs.
+        """
+        if MOCK_MODE:
+            return None
+        if not self._vector_type_probed:
+            try:
+                cursor = db_connection.cursor()
+                cursor.execute("""
+                    SELECT format_type(atttypid, atttypmod) FROM pg_attribute
+                    WHERE attrelid = to_regclass('reddit_embeddings')
+                    AND attname = 'embedding_vector' AND NOT attisdropped
+                """)
+                row = cursor.fetchone()
+                self._vector_type = row[0].split('(')[0] if row and row[0] else None
+            except Exception as e:
+                logger.warning(f"Could not read reddit_embeddings schema: {e}")
+                db_connection.rollback()
+                self._vector_type = None
+            self._vector_type_probed = True
+        return self._vector_type
+    
+    def _search_pgvector(self, query_embedding, top_k: int):
+        """Run the top-k search inside Postgres on the HNSW index.
+        
+        Stored vectors are unit length, so the negative inner product <#>
+        ranks like cosine distance and is served by idx_reddit_hnsw_ip.
+        
+        Returns:
+            List of ((post_id, title, text), similarity) pairs, or None if
+            the table has no pgvector column or the query fails
+        """
+        db_connection = self._borrow_connection()
         try:
-            # Generate embeddings for the query
-            if not MOCK_MODE:
-                query_embedding = self.embeddings.embed_query(query)
-            else:
-                query_embedding = [0.1] * 1536
-                
-            # Query to fetch embeddings from the Reddit posts
-            cursor.execute("SELECT post_id, title, text, embedding FROM reddit_embeddings")
-            rows = cursor.fetchall()
+            vector_type = self._vector_column_type(db_connection)
+            if vector_type is None:
+                return None
+            
+            q = np.asarray(query_embedding, dtype=np.float32)
+            norm = np.sqrt(np.vdot(q, q))
+            if norm:
+                q = q / norm
+            query_vector = "[" + ",".join(map(str, q.tolist())) + "]"
+            
+            cursor = db_connection.cursor()
+            try:
+                # SET LOCAL scopes ef_search to this transaction
+                cursor.execute(f"SET LOCAL hnsw.ef_search = {max(HNSW_EF_SEARCH, top_k)}")
+                cursor.execute(f"""
+                    SELECT post_id, title, text, embedding_vector <#> %s::{vector_type} AS distance
+                    FROM reddit_embeddings
+                    WHERE embedding_vector IS NOT NULL
+                    ORDER BY distance
+                    LIMIT %s
+                """, (query_vector, top_k))
+                rows = cursor.fetchall()
+                db_connection.commit()
+            finally:
+                cursor.close()
+            return [((post_id, title, text), -distance) for post_id, title, text, distance in rows]
+        except Exception as e:
+            logger.warning(f"pgvector search failed, scoring in memory instead: {e}")
+            db_connection.rollback()
+            return None
+        finally:
+            self._release_connection(db_connection)
+    
+    def _load_fallback_matrix(self):
+        """Return (rows, codes, scales) for every stored post, cached for FALLBACK_CACHE_TTL.
+        
+        The table is streamed through a named (server-side) cursor, reading
+        embedding_vector as NumPy arrays when pgvector is available and
+        otherwise parsing each block of text embeddings in one C pass. The
+        result is kept as a contiguous matrix of int8 codes of the unit-length
+        embeddings plus one scale per row, so fallback queries neither
+        re-fetch, re-parse nor re-normalize it.
+        """
+        with self._fallback_lock:
+            if self._fallback_matrix is not None and time.monotonic() - self._fallback_loaded_at <= FALLBACK_CACHE_TTL:
+                return self._fallback_matrix
             
-            if not rows:
+            db_connection = self._borrow_connection()
+            cursor = db_connection.cursor(name="reddit_stream")
+            cursor.itersize = FALLBACK_BLOCK_ROWS
+            try:
+                native = HAVE_PGVECTOR and self._vector_column_type(db_connection) is not None
+                if native:
+                    register_vector(db_connection)
+                    cursor.execute("""
+                        SELECT post_id, title, text, embedding_vector::vector FROM reddit_embeddings
+                        WHERE embedding_vector IS NOT NULL
+                    """)
+                else:
+                    cursor.execute("SELECT post_id, title, text, embedding FROM reddit_embeddings")
+                rows, blocks, block_scales = [], [], []
+                while True:
+                    block = cursor.fetchmany(FALLBACK_BLOCK_ROWS)
+                    if not block:
+                        break
+                    rows.extend(tuple(row[:3]) for row in block)
+                    if native:
+                        codes, scales = _quantize_rows(np.vstack([row[3] for row in block]))
+                    else:
+                        flat = np.fromstring(",".join(row[3].strip()[1:-1] for row in block), sep=',', dtype=np.float32)
+                        codes, scales = _quantize_rows(flat.reshape(len(block), -1))
+                    blocks.append(codes)
+                    block_scales.append(scales)
+            finally:
+                cursor.close()
+                self._release_connection(db_connection)
+            
+            # int8 codes: a quarter of the memory (and bandwidth per query) of float32
+            codes = np.ascontiguousarray(np.concatenate(blocks)) if blocks else None
+            scales = np.concatenate(block_scales) if block_scales else None
+            self._fallback_matrix = (rows, codes, scales)
+            self._fallback_loaded_at = time.monotonic()
+            logger.info(f"Cached {len(rows)} Reddit embeddings for fallback retrieval")
+            return self._fallback_matrix
+    
+    def retrieve_reddit_data_fallback(self, query: str, top_k: int = 3) -> List[Document]:
+        """Legacy fallback method to retrieve Reddit posts if LangChain retrieval fails"""
+        try:
+            query_embedding = self.embed_query(query)
+            if top_k <= 0:
                 return []
             
-            # Process the embeddings and calculate similarity
-            embeddings = np.array([np.array(ast.literal_eval(row[3])) for row in rows])
-            similarities = cosine_similarity([query_embedding], embeddings)[0]
+            # Let the HNSW index find the top k when the table has a vector
+            # column; otherwise score the cached matrix
+            matches = self._search_pgvector(query_embedding, top_k)
+            if matches is None:
+                rows, codes, scales = self._load_fallback_matrix()
+                if not rows:
+                    return []
+                
+                # Rows were normalized when loaded; normalize the query once
+                # and cosine similarity is a plain dot product
+                q = np.asarray(query_embedding, dtype=np.float32)
+                norm = np.sqrt(np.vdot(q, q))
+                similarities = _dot_scores(codes, scales, q / norm if norm else q)
+                
+                # Find the most similar posts
+                # argpartition selects the top k in O(N); only those k get sorted
+                k = min(top_k, len(similarities))
+                top_indices = np.argpartition(-similarities, k - 1)[:k]
+                top_indices = top_indices[np.argsort(-similarities[top_indices])]
+                matches = [(rows[idx], similarities[idx]) for idx in top_indices]
             
-            # Find the most similar posts
-            top_indices = similarities.argsort()[-top_k:][::-1]
             result_docs = []
-            
-            for idx in top_indices:
-                post = rows[idx]
+            for post, similarity in matches:
                 # Convert to LangChain Document format
                 doc = Document(
                     page_content=post[2],  # post text
                     metadata={
                         "post_id": post[0],
                         "title": post[1],
-                        "similarity": float(similarities[idx])
+                        "similarity": float(similarity)
                     }
                 )
                 result_docs.append(doc)
@@ -363,16 +1108,14 @@ class CryptoRAGSystem:
         except Exception as e:
             logger.error(f"Error in fallback retrieval: {e}")
             return []
-        finally:
-            cursor.close()
-            db_connection.close()
     
-    def retrieve_structured_data(self, query: str) -> Dict[str, Any]:
+    def retrieve_structured_data(self, query: str, entity: Optional[str] = None) -> Dict[str, Any]:
         """
         Retrieve structured market data for cryptocurrencies matching the query.
         
         Args:
             query: User query to search for relevant coins
+            entity: Ticker symbol already extracted from the query, if any
             
         Returns:
             Dictionary containing structured market data
@@ -394,28 +1137,50 @@ class CryptoRAGSystem:
             metadata={"timestamp": datetime.now().isoformat()}
         ) as results_id:
             
-            # Connect to the database
-            db_connection = self.get_db_connection()
+            # Borrow a pooled database connection
+            db_connection = self._borrow_connection()
+            prepared = self._prepared_statements(db_connection)
             cursor = db_connection.cursor()
             
             try:
-                # Define your query to fetch the relevant structured data
-                cursor.execute("""
-                    SELECT "Name", "Symbol", "Price (USD)", "Market Cap (USD)", "24h Volume (USD)", "Circulating Supply" 
-                    FROM coin_data_structured
-                    WHERE "Name" ILIKE %s OR "Symbol" ILIKE %s
-                """, (f"%{query}%", f"%{query}%"))
-                rows = cursor.fetchall()
+                # Most queries name a coin ("ETH", "price of Ethereum"); try an
+                # exact match on the Symbol primary key and the Name first,
+                # using the extracted ticker when there is one
+                lookup = entity or _extract_crypto_entity(query) or query
+                if "coin_exact" in prepared:
+                    cursor.execute("EXECUTE coin_exact (%s)", (lookup,))
+                else:
+                    cursor.execute("""
+                        SELECT "Name", "Symbol", "Price (USD)", "Market Cap (USD)", "24h Volume (USD)", "Circulating Supply" 
+                        FROM coin_data_structured
+                        WHERE "Symbol" = upper(%s) OR "Name" = %s
+                        LIMIT 1
+                    """, (lookup, lookup))
+                data = cursor.fetchone()
                 
-                if not rows:
-                    self.lineage.get_node(results_id).metadata.update({
+                # Fall back to the trigram-indexed (idx_coin_trgm) substring
+                # search; only the first coin is used, so take the largest
+                if data is None:
+                    if "coin_search" in prepared:
+                        cursor.execute("EXECUTE coin_search (%s)", (f"%{query}%",))
+                    else:
+                        cursor.execute("""
+                            SELECT "Name", "Symbol", "Price (USD)", "Market Cap (USD)", "24h Volume (USD)", "Circulating Supply" 
+                            FROM coin_data_structured
+                            WHERE "Name" ILIKE %s OR "Symbol" ILIKE %s
+                            ORDER BY "Market Cap (USD)" DESC NULLS LAST
+                            LIMIT 1
+                        """, (f"%{query}%", f"%{query}%"))
+                    data = cursor.fetchone()
+                
+                if data is None:
+                    self.lineage.update_node_metadata(results_id, {
                         "coins_found": 0,
                         "search_query": query
                     })
                     return {}
                 
                 # Format the structured data as a dictionary
-                data = rows[0]  # Assuming we're looking for the first matching coin
                 structured_data = {
                     "name": data[0],
                     "symbol": data[1],
@@ -426,8 +1191,8 @@ class CryptoRAGSystem:
                 }
                 
                 # Update lineage metadata
-                self.lineage.get_node(results_id).metadata.update({
-                    "coins_found": len(rows),
+                self.lineage.update_node_metadata(results_id, {
+                    "coins_found": 1,
                     "coin_retrieved": data[0],
                     "search_query": query
                 })
@@ -439,9 +1204,25 @@ class CryptoRAGSystem:
                 return {}
             finally:
                 cursor.close()
-                db_connection.close()
+                self._release_connection(db_connection)
+    
+    def _stream_chain(self, inputs: Dict[str, Any], response_id: str) -> Iterator[str]:
+        """Yield response text from the answer chain as the model produces it."""
+        generated = []
+        for chunk in self._answer_chain.stream(inputs):
+            if chunk:
+                generated.append(chunk)
+                yield chunk
+        
+        self.lineage.update_node_metadata(response_id, {
+            "model": CHAT_MODEL,
+            "framework": "langchain",
+            "response_length": len("".join(generated)),
+            "streamed": True
+        })
     
-    def generate_response_with_langchain(self, query: str, structured_data: Dict[str, Any], reddit_docs: List[Document]) -> str:
+    def generate_response_with_langchain(self, query: str, structured_data: Dict[str, Any], reddit_docs: List[Document],
+                                         stream: bool = False) -> Union[str, Iterator[str]]:
         """
         Generate a conversational response using LangChain based on retrieved data.
         
@@ -449,9 +1230,11 @@ class CryptoRAGSystem:
             query: Original user query
             structured_data: Dictionary of structured market data
             reddit_docs: List of relevant Reddit posts as LangChain Document objects
+            stream: Return an iterator of text chunks that yields tokens as
+                they are generated instead of waiting for the full response
             
         Returns:
-            Generated response text
+            Generated response text, or an iterator of its chunks when streaming
         """
         # Create data lineage nodes
         retrieval_node_id = self.lineage.add_node(
@@ -477,164 +1260,105 @@ class CryptoRAGSystem:
             
             if MOCK_MODE:
                 # Generate a mock response based on the cryptocurrency being queried
-                crypto_name = structured_data.get('name', '').lower() if structured_data else ''
+                mock_response = _mock_response(query, structured_data, reddit_docs)
                 
-                if "bitcoin" in crypto_name or "btc" in crypto_name:
-                    mock_response = (
-                        f"Based on current market data, {structured_data.get('name', 'Bitcoin')} "
-                        f"({structured_data.get('symbol', 'BTC')}) is trading at ${structured_data.get('price', 0):,.2f}. "
-                        f"The market cap is ${structured_data.get('market_cap', 0):,.2f} with a 24-hour trading volume "
-                        f"of ${structured_data.get('volume_24h', 0):,.2f}.\n\n"
-                        f"According to recent Reddit discussions, Bitcoin is viewed as digital gold and a store of value. "
-                        f"There has been increased institutional adoption, and the recent halving event has generated positive sentiment. "
-                        f"Users are also discussing Bitcoin's performance relative to other cryptocurrencies like Ethereum."
-                    )
-                elif "solana" in crypto_name or "sol" in crypto_name:
-                    mock_response = (
-                        f"Based on current market data, {structured_data.get('name', 'Solana')} "
-                        f"({structured_data.get('symbol', 'SOL')}) is trading at ${structured_data.get('price', 0):,.2f}. "
-                        f"The market cap is ${structured_data.get('market_cap', 0):,.2f} with a 24-hour trading volume "
-                        f"of ${structured_data.get('volume_24h', 0):,.2f}.\n\n"
-                        f"According to recent Reddit discussions, Solana is viewed as a high-throughput blockchain platform with low fees. "
-                        f"Users are also discussing Solana's performance relative to other cryptocurrencies like Ethereum."
-                    )
-                elif "regulat" in query.lower() or "compliance" in query.lower() or "law" in query.lower():
-                    # Special case for regulation-related queries
-                    mock_response = (
-                        "Based on recent Reddit discussions about cryptocurrency regulations:\n\n"
-                        "1. Many users are concerned about the evolving regulatory landscape across different countries.\n\n"
-                        "2. There's significant discussion about the SEC's approach to cryptocurrency in the United States, "
-                        "particularly regarding which tokens might be classified as securities.\n\n"
-                        "3. Community sentiment suggests that clear regulations could help with institutional adoption, "
-                        "though there are concerns about potential restrictions on innovation.\n\n"
-                        "4. Several posts highlight that regulatory clarity varies significantly by country, with some nations "
-                        "like Singapore and Switzerland establishing more comprehensive frameworks."
-                    )
-                elif "nft" in query.lower() or "non-fungible token" in query.lower():
-                    # Special case for NFT-related queries
-                    mock_response = (
-                        "Based on recent Reddit discussions about NFTs and current market trends:\n\n"
-                        "1. The NFT market has matured significantly since the 2021 boom, with more focus on utility and long-term value.\n\n"
-                        "2. Gaming and metaverse-related NFTs continue to gain traction, with several major gaming companies launching NFT integrations.\n\n"
-                        "3. There's growing interest in music NFTs and tokenized royalties, allowing artists to directly connect with fans.\n\n"
-                        "4. Environmental concerns regarding NFT minting have led to more collections moving to energy-efficient blockchains like Polygon, Solana, and Ethereum post-merge.\n\n"
-                        "5. Community sentiment indicates that the 'profile picture' NFT projects are seeing less speculative interest, while projects offering tangible utility or community benefits are showing more stability."
-                    )
-                elif "mining" in query.lower() or "miner" in query.lower():
-                    # Special case for mining-related queries
-                    mock_response = (
-                        "Based on recent Reddit discussions about cryptocurrency mining:\n\n"
-                        "1. Bitcoin mining profitability is highly dependent on electricity costs, with most profitable operations located in regions with low energy costs.\n\n"
-                        "2. Following the April 2024 halving event, miners with older equipment have faced increased pressure as rewards were cut in half.\n\n"
-                        "3. Many small-scale miners have shifted to alternative cryptocurrencies or joined mining pools to maintain profitability.\n\n"
-                        "4. There's significant discussion about the environmental impact of mining, with a growing focus on renewable energy sources.\n\n"
-                        "5. Community sentiment suggests that while mining is less accessible to individuals than in previous years, it remains viable for those with efficient operations and access to cheap electricity."
-                    )
-                else:
-                    mock_response = (
-                        f"Based on current market data, {structured_data.get('name', 'the cryptocurrency')} "
-                        f"({structured_data.get('symbol', '')}) is trading at ${structured_data.get('price', 0):,.2f}. "
-                        f"The market cap is ${structured_data.get('market_cap', 0):,.2f} with a 24-hour trading volume "
-                        f"of ${structured_data.get('volume_24h', 0):,.2f}.\n\n"
-                        f"According to recent Reddit discussions, users are talking about: "
-                        f"{reddit_docs[0].page_content if reddit_docs else 'No relevant discussions found.'}"
-                    )
-                
-                return mock_response
-            
-            # Define the system prompt
-            system_template = """
-            You are CryptoInsight, an expert cryptocurrency assistant that provides valuable insights based on market data and community discussions.
-            
-            Use the structured market data provided to give accurate information about cryptocurrency prices, market capitalization, and trading volumes.
-            
-            Also, incorporate insights from relevant Reddit discussions to provide context and community sentiment.
-            
-            Keep your responses concise, fact-based, and focused on the information provided in the structured data and Reddit posts.
-            """
+                return iter([mock_response]) if stream else mock_response
             
-            # Format the structured data
-            structured_content = ""
-            if structured_data:
-                structured_content = f"""
-                MARKET DATA FOR {structured_data.get('name', '').upper()} ({structured_data.get('symbol', '')}):
-                - Current Price: ${structured_data.get('price', 0):,.2f}
-                - Market Cap: ${structured_data.get('market_cap', 0):,.2f}
-                - 24h Trading Volume: ${structured_data.get('volume_24h', 0):,.2f}
-                - Circulating Supply: {structured_data.get('circulating_supply', 0):,.0f} {structured_data.get('symbol', '')}
-                """
+            structured_content, reddit_content = _format_context(structured_data, reddit_docs)
             
-            # Format the Reddit discussions
-            reddit_content = "RELEVANT REDDIT DISCUSSIONS:\n"
-            if reddit_docs:
-                for i, doc in enumerate(reddit_docs, 1):
-                    reddit_content += f"{i}. {doc.metadata.get('title', 'Reddit Post')}: {doc.page_content}\n\n"
-            else:
-                reddit_content += "No relevant Reddit discussions found.\n"
-            
-            # Create the human message template
-            human_template = """
-            Answer the following query about cryptocurrencies:
-            
-            USER QUERY: {query}
-            
-            Use these sources to provide an accurate and helpful response:
-            
-            {structured_content}
-            
-            {reddit_content}
-            
-            Respond in a helpful, conversational tone. Provide specific facts and figures from the data when available.
-            """
-            
-            # Create the chat prompt
-            chat_prompt = ChatPromptTemplate.from_messages([
-                ("system", system_template),
-                ("human", human_template)
-            ])
-            
-            # Create the response generation chain
-            chain = chat_prompt | self.llm
-            
-            # Generate the response
-            response = chain.invoke({
+            inputs = {
                 "query": query,
                 "structured_content": structured_content,
                 "reddit_content": reddit_content
-            })
+            }
+            if stream:
+                return self._stream_chain(inputs, response_id)
+            
+            # Generate the response
+            response = self._answer_chain.invoke(inputs)
             
             # Update lineage metadata
-            self.lineage.get_node(response_id).metadata.update({
-                "model": "gpt-3.5-turbo",
+            self.lineage.update_node_metadata(response_id, {
+                "model": CHAT_MODEL,
                 "framework": "langchain",
-                "response_length": len(response.content)
+                "response_length": len(response)
             })
             
-            return response.content
+            return response
     
-    def chat(self, query: str, posts_limit: int = 3) -> str:
+    def chat(self, query: str, posts_limit: int = 3, stream: bool = False) -> Union[str, Iterator[str]]:
         """
         Main method to process a user query and generate a response.
         
         Args:
             query: User query about cryptocurrencies
             posts_limit: Maximum number of Reddit posts to retrieve
+            stream: Return the response as an iterator of text chunks
             
         Returns:
-            Generated response text
+            Generated response text, or an iterator of its chunks when streaming
         """
         logger.info(f"Processing query: {query}")
         
+        # Find the coin once and hand it to both retrievals
+        entity = _extract_crypto_entity(query)
+        
+        # The query embedding stays in the LRU cache, so retrieval does not
+        # request it again. Mock embeddings are all the same vector, so mock
+        # runs skip the response cache.
+        query_vector = None
+        if not MOCK_MODE:
+            try:
+                query_vector = np.asarray(self.embed_query(query), dtype=np.float32)
+                norm = np.sqrt(np.vdot(query_vector, query_vector))
+                if norm:
+                    query_vector = query_vector / norm
+            except Exception as e:
+                logger.warning(f"Could not embed query for the response cache: {e}")
+                query_vector = None
+        
+        # The market data lookup and the Reddit search (embedding API call plus
+        # vector query) are independent I/O, so run them at the same time
+        structured_future = _retrieval_executor.submit(self.retrieve_structured_data, query, entity)
+        reddit_future = _retrieval_executor.submit(self.retrieve_reddit_data_with_langchain, query, posts_limit, entity)
+        
         # Retrieve structured market data
-        structured_data = self.retrieve_structured_data(query)
+        structured_data = structured_future.result()
         
         # Retrieve relevant Reddit posts
-        reddit_docs = self.retrieve_reddit_data_with_langchain(query, posts_limit)
+        reddit_docs = reddit_future.result()
+        
+        # A cached answer is reused only if it was generated from this same
+        # context, which skips the LLM call
+        context_hash = None
+        if query_vector is not None:
+            try:
+                context_hash = SemanticResponseCache.context_hash("\0".join(_format_context(structured_data, reddit_docs)))
+                cached = self._response_cache.get(query, query_vector, entity, context_hash)
+                if cached is not None:
+                    logger.info("Answered from the semantic response cache")
+                    return iter([cached]) if stream else cached
+            except Exception as e:
+                logger.warning(f"Semantic response cache lookup failed: {e}")
+                context_hash = None
         
         # Generate response using LangChain
-        response = self.generate_response_with_langchain(query, structured_data, reddit_docs)
+        response = self.generate_response_with_langchain(query, structured_data, reddit_docs, stream=stream)
         
+        if context_hash is not None:
+            if stream:
+                return self._cache_stream(query, query_vector, entity, context_hash, response)
+            self._response_cache.put(query, query_vector, entity, context_hash, response)
         return response
+    
+    def _cache_stream(self, query: str, query_vector, entity: Optional[str], context_hash: bytes,
+                      chunks: Iterator[str]) -> Iterator[str]:
+        """Pass a streamed response through, caching it once it completes."""
+        generated = []
+        for chunk in chunks:
+            generated.append(chunk)
+            yield chunk
+        self._response_cache.put(query, query_vector, entity, context_hash, "".join(generated))
 
 def main():
     """Main function for running the enhanced RAG system from command line"""
@@ -648,13 +1372,18 @@ def main():
     # Initialize the RAG system
     rag_system = CryptoRAGSystem(mock_mode=args.mock)
     
-    # Get the chat response
-    response = rag_system.chat(args.query, posts_limit=args.posts)
-    
-    # Display the response
-    print("\n" + "="*50)
-    print(response)
-    print("="*50 + "\n")
+    try:
+        # Get the chat response
+        response = rag_system.chat(args.query, posts_limit=args.posts, stream=True)
+        
+        # Display the response as it streams in
+        print("\n" + "="*50)
+        for chunk in response:
+            print(chunk, end="", flush=True)
+        print()
+        print("="*50 + "\n")
+    finally:
+        rag_system.close()
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -0,0 +1,143 @@
+"""
+One-off migration of reddit_embeddings to the current vector search layout.
+
+This script will:
+1. Normalize stored vectors to unit length (rows written before the
+   inner-product index are raw) and drop the old cosine indexes
+2. Convert embedding_vector to halfvec(1536) (pgvector 0.7 or newer)
+3. Rebuild the inner-product HNSW index as a partial index over non-NULL vectors
+4. Build the binary-quantized HNSW index once the table reaches BINARY_RERANK_MIN_ROWS
+
+Every step commits on its own and is idempotent, so the script is safe
+to rerun. The UPDATE, the ALTER and the index builds lock
+or rewrite the whole table, so run it while improved_RAG.py is not serving.
+"""
+
+import argparse
+import logging
+import sys
+from pathlib import Path
+
+# Add the project root to Python path to ensure imports work
+project_root = Path(__file__).resolve().parent
+if str(project_root) not in sys.path:
+    sys.path.insert(0, str(project_root))
+
+import improved_RAG
+from improved_RAG import LEGACY_COSINE_INDEXES, _VECTOR_COLUMN_TYPE_SQL, _create_hnsw_index, configure_hnsw_params
+
+# Set up logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# From this many posts, searches shortlist candidates by Hamming distance
+# over binary-quantized vectors before the full inner-product rerank
+BINARY_RERANK_MIN_ROWS = 1_000_000
+
+def _create_binary_index(cursor, m, ef_construction):
+    """Build the Hamming-distance HNSW index over binary-quantized Reddit vectors."""
+    cursor.execute("SET LOCAL maintenance_work_mem = %s", (improved_RAG.HNSW_BUILD_WORK_MEM,))
+    cursor.execute("SET LOCAL max_parallel_maintenance_workers = %s", (improved_RAG.HNSW_BUILD_WORKERS,))
+    cursor.execute(f"""
+        CREATE INDEX IF NOT EXISTS idx_reddit_hnsw_bit ON reddit_embeddings
+        USING hnsw ((binary_quantize(embedding_vector)::bit(1536)) bit_hamming_ops)
+        WITH (m = {m}, ef_construction = {ef_construction})
+        WHERE embedding_vector IS NOT NULL
+    """)
+
+def _run_step(db_connection, description, step):
+    """Run one migration step in its own transaction.
+
+    Returns:
+        True if the step committed, False if it failed and was rolled back
+    """
+    logger.info(description)
+    try:
+        step(db_connection.cursor())
+        db_connection.commit()
+        return True
+    except Exception as e:
+        logger.warning(f"{description} failed: {e}")
+        db_connection.rollback()
+        return False
+
+def _drop_legacy_indexes(cursor):
+    """Drop the cosine indexes that predate the inner-product search."""
+    for index in LEGACY_COSINE_INDEXES:
+        cursor.execute(f"DROP INDEX IF EXISTS {index}")
+
+def _column_type(db_connection):
+    """Return the declared type of embedding_vector, e.g. 'halfvec(1536)', or None."""
+    cursor = db_connection.cursor()
+    cursor.execute(_VECTOR_COLUMN_TYPE_SQL)
+    row = cursor.fetchone()
+    db_connection.commit()
+    return row[0] if row else None
+
+def migrate_search_indexes(db_connection):
+    """Bring reddit_embeddings up to the layout improved_RAG.py searches."""
+    cursor = db_connection.cursor()
+    cursor.execute("SELECT count(*) FROM reddit_embeddings WHERE embedding_vector IS NOT NULL")
+    vector_count = cursor.fetchone()[0]
+    cursor.execute("SELECT indpred IS NULL FROM pg_index WHERE indexrelid = to_regclass('idx_reddit_hnsw_ip')")
+    row = cursor.fetchone()
+    unfiltered = bool(row and row[0])
+    db_connection.commit()
+    m, ef_construction, _ = configure_hnsw_params(vector_count)
+    logger.info(f"{vector_count} embedded posts; HNSW m={m}, ef_construction={ef_construction}")
+
+    def normalize(cursor):
+        cursor.execute("""
+            UPDATE reddit_embeddings SET embedding_vector = l2_normalize(embedding_vector)
+            WHERE embedding_vector IS NOT NULL
+        """)
+        _drop_legacy_indexes(cursor)
+    if not _run_step(db_connection, "Normalizing stored Reddit embeddings for inner-product search", normalize):
+        # An inner-product index over raw vectors would rank wrongly
+        return
+
+    column_type = _column_type(db_connection)
+    if not column_type:
+        logger.warning("reddit_embeddings has no embedding_vector column; nothing to migrate")
+        return
+    if column_type.startswith('vector'):
+        # halfvec halves the bytes of every index page and row fetched during
+        # the graph walk; older servers keep the vector column and its index
+        # Indexes with vector opclasses block the type change, so they are
+        # dropped in the same transaction as the ALTER
+        def convert(cursor):
+            _drop_legacy_indexes(cursor)
+            cursor.execute("DROP INDEX IF EXISTS idx_reddit_hnsw_ip")
+            cursor.execute("""
+                ALTER TABLE reddit_embeddings
+                ALTER COLUMN embedding_vector TYPE halfvec(1536) USING embedding_vector::halfvec(1536)
+            """)
+        if _run_step(db_connection, "Converting embedding_vector to halfvec", convert):
+            column_type = 'halfvec(1536)'
+
+    if unfiltered:
+        _run_step(db_connection, "Dropping the HNSW index that also covers NULL vectors",
+                  lambda cursor: cursor.execute("DROP INDEX IF EXISTS idx_reddit_hnsw_ip"))
+
+    opclass = 'halfvec_ip_ops' if column_type.startswith('halfvec') else 'vector_ip_ops'
+    _run_step(db_connection, "Building the inner-product HNSW index",
+              lambda cursor: _create_hnsw_index(cursor, opclass, m, ef_construction))
+
+    if vector_count >= BINARY_RERANK_MIN_ROWS:
+        _run_step(db_connection, "Building the binary-quantized HNSW index for the shortlist-and-rerank search",
+                  lambda cursor: _create_binary_index(cursor, m, ef_construction))
+
+    logger.info("Search index migration complete")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Migrate reddit_embeddings to the current vector search layout")
+    parser.parse_args()
+
+    conn = improved_RAG.get_db_connection()
+    try:
+        migrate_search_indexes(conn)
+    finally:
+        conn.close()
@@ -97,6 +97,9 @@ def generate_secure_vector(size):
     """
     return np.array([secrets.SystemRandom().random() for _ in range(size)])
 
+# Columns read from reddit_embeddings for each migrated post
+_SOURCE_COLUMNS = ("post_id", "title", "text", "score", "num_comments", "created_utc", "embedding")
+
 class MockCursor:
     """Mock database cursor for testing"""
     def __init__(self):
@@ -136,7 +139,7 @@ class MockCursor:
     
     def fetchall(self):
         logger.info("Mock fetching all results")
-        return self.mock_data
+        return [tuple(row[column] for column in _SOURCE_COLUMNS) for row in self.mock_data]
     
     def fetchmany(self, size):
         logger.info(f"Mock fetching {size} results")
@@ -145,7 +148,7 @@ class MockCursor:
         
         batch = self.mock_data[self.fetched:min(self.fetched + size, len(self.mock_data))]
         self.fetched += size
-        return batch
+        return [tuple(row[column] for column in _SOURCE_COLUMNS) for row in batch]
     
     def close(self):
         pass
@@ -155,7 +158,7 @@ class MockConnection:
     def __init__(self):
         pass
     
-    def cursor(self):
+    def cursor(self, name=None):
         return MockCursor()
     
     def commit(self):
@@ -181,13 +184,75 @@ class MockVectorStore:
         self.documents.extend(documents)
         logger.info(f"Added {len(documents)} documents to mock vector store")
         return self.documents
+    
+    def add_embeddings(self, texts, embeddings, metadatas=None):
+        self.documents.extend(Document(page_content=text, metadata=metadata) for text, metadata in zip(texts, metadatas))
+        logger.info(f"Added {len(texts)} precomputed embeddings to mock vector store")
+        return self.documents
+
+def fetch_existing_embeddings(conn, batch_size: int, include_embeddings: bool = True):
+    """Stream the posts in reddit_embeddings as batches of LangChain Documents.
+    
+    A named (server-side) cursor keeps the table on the server, so only one
+    batch of rows is transferred and held at a time.
+    
+    Args:
+        conn: Database connection
+        batch_size: Number of posts per batch
+        include_embeddings: Also read and parse each post's stored embedding
+    
+    Yields:
+        (documents, embeddings) where embeddings holds one float32 vector (or
+        None for posts without one) per document, or is None when
+        include_embeddings is False
+    """
+    columns = _SOURCE_COLUMNS if include_embeddings else _SOURCE_COLUMNS[:-1]
+    cursor = conn.cursor(name="reddit_stream")
+    cursor.itersize = batch_size
+    try:
+        cursor.execute(f"SELECT {', '.join(columns)} FROM reddit_embeddings")
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            # Reddit_scraper embeds only the post text, so page_content is
+            # exactly that text and the stored vectors match it; the title
+            # goes in metadata, where the prompt template reads it
+            documents = [
+                Document(
+                    page_content=text,
+                    metadata={
+                        "post_id": post_id,
+                        "title": title,
+                        "score": score,
+                        "num_comments": num_comments,
+                        "created_utc": created_utc,
+                        "source": "reddit"
+                    }
+                )
+                for post_id, title, text, score, num_comments, created_utc, *_ in rows
+            ]
+            embeddings = None
+            if include_embeddings:
+                # Each '[x, y, ...]' string is parsed in C, not with ast.literal_eval
+                embeddings = [
+                    np.fromstring(row[6].strip()[1:-1], sep=',', dtype=np.float32) if row[6] else None
+                    for row in rows
+                ]
+            yield documents, embeddings
+    finally:
+        cursor.close()
 
-def migrate_to_langchain(batch_size: int = 10, mock: bool = False):
+def migrate_to_langchain(batch_size: int = 10, mock: bool = False, reembed: bool = False):
     """Migrate existing Reddit embeddings to LangChain PGVector format.
     
+    The embeddings already stored in reddit_embeddings are copied across
+    as they are, so only posts without one are sent to the embedding model.
+    
     Args:
         batch_size: Number of documents to process at once
         mock: Whether to run in mock mode without real API calls
+        reembed: Embed every document again, e.g. after changing the embedding model
     """
     # Check for CI environment
     if 'CI' in os.environ:
@@ -219,15 +284,7 @@ def migrate_to_langchain(batch_size: int = 10, mock: bool = False):
             logger.info("Falling back to mock database connection")
             conn = MockConnection()
     
-    cursor = conn.cursor()
-    
     try:
-        # Fetch existing Reddit embeddings
-        cursor.execute("""
-            SELECT post_id, title, text, embedding, score, num_comments, created_utc
-            FROM reddit_embeddings
-        """)
-        
         # Set up LangChain components
         CONNECTION_STRING = f"postgresql+psycopg2://{os.getenv('DB_USER', 'postgres')}:{os.getenv('DB_PASSWORD', 'postgres')}@{os.getenv('DB_HOST', 'localhost')}:{os.getenv('DB_PORT', '5432')}/{os.getenv('DB_NAME', 'crypto_data')}"
         COLLECTION_NAME = "reddit_posts"
@@ -256,91 +313,46 @@ def migrate_to_langchain(batch_size: int = 10, mock: bool = False):
                 embeddings = MockEmbeddings()
                 vector_store = MockVectorStore()
         
-        # Process in batches
-        if MOCK_MODE:
-            # Use mock cursor for batch fetching
-            all_docs = 0
-            batch_num = 0
-            
-            while True:
-                batch = cursor.fetchmany(batch_size)
-                if not batch:
-                    break
-                
-                batch_num += 1
-                logger.info(f"Processing batch {batch_num} with {len(batch)} documents")
-                
-                # Convert to LangChain documents
-                documents = []
-                for row in batch:
-                    post_id, title, text, embedding_str, score, num_comments, created_utc = row
-                    
-                    # Create a document with metadata
-                    doc = Document(
-                        page_content=f"{title}\n\n{text}",
-                        metadata={
-                            "post_id": post_id,
-                            "score": score,
-                            "num_comments": num_comments,
-                            "created_utc": created_utc,
-                            "source": "reddit"
-                        }
-                    )
-                    documents.append(doc)
-                
-                # Add to vector store
-                vector_store.add_documents(documents)
-                all_docs += len(documents)
+        # Stream the posts in batches instead of loading the whole table
+        all_docs = reused = 0
+        batches = fetch_existing_embeddings(conn, batch_size, include_embeddings=not reembed)
+        for batch_num, (documents, vectors) in enumerate(batches, 1):
+            logger.info(f"Processing batch {batch_num} with {len(documents)} documents")
             
-            logger.info(f"Migration complete. {all_docs} documents migrated to LangChain PGVector.")
-        else:
-            # Fetch all at once for real database connection
-            all_rows = cursor.fetchall()
-            logger.info(f"Fetched {len(all_rows)} documents from reddit_embeddings table")
-            
-            # Process in batches
-            for i in range(0, len(all_rows), batch_size):
-                batch = all_rows[i:i+batch_size]
-                logger.info(f"Processing batch {i//batch_size + 1} with {len(batch)} documents")
-                
-                # Convert to LangChain documents
-                documents = []
-                for row in batch:
-                    post_id, title, text, embedding_str, score, num_comments, created_utc = row
-                    
-                    # Create a document with metadata
-                    doc = Document(
-                        page_content=f"{title}\n\n{text}",
-                        metadata={
-                            "post_id": post_id,
-                            "score": score,
-                            "num_comments": num_comments,
-                            "created_utc": created_utc,
-                            "source": "reddit"
-                        }
-                    )
-                    documents.append(doc)
-                
-                # Add to vector store
-                vector_store.add_documents(documents)
+            # Copy stored embeddings across instead of calling the embedding API
+            stored = [(doc, vector) for doc, vector in zip(documents, vectors or []) if vector is not None]
+            if stored:
+                vector_store.add_embeddings(
+                    texts=[doc.page_content for doc, _ in stored],
+                    embeddings=[vector.tolist() for _, vector in stored],
+                    metadatas=[doc.metadata for doc, _ in stored]
+                )
+                reused += len(stored)
             
-            logger.info(f"Migration complete. {len(all_rows)} documents migrated to LangChain PGVector.")
+            # Embed the rest through the vector store
+            missing = documents if vectors is None else [doc for doc, vector in zip(documents, vectors) if vector is None]
+            if missing:
+                vector_store.add_documents(missing)
+            all_docs += len(documents)
+        
+        logger.info(f"Migration complete. {all_docs} documents migrated to LangChain PGVector "
+                    f"({reused} with their stored embeddings).")
     
     except Exception as e:
         logger.error(f"Error during migration: {e}")
         logger.info("Migration completed with errors")
     
     finally:
-        cursor.close()
         conn.close()
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Migrate Reddit embeddings to LangChain PGVector format")
     parser.add_argument("--batch-size", type=int, default=10, help="Number of documents to process at once")
     parser.add_argument("--mock", action="store_true", help="Run in mock mode without real API calls")
+    parser.add_argument("--reembed", action="store_true", help="Embed every document again instead of reusing stored embeddings")
     args = parser.parse_args()
     
     # Force mock mode in CI environment
     mock_mode = args.mock or 'CI' in os.environ
     
-    migrate_to_langchain(batch_size=args.batch_size, mock=mock_mode) 
\ No newline at end of file
+    migrate_to_langchain(batch_size=args.batch_size, mock=mock_mode, reembed=args.reembed) 
\ No newline at end of file
@@ -0,0 +1,430 @@
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import unittest
+
+import data_lineage
+from data_lineage import DataLineage, LineageContext, MemoryLineage, NullLineage
+
+def assert_nested_edge_metadata_is_private(test, lineage):
+    """Shared check for both trackers: edge metadata reads never alias each other."""
+    source_id = lineage.add_node("source", "Source", "source node")
+    target_id = lineage.add_node("dataset", "Target", "target node")
+    lineage.add_edge(source_id, target_id, "load", {"columns": ["a"], "stats": {"rows": 1}})
+
+    edge = lineage.get_edges(source_id)[0]
+    edge["metadata"]["columns"].append("b")
+    edge["metadata"]["stats"]["rows"] = 2
+
+    expected = {"columns": ["a"], "stats": {"rows": 1}}
+    test.assertEqual(lineage.get_edges(source_id)[0]["metadata"], expected)
+    test.assertEqual(lineage.get_outgoing_edges(source_id)[0]["metadata"], expected)
+    test.assertEqual(lineage.get_incoming_edges(target_id)[0]["metadata"], expected)
+
+def assert_metadata_updates_match_dict_update(test, lineage):
+    """Shared check for both trackers: update_node_metadata behaves like dict.update."""
+    metadata = {"query": "btc", "stats": {"rows": 1, "cols": 2}}
+    node_id = lineage.add_node("dataset", "Results", "results node", metadata)
+    updates = [{"rows": 5}, {"rows": 6, "method": "pgvector"}, {"first_protocol": None, "stats": {"rows": 3}}]
+    for update in updates:
+        lineage.update_node_metadata(node_id, update)
+        metadata.update(update)
+
+    test.assertEqual(lineage.get_node(node_id).metadata, metadata)
+    test.assertIsNone(lineage.get_node(node_id).metadata["first_protocol"])
+
+class TestDataLineage(unittest.TestCase):
+    def setUp(self):
+        """Create a tracker backed by a fresh database file."""
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp_dir.name, "lineage.db")
+        self.lineage = DataLineage(db_path=self.db_path)
+        # Route LineageContext through this tracker instead of lineage.db
+        self._saved_tracker = data_lineage._lineage_tracker
+        data_lineage._lineage_tracker = self.lineage
+
+    def tearDown(self):
+        self.lineage.close()
+        data_lineage._lineage_tracker = self._saved_tracker
+        self.tmp_dir.cleanup()
+
+    def test_add_and_get_node(self):
+        """Test that a queued node is visible to a subsequent read."""
+        node_id = self.lineage.add_node(
+            node_type="source",
+            name="DeFi Llama API",
+            description="TVL data",
+            metadata={"url": "https://defillama.com"}
+        )
+
+        node = self.lineage.get_node(node_id)
+        self.assertIsNotNone(node)
+        self.assertEqual(node.name, "DeFi Llama API")
+        self.assertEqual(node.metadata, {"url": "https://defillama.com"})
+
+    def test_add_edge(self):
+        """Test that edges are returned for both endpoints."""
+        source_id = self.lineage.add_node("source", "Source", "source node")
+        target_id = self.lineage.add_node("dataset", "Target", "target node")
+        self.lineage.add_edge(source_id, target_id, "extract", {"rows": 10})
+
+        for node_id in (source_id, target_id):
+            edges = self.lineage.get_edges(node_id)
+            self.assertEqual(len(edges), 1)
+            self.assertEqual(edges[0]["operation"], "extract")
+            self.assertEqual(edges[0]["metadata"], {"rows": 10})
+
+        self.assertEqual(len(self.lineage.get_outgoing_edges(source_id)), 1)
+        self.assertEqual(self.lineage.get_outgoing_edges(target_id), [])
+        self.assertEqual(self.lineage.get_incoming_edges(target_id)[0]["source_id"], source_id)
+
+    def test_duplicate_edge_is_ignored(self):
+        """Test that re-adding an edge keeps the original one."""
+        source_id = self.lineage.add_node("source", "Source", "source node")
+        target_id = self.lineage.add_node("dataset", "Target", "target node")
+        edge_id = self.lineage.add_edge(source_id, target_id, "extract", {"run": 1})
+        self.lineage.add_edge(source_id, target_id, "extract", {"run": 2})
+        self.lineage.add_edge(source_id, target_id, "transform")
+
+        edges = self.lineage.get_edges(target_id)
+        self.assertEqual(len(edges), 2)
+        extract = next(edge for edge in edges if edge["operation"] == "extract")
+        self.assertEqual(extract["id"], edge_id)
+        self.assertEqual(extract["metadata"], {"run": 1})
+
+    def test_add_edges_fan_in(self):
+        """Test that a fan-in batch creates one edge per source."""
+        source_ids = [self.lineage.add_node("source", f"Source {i}", "source node") for i in range(3)]
+        target_id = self.lineage.add_node("dataset", "Target", "target node")
+
+        edge_ids = self.lineage.add_edges(source_ids, target_id, "combine", {"step": 1})
+
+        self.assertEqual(len(edge_ids), 3)
+        edges = self.lineage.get_edges(target_id)
+        self.assertEqual(sorted(edge["source_id"] for edge in edges), sorted(source_ids))
+        self.assertTrue(all(edge["metadata"] == {"step": 1} for edge in edges))
+        # Each edge gets its own decoded dict, so the result serializes and
+        # changing one edge's metadata leaves the others alone
+        json.dumps(edges)
+        edges[0]["metadata"]["step"] = 2
+        self.assertEqual(edges[1]["metadata"], {"step": 1})
+        self.assertEqual(self.lineage.get_edges(target_id)[0]["metadata"], {"step": 1})
+
+    def test_edge_metadata_is_not_shared(self):
+        """Test that nested edge metadata changed by a caller is not seen by later reads."""
+        assert_nested_edge_metadata_is_private(self, self.lineage)
+
+    def test_bulk_inserts(self):
+        """Test that bulk-added nodes and edges are all persisted."""
+        node_ids = self.lineage.add_nodes_bulk([
+            {"node_type": "source", "name": "Reddit API", "metadata": {"subreddit": "cryptocurrency"}},
+            {"node_type": "dataset", "name": "Reddit Posts", "description": "raw posts"},
+        ])
+        # Generators are accepted as well as lists
+        edge_ids = self.lineage.add_edges_bulk(
+            {"source_id": source_id, "target_id": node_ids[1], "operation": "extract"}
+            for source_id in node_ids[:1]
+        )
+
+        self.assertEqual(len(edge_ids), 1)
+        self.assertEqual(self.lineage.get_node(node_ids[0]).metadata, {"subreddit": "cryptocurrency"})
+        self.assertEqual(self.lineage.get_node(node_ids[1]).description, "raw posts")
+        self.assertIsNotNone(self.lineage.get_node(node_ids[0]).created_at)
+        self.assertEqual(self.lineage.get_node(node_ids[0]).created_at, self.lineage.get_node(node_ids[1]).created_at)
+        self.assertEqual(self.lineage.get_edges(node_ids[1])[0]["source_id"], node_ids[0])
+
+    def test_concurrent_writers(self):
+        """Test that nodes written from several threads are all persisted."""
+        node_ids = []
+        lock = threading.Lock()
+
+        def worker(worker_id):
+            for i in range(50):
+                node_id = self.lineage.add_node("dataset", f"node-{worker_id}-{i}", "threaded")
+                with lock:
+                    node_ids.append(node_id)
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(node_ids), 200)
+        for node_id in node_ids:
+            self.assertIsNotNone(self.lineage.get_node(node_id))
+
+    def test_concurrent_readers_share_bounded_pool(self):
+        """Test that reads from many threads reuse at most read_pool_size connections."""
+        node_id = self.lineage.add_node("source", "Source", "source node")
+        results = []
+
+        def reader():
+            for _ in range(20):
+                results.append(self.lineage.get_node(node_id) is not None)
+
+        threads = [threading.Thread(target=reader) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(results), 160)
+        self.assertTrue(all(results))
+        self.assertLessEqual(self.lineage._read_conn_count, self.lineage.read_pool_size)
+
+    def test_synchronous_writes(self):
+        """Test that async_writes=False commits before the call returns."""
+        self.lineage.close()
+        self.lineage = DataLineage(db_path=self.db_path, async_writes=False)
+        self.assertIsNone(self.lineage.writer_thread)
+
+        node_id = self.lineage.add_node("source", "Source", "source node")
+
+        conn = sqlite3.connect(self.db_path)
+        try:
+            row = conn.execute("SELECT name FROM nodes WHERE id = ?", (node_id,)).fetchone()
+        finally:
+            conn.close()
+        self.assertEqual(row, ("Source",))
+
+        # The stored edge's id comes back for duplicates
+        target_id = self.lineage.add_node("dataset", "Target", "target node")
+        edge_id = self.lineage.add_edge(node_id, target_id, "extract")
+        self.assertEqual(self.lineage.add_edge(node_id, target_id, "extract"), edge_id)
+        self.assertEqual(len(self.lineage.get_edges(target_id)), 1)
+
+    def test_update_node_metadata_merges(self):
+        """Test that queued metadata updates are merged like dict.update."""
+        assert_metadata_updates_match_dict_update(self, self.lineage)
+
+    def test_non_finite_metadata_is_stored_as_null(self):
+        """Test that NaN and infinities round-trip as null through writes, patches and export."""
+        node_id = self.lineage.add_node("dataset", "Prices", "prices", {"price": float("nan"), "rows": 1})
+        self.lineage.update_node_metadata(node_id, {"changes": [float("inf"), 2.5]})
+        expected = {"price": None, "rows": 1, "changes": [None, 2.5]}
+        self.assertEqual(self.lineage.get_node(node_id).metadata, expected)
+
+        output_file = os.path.join(self.tmp_dir.name, "lineage.json")
+        self.lineage.export_json(output_file=output_file)
+        with open(output_file) as f:
+            data = json.load(f)
+        self.assertEqual(data["nodes"][0]["metadata"], expected)
+
+    def test_bad_write_only_discards_itself(self):
+        """Test that a write SQLite cannot bind neither kills the writer nor drops its batch."""
+        good_ids = self.lineage.add_nodes_bulk([{"node_type": "source", "name": "Good"}] * 3)
+        bad_id = self.lineage.add_node(2 ** 70, "Bad", "out-of-range node_type")
+        late_id = self.lineage.add_node("source", "Late", "queued after the bad write")
+
+        self.assertIsNone(self.lineage.get_node(bad_id))
+        for node_id in good_ids + [late_id]:
+            self.assertIsNotNone(self.lineage.get_node(node_id))
+
+    def test_close_commits_pending_writes(self):
+        """Test that close() persists queued writes and rejects new ones."""
+        node_id = self.lineage.add_node("source", "Source", "source node")
+        self.assertIn(self.lineage, data_lineage._async_trackers)
+        self.lineage.close()
+        # The shared exit hook no longer holds on to a closed tracker
+        self.assertNotIn(self.lineage, data_lineage._async_trackers)
+
+        reopened = DataLineage(db_path=self.db_path)
+        try:
+            self.assertIsNotNone(reopened.get_node(node_id))
+        finally:
+            reopened.close()
+
+        with self.assertRaises(sqlite3.ProgrammingError):
+            self.lineage.add_node("source", "Late", "written after close")
+
+    def test_lineage_context_records_error(self):
+        """Test that an exception inside the context is stored on the target node."""
+        source_id = self.lineage.add_node("source", "Source", "source node")
+        context = LineageContext(
+            source_nodes=[source_id],
+            operation="transform",
+            target_name="Target",
+            target_description="target node"
+        )
+
+        with self.assertRaises(ValueError):
+            with context as target_id:
+                raise ValueError("boom")
+
+        node = self.lineage.get_node(target_id)
+        self.assertEqual(node.metadata["error"]["error_type"], "ValueError")
+        self.assertEqual(len(self.lineage.get_edges(target_id)), 1)
+
+    def test_export_json(self):
+        """Test that the exported file contains every node and edge."""
+        source_id = self.lineage.add_node("source", "Source", "source node")
+        target_id = self.lineage.add_node("dataset", "Target", "target node")
+        self.lineage.add_edge(source_id, target_id, "load")
+
+        output_file = os.path.join(self.tmp_dir.name, "lineage.json")
+        self.lineage.export_json(output_file=output_file)
+
+        with open(output_file) as f:
+            data = json.load(f)
+        self.assertEqual(len(data["nodes"]), 2)
+        self.assertEqual(len(data["edges"]), 1)
+        self.assertEqual(data["edges"][0]["source_id"], source_id)
+        self.assertEqual(data["edges"][0]["metadata"], {})
+
+    def test_visualize_html_without_graph_libraries(self):
+        """Test that .html output embeds the graph as vis.js data."""
+        source_id = self.lineage.add_node("source", "Source</script>", "source node")
+        target_id = self.lineage.add_node("dataset", "Target", "target node")
+        self.lineage.add_edge(source_id, target_id, "load")
+
+        output_file = os.path.join(self.tmp_dir.name, "lineage.html")
+        self.lineage.visualize(output_file=output_file)
+
+        with open(output_file) as f:
+            html = f.read()
+        nodes = json.loads(html.split("new vis.DataSet(")[1].split(");")[0])
+        edges = json.loads(html.split("new vis.DataSet(")[2].split(");")[0])
+        self.assertEqual({node["label"] for node in nodes}, {"Source</script>", "Target"})
+        self.assertEqual(edges, [{"from": source_id, "to": target_id, "label": "load"}])
+        self.assertNotIn("Source</script>", html)
+
+    def test_export_json_skips_unchanged_graph(self):
+        """Test that export_json only rewrites the file after the graph changes."""
+        self.lineage.add_node("source", "Source", "source node")
+        output_file = os.path.join(self.tmp_dir.name, "lineage.json")
+        self.lineage.export_json(output_file=output_file)
+
+        with open(output_file, 'w') as f:
+            f.write("stale")
+        self.lineage.export_json(output_file=output_file)
+        with open(output_file) as f:
+            self.assertEqual(f.read(), "stale")
+
+        self.lineage.add_node("dataset", "Target", "target node")
+        self.lineage.export_json(output_file=output_file)
+        with open(output_file) as f:
+            self.assertEqual(len(json.load(f)["nodes"]), 2)
+
+class TestNewId(unittest.TestCase):
+    @unittest.skipUnless(hasattr(os, "fork"), "requires os.fork")
+    def test_forked_child_gets_distinct_ids(self):
+        """Test that a forked process does not repeat its parent's ids."""
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            os.write(write_fd, data_lineage._new_id().encode())
+            os._exit(0)
+        os.close(write_fd)
+        parent_id = data_lineage._new_id()
+        with os.fdopen(read_fd) as f:
+            child_id = f.read()
+        os.waitpid(pid, 0)
+        self.assertNotEqual(child_id[:16], parent_id[:16])
+
+class TestMemoryLineage(unittest.TestCase):
+    def setUp(self):
+        """Create an in-memory tracker and a directory for persisted output."""
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.lineage = MemoryLineage()
+
+    def tearDown(self):
+        self.lineage.close()
+        self.tmp_dir.cleanup()
+
+    def test_add_and_get(self):
+        """Test nodes, duplicate edges and adjacency lookups without SQLite."""
+        source_id = self.lineage.add_node("source", "Source", "source node", {"url": "x"})
+        target_id = self.lineage.add_node("dataset", "Target", "target node")
+        edge_id = self.lineage.add_edge(source_id, target_id, "extract")
+        self.assertEqual(self.lineage.add_edge(source_id, target_id, "extract"), edge_id)
+        self.lineage.update_node_metadata(target_id, {"rows": 5})
+
+        self.assertEqual(self.lineage.get_node(source_id).metadata, {"url": "x"})
+        self.assertEqual(self.lineage.get_node(target_id).metadata, {"rows": 5})
+        self.assertEqual(len(self.lineage.get_edges(source_id)), 1)
+        self.assertEqual(self.lineage.get_incoming_edges(target_id)[0]["source_id"], source_id)
+        self.assertEqual(self.lineage.get_outgoing_edges(target_id), [])
+
+    def test_edge_metadata_is_not_shared(self):
+        """Test that nested edge metadata changed by a caller is not seen by later reads."""
+        assert_nested_edge_metadata_is_private(self, self.lineage)
+
+    def test_update_node_metadata_merges(self):
+        """Test that metadata updates are merged like dict.update, as in DataLineage."""
+        assert_metadata_updates_match_dict_update(self, self.lineage)
+
+    def test_persist_matches_sqlite_tracker(self):
+        """Test that a persisted graph reads back through DataLineage."""
+        node_ids = self.lineage.add_nodes_bulk([
+            {"node_type": "source", "name": "Source"},
+            {"node_type": "dataset", "name": "Target", "metadata": {"rows": 5}},
+        ])
+        self.lineage.add_edges(node_ids[:1], node_ids[1], "load", {"step": 1})
+
+        db_path = os.path.join(self.tmp_dir.name, "lineage.db")
+        self.lineage.persist(db_path)
+
+        reopened = DataLineage(db_path=db_path)
+        try:
+            self.assertEqual(reopened.get_node(node_ids[1]).metadata, {"rows": 5})
+            self.assertEqual(reopened.get_edges(node_ids[1]), self.lineage.get_edges(node_ids[1]))
+            json.dumps(self.lineage.get_edges(node_ids[1]))
+        finally:
+            reopened.close()
+
+    def test_export_json(self):
+        """Test that the in-memory export has the same shape as the SQLite one."""
+        source_id = self.lineage.add_node("source", "Source", "source node")
+        target_id = self.lineage.add_node("dataset", "Target", "target node")
+        self.lineage.add_edge(source_id, target_id, "load")
+
+        output_file = os.path.join(self.tmp_dir.name, "lineage.json")
+        self.lineage.export_json(output_file=output_file)
+
+        with open(output_file) as f:
+            data = json.load(f)
+        self.assertEqual(len(data["nodes"]), 2)
+        self.assertEqual(data["edges"][0]["source_id"], source_id)
+        self.assertEqual(data["edges"][0]["metadata"], {})
+
+class TestNullLineage(unittest.TestCase):
+    def setUp(self):
+        """Route LineageContext through a tracker that records nothing."""
+        self._saved_tracker = data_lineage._lineage_tracker
+        data_lineage._lineage_tracker = NullLineage()
+
+    def tearDown(self):
+        data_lineage._lineage_tracker = self._saved_tracker
+
+    def test_callers_run_without_recording(self):
+        """Test that the usual annotate-the-result pattern works and stores nothing."""
+        lineage = data_lineage.get_lineage_tracker()
+        source_id = lineage.add_node("source", "Source", "source node")
+        with LineageContext(source_id, "retrieve", "Results", "results") as results_id:
+            lineage.get_node(results_id).metadata.update({"rows": 5})
+        self.assertEqual(lineage.get_node(results_id).metadata, {})
+        self.assertEqual(lineage.get_edges(source_id), [])
+
+    def test_disable_lineage(self):
+        """Test that mock runs switch to NullLineage unless LINEAGE_DISABLED=0."""
+        saved_env = os.environ.pop("LINEAGE_DISABLED", None)
+        try:
+            data_lineage._lineage_tracker = None
+            self.assertIsInstance(data_lineage.disable_lineage(), NullLineage)
+            self.assertIsInstance(data_lineage.get_lineage_tracker(), NullLineage)
+            
+            tracker = MemoryLineage()
+            data_lineage._lineage_tracker = tracker
+            os.environ["LINEAGE_DISABLED"] = "0"
+            self.assertIs(data_lineage.disable_lineage(), tracker)
+        finally:
+            os.environ.pop("LINEAGE_DISABLED", None)
+            if saved_env is not None:
+                os.environ["LINEAGE_DISABLED"] = saved_env
+
+if __name__ == '__main__':
+    unittest.main()